@@ -0,0 +1,134 @@
+"""
+Benchmark: memory used by trajectory points when loading an experiment.
+
+Creates a synthetic multi-subject experiment (raw recorder results + encoded results per subject), and loads it with
+encoder.dataio.load_experiment and recorder.results.load_experiment. Each measurement runs in a separate process,
+once with the current (__slots__-based) point classes and once with equivalent classes that have a per-instance
+__dict__ (as in older versions), and reports the peak RSS and the number of live allocations after loading.
+The allocations are counted with tracemalloc in a separate run, so they don't affect the RSS measurement.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+
+n_subjects = 4
+n_trials_per_subject = 50
+n_points_per_stroke = 150
+n_strokes_per_trial = 8
+
+
+#----------------------------------------------------------------------------
+class DictTrajectoryPoint(object):
+    """ TrajectoryPoint, as defined before it used __slots__ """
+
+    def __init__(self, x, y, z, t):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.t = t
+
+
+#----------------------------------------------------------------------------
+def create_experiment(root_dir):
+    """ Create raw + encoded data for several subjects. Return the list of (raw_dir, encoded_dir) """
+    from writracker.encoder import dataio
+
+    dirs = []
+    for subj in range(n_subjects):
+        raw_dir = os.path.join(root_dir, 'subj{}'.format(subj + 1), 'raw')
+        enc_dir = os.path.join(root_dir, 'subj{}'.format(subj + 1), 'encoded')
+        os.makedirs(raw_dir)
+        os.makedirs(enc_dir)
+
+        with open(raw_dir + os.sep + 'trials.csv', 'w') as raw_index, open(enc_dir + os.sep + 'trials.csv', 'w') as enc_index, \
+                open(enc_dir + os.sep + 'strokes.csv', 'w') as strokes:
+            raw_index.write('trial_id,target_id,target,rc,time_in_session,date,time_in_day,traj_file_name,sound_file_length\n')
+            enc_index.write(','.join(dataio.trials_index_cols) + '\n')
+            strokes.write(','.join(dataio.strokes_cols) + '\n')
+
+            for trial_id in range(1, n_trials_per_subject + 1):
+                traj_fn = 'trajectory_{}.csv'.format(trial_id)
+                raw_index.write('{0},{0},abcd,OK,{1},01/01/2024,10:00:00,{2},0\n'.format(trial_id, trial_id * 10, traj_fn))
+                enc_index.write('{0},{0},1,abcd,abcd,{1},OK,0,{2},10:00:00,01/01/2024,0\n'.format(trial_id, trial_id * 10, traj_fn))
+
+                with open(raw_dir + os.sep + traj_fn, 'w') as raw_traj, open(enc_dir + os.sep + traj_fn, 'w') as enc_traj:
+                    raw_traj.write('x,y,pressure,time\n')
+                    enc_traj.write('char_num,stroke,pen_down,x,y,pressure,time\n')
+                    for stroke_num in range(1, n_strokes_per_trial + 1):
+                        on_paper = stroke_num % 2
+                        char_num = (stroke_num + 1) // 2 if on_paper else 0
+                        strokes.write('{},1,{},{},{}\n'.format(trial_id, char_num, stroke_num, on_paper))
+                        for i in range(n_points_per_stroke):
+                            x, y = 100 + stroke_num * 50 + i % 40, 300 + (i * 7) % 60
+                            pressure = 20 + i % 60 if on_paper else 0
+                            t = ((stroke_num - 1) * n_points_per_stroke + i) * 0.005
+                            raw_traj.write('{},{},{},{:.4f}\n'.format(x, y, pressure, t))
+                            enc_traj.write('{},{},{},{},{},{},{:.3f}\n'.format(char_num, stroke_num, on_paper, x, y, pressure, t))
+
+        dirs.append((raw_dir, enc_dir))
+
+    return dirs
+
+
+#----------------------------------------------------------------------------
+def measure(root_dir, point_class, what):
+    """
+    Load the experiment (in this process) and print either the peak RSS (KB) or the number of live allocations
+    and allocated bytes
+    """
+    from writracker import commonio
+    from writracker.encoder import dataio as enc_dataio
+    from writracker.recorder import results
+
+    if point_class == 'dict':
+        commonio.TrajectoryPoint = DictTrajectoryPoint
+
+    subj_dirs = sorted(os.path.join(root_dir, d) for d in os.listdir(root_dir))
+
+    if what == 'allocations':
+        tracemalloc.start()
+
+    data = []
+    for subj_dir in subj_dirs:
+        data.append(results.load_experiment(subj_dir + os.sep + 'raw'))
+        data.append(enc_dataio.load_experiment(subj_dir + os.sep + 'encoded'))
+
+    if what == 'allocations':
+        stats = tracemalloc.take_snapshot().statistics('filename')
+        tracemalloc.stop()
+        print(sum(stat.count for stat in stats), sum(stat.size for stat in stats))
+    else:
+        print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+#----------------------------------------------------------------------------
+def run():
+    with tempfile.TemporaryDirectory() as root_dir:
+        create_experiment(root_dir)
+
+        n_points = 2 * n_subjects * n_trials_per_subject * n_strokes_per_trial * n_points_per_stroke
+        print('Loading {} subjects (raw + encoded), {} points in total'.format(n_subjects, n_points))
+
+        results = {}
+        for point_class in 'dict', 'slots':
+            results[point_class] = []
+            for what, n_values in ('rss', 1), ('allocations', 2):
+                out = subprocess.check_output([sys.executable, __file__, 'measure', root_dir, point_class, what], text=True)
+                results[point_class].extend(int(v) for v in out.split()[-n_values:])
+
+        for name, ind in ('Peak RSS (MB)', 0), ('Live allocations', 1), ('Allocated (MB)', 2):
+            scale = 1024 if ind == 0 else (1024 * 1024 if ind == 2 else 1)
+            old = results['dict'][ind] / scale
+            new = results['slots'][ind] / scale
+            print('   {:18} __dict__: {:12,.1f}   __slots__: {:12,.1f}   change: {:6.1f}%'.format(name, old, new, 100 * (new - old) / old))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'measure':
+        measure(sys.argv[2], sys.argv[3], sys.argv[4])
+    else:
+        run()
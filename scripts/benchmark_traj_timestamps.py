@@ -0,0 +1,69 @@
+"""
+Benchmark: the per-sample cost of computing trajectory time stamps in the recorder.
+
+Compares the old method (format datetime.now() as "%M:%S:%f" and parse it back with strptime) with the
+monotonic clock used by recorder.dataio.Trajectory. The samples come from synthetic packet streams
+(bursts of up to 100 packets, as returned by wintab).
+"""
+import time
+from datetime import datetime
+
+import numpy as np
+
+from writracker.recorder import dataio
+
+
+n_packets = 100000
+burst_size = 100
+
+
+#----------------------------------------------------------------------------
+class LegacyTimestamps(object):
+    """ The time stamps, as computed by older versions of Trajectory.add_row() """
+
+    def __init__(self):
+        self.start_time = datetime.now().strftime("%M:%S:%f")[:-2]
+
+    def sample_time(self):
+        time_abs = datetime.now().strftime("%M:%S:%f")[:-2]
+        time_relative = datetime.strptime(time_abs, "%M:%S:%f") - datetime.strptime(self.start_time, "%M:%S:%f")
+        return time_relative.total_seconds()
+
+
+#----------------------------------------------------------------------------
+def synthetic_packet_stream(n, seed=0):
+    """ Random-walk pen positions and pressures, split into bursts like those returned by wintab.GetPackets() """
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.integers(-3, 4, n)) + 1000
+    y = np.cumsum(rng.integers(-3, 4, n)) + 700
+    pressure = rng.integers(0, 100, n)
+    packets = list(zip(x.tolist(), y.tolist(), pressure.tolist()))
+    return [packets[i:i+burst_size] for i in range(0, n, burst_size)]
+
+
+#----------------------------------------------------------------------------
+def time_per_sample(timestamps, bursts):
+    rows = []
+    t0 = time.perf_counter()
+    for burst in bursts:
+        for x, y, pressure in burst:
+            rows.append((x, y, pressure, timestamps.sample_time()))
+    elapsed = time.perf_counter() - t0
+    return elapsed / len(rows)
+
+
+#----------------------------------------------------------------------------
+def run():
+    bursts = synthetic_packet_stream(n_packets)
+
+    legacy = time_per_sample(LegacyTimestamps(), bursts)
+    current = time_per_sample(dataio.Trajectory('unused.csv', '.'), bursts)
+
+    print(f'Per-sample time stamp cost over {n_packets} synthetic packets:')
+    print(f'   datetime/strptime (old):  {legacy * 1e6:8.2f} us')
+    print(f'   monotonic clock (new):    {current * 1e6:8.2f} us')
+    print(f'   speedup:                  {legacy / current:8.1f}x')
+
+
+if __name__ == '__main__':
+    run()
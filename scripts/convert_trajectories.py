@@ -0,0 +1,14 @@
+#
+# Create binary versions of the trajectory files in encoded-data directories.
+# The binary files are loaded instead of the CSV files, which is much faster.
+#
+
+from writracker.encoder.dataio import convert_trajectories_to_binary
+
+#-- List of directories that contain encoded (or recorded) data
+dirs = [r'/Users/dror/data/acad-proj/2-InProgress/WriTracker/encoded']
+
+
+for dir_name in dirs:
+    n = convert_trajectories_to_binary(dir_name)
+    print('{}: converted {} trajectory files'.format(dir_name, n))
@@ -1,5 +1,6 @@
 """
-Re-create the character.csv files of the given sessions
+Re-create the character.csv files of the given sessions.
+Only trials that changed since the last run are re-computed; use incremental=False to re-create the files from scratch.
 """
 import os
 import glob
@@ -14,4 +15,6 @@ for dir_name in dirnames:
 
     print(f'Processing {dir_name}...')
 
-    writracker.encoder.dataio.save_characters_file(dir_name)
+    n_updated = writracker.encoder.dataio.save_characters_file(dir_name)
+    if n_updated > 0:
+        print(f'   {n_updated} trials were updated')
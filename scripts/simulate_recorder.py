@@ -0,0 +1,28 @@
+"""
+Drive the recorder headlessly (no tablet, no display) and report dropped packets and end-to-end latency.
+
+Usage: python simulate_recorder.py [trajectory_file.csv ...]
+Without arguments, synthetic handwriting is used.
+"""
+import sys
+import tempfile
+
+from writracker.recorder import packetsource, simulator
+
+
+#-- Replay speed: 1 = real time
+speed = 4.0
+
+#-- Tablet polling interval (ms); None = the recorder's default
+poll_time = None
+
+
+if len(sys.argv) > 1:
+    source = packetsource.TrajectoryFileReplaySource(sys.argv[1:], speed=speed)
+else:
+    source = packetsource.SyntheticHandwritingSource(n_strokes=20, speed=speed)
+
+with tempfile.TemporaryDirectory() as results_folder:
+    results = simulator.run_headless(source, results_folder=results_folder, poll_time=poll_time)
+
+print(results.summary())
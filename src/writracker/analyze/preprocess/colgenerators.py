@@ -6,7 +6,6 @@ import math
 import numpy as np
 import pandas as pd
 import inspect
-import scipy.stats
 import enum
 
 import mtl.utils as mu
@@ -26,6 +25,7 @@ class GenerateFor(enum.Enum):
 class GenerationScope(enum.Enum):
     SingleRow = 1   # Operate on one row at a time
     DataFrame = 2   # Operate on the full data (either one dataset or the whole data, depending on when the generator is applied)
+    Vectorized = 3  # Like SingleRow, but compute all rows at once: get the data frame, return a column (or a list of columns)
 
 
 class Phase(enum.Enum):
@@ -41,12 +41,12 @@ class GeneratorSpec(object):
                  col_names,
                  generator: callable,
                  phase: Phase = Phase.DatasetLoaded,
-                 scope: GenerationScope = GenerationScope.SingleRow):
+                 scope: GenerationScope = None):
 
         if not isinstance(generate_for, GenerateFor):
             raise ValueError(f'Invalid generate_for = "{generate_for}"')
 
-        if not isinstance(scope, GenerationScope):
+        if scope is not None and not isinstance(scope, GenerationScope):
             raise ValueError(f'Invalid scope = "{scope}"')
 
         self.generate_for = generate_for
@@ -62,6 +62,10 @@ class GeneratorSpec(object):
 
         self.scope = scope or GenerationScope.SingleRow
 
+        #-- A SingleRow generator may also have a vectorized form (with the Vectorized scope arguments), which is
+        #-- used instead of calling the generator per row
+        self.vectorized = getattr(generator, 'vectorized', None) if self.scope == GenerationScope.SingleRow else None
+
     @property
     def col_names(self):
         return self._col_names
@@ -121,6 +125,9 @@ class ColGeneratorsManager(object):
                    4 args = Like the 3-arg function. The 4th argument: when creating a new column in characters.csv,
                             this is the trial row (from trials.csv) corresponding to the character's trial_id;
                             When creating a new column in trials.csv, this is a DataFrame with the current trial's characters
+                With the Vectorized scope, the function is called once, with the data frame instead of a row (and
+                the other data frame - trials or characters - as the 4th argument). It returns a column with one
+                value per row (or a list of columns, or a DataFrame, if several columns are generated).
         """
         if not mu.is_collection(generators_spec) or sum(not isinstance(g, GeneratorSpec) for g in generators_spec) > 0:
             raise ValueError('generators_spec must be a collection of GeneratorSpec objects')
@@ -136,14 +143,21 @@ class ColGeneratorsManager(object):
         :param ds_dir: The current dataset.
         """
 
-        trials_rows = [dict(row) for _, row in trials_df.iterrows()]
-        chars_rows = [dict(row) for _, row in chars_df.iterrows()]
+        trials_rows = _LazyRows(trials_df)
+        chars_rows = _LazyRows(chars_df)
 
         orig_trials_cols = trials_df.columns
         orig_chars_cols = chars_df.columns
 
+        #-- Lookup of the trial of each character (for 4-argument generators). Re-created when trials_df changes.
+        trial_key_cols = TrialRowsIndex.key_cols_of(trials_df, chars_df)
+        trials_index = None
+
         for generator in self.generators:
 
+            if phase != generator.phase:
+                continue
+
             if self.trace:
                 print(f'  Add column/s {generator.all_col_names} to {generator.generate_for.value} file')
 
@@ -152,11 +166,14 @@ class ColGeneratorsManager(object):
                 gen_args = TrialColGenratorArgs(new_col_name=generator.col_names, nparams=generator.nparams,
                                                 ds_dir=ds_dir, subj_id=subj_id, chars_df=chars_df)
                 self.apply_generator(generator, gen_args, trials_rows, trials_df, orig_trials_cols, phase)
+                trials_index = None
 
             else:
                 #-- Generate a new column in chars_df
+                if trials_index is None:
+                    trials_index = TrialRowsIndex(trials_df, trial_key_cols)
                 gen_args = CharColGenratorArgs(new_col_name=generator.col_names, nparams=generator.nparams,
-                                               ds_dir=ds_dir, subj_id=subj_id, trials_df=trials_df)
+                                               ds_dir=ds_dir, subj_id=subj_id, trials_df=trials_df, trials_index=trials_index)
                 self.apply_generator(generator, gen_args, chars_rows, chars_df, orig_chars_cols, phase)
 
         if trials_df.shape[0] > 0:
@@ -179,28 +196,37 @@ class ColGeneratorsManager(object):
         """
         Apply a column generator to all rows, then add the generated values as new column/s to the DataFrame
 
+        :param rows: The rows of the data frame (_LazyRows)
         :param phase: Run only if this matches self's phase
         """
 
         if phase != generator.phase:
             return
 
-        if generator.scope == GenerationScope.SingleRow:
-            new_col_values = [generator.generator(*gen_args_func(row)) for row in rows]
+        if generator.scope == GenerationScope.SingleRow and generator.vectorized is not None:
+            new_columns = self._vectorized_columns(generator, generator.vectorized(rows.frame, gen_args_func.ds_dir, gen_args_func.subj_id))
+
+        elif generator.scope == GenerationScope.SingleRow:
+            new_col_values = [generator.generator(*gen_args_func(row)) for row in rows.rows]
+            new_columns = self._row_values_to_columns(generator, new_col_values)
+
         elif generator.scope == GenerationScope.DataFrame:
             new_col_values = generator.generator(df, gen_args_func.ds_dir, gen_args_func.subj_id)
+            new_columns = self._row_values_to_columns(generator, new_col_values)
+
+        elif generator.scope == GenerationScope.Vectorized:
+            new_columns = self._vectorized_columns(generator, generator.generator(*gen_args_func.vectorized_args(rows.frame)))
+
         else:
             raise ValueError(f'Invalid generator scope: {generator.scope}')
 
-        #-- Ensure the generated values are arrays
-        if not generator.generates_multiple_values:
-            new_col_values = [[v] for v in new_col_values]
-
         #-- Export the generated values into the data frame
-        for i, col_name in enumerate(generator.col_names):
+        for col_name, values in zip(generator.col_names, new_columns):
+
+            if len(values) != df.shape[0]:
+                raise ValueError(f'The generator of column/s {generator.all_col_names} returned {len(values)} values, expected {df.shape[0]}')
 
-            for row, v in zip(rows, new_col_values):
-                row[col_name] = v[i]
+            rows.set_column(col_name, values)
 
             if col_name.startswith('__'):
                 continue
@@ -213,7 +239,64 @@ class ColGeneratorsManager(object):
                 self.override_warning_issued.add(col_name)
 
 
-            df[col_name] = [v[i] for v in new_col_values]
+            df[col_name] = values
+
+    #-------------------------------------------------------------------
+    @staticmethod
+    def _row_values_to_columns(generator, new_col_values):
+        """ Convert the per-row values (or value lists, if the generator creates several columns) to columns """
+        if not generator.generates_multiple_values:
+            return [list(new_col_values)]
+
+        new_col_values = list(new_col_values)
+        return [[v[i] for v in new_col_values] for i in range(len(generator.col_names))]
+
+    @staticmethod
+    def _vectorized_columns(generator, result):
+        """ Get the columns returned by a vectorized generator (a Series, array or list per column) """
+        if not generator.generates_multiple_values:
+            result = [result]
+        elif isinstance(result, pd.DataFrame):
+            result = [result.iloc[:, i] for i in range(result.shape[1])]
+
+        if len(result) != len(generator.col_names):
+            raise ValueError(f'The generator of columns {generator.all_col_names} returned {len(result)} columns')
+
+        return [col.values if isinstance(col, pd.Series) else col for col in result]
+
+
+#--------------------------------------------------------------------------------------------
+class _LazyRows(object):
+    """
+    The rows of a data frame, as dicts. The dicts are created only if a SingleRow generator needs them.
+    Generated columns whose name starts with '__' are not added to the data frame, only to the rows.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._generated_cols = dict()
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self.df.to_dict('records')
+            for col_name, values in self._generated_cols.items():
+                for row, v in zip(self._rows, values):
+                    row[col_name] = v
+        return self._rows
+
+    @property
+    def frame(self):
+        """ The data frame, including the columns that were generated only in the rows """
+        hidden_cols = {c: v for c, v in self._generated_cols.items() if c.startswith('__')}
+        return self.df.assign(**hidden_cols) if len(hidden_cols) > 0 else self.df
+
+    def set_column(self, col_name, values):
+        self._generated_cols[col_name] = values
+        if self._rows is not None:
+            for row, v in zip(self._rows, values):
+                row[col_name] = v
 
 
 #--------------------------------------------------------------------------------------------
@@ -222,10 +305,17 @@ class CharColGenratorArgs(object):
     Generate arguments for the col-generation function for characters.csv
     """
 
-    def __init__(self, new_col_name, nparams, ds_dir, subj_id, trials_df):
+    def __init__(self, new_col_name, nparams, ds_dir, subj_id, trials_df, trials_index=None):
+        """
+        :param trials_index: TrialRowsIndex of trials_df (if not provided, it is created here)
+        """
         self.ds_dir = ds_dir
         self.subj_id = subj_id
 
+        self.nparams = nparams
+        self.trials_df = trials_df
+        self.trials_index = trials_index
+
         if nparams == 1:
             self.generate_args = self.gen_1args
 
@@ -233,7 +323,8 @@ class CharColGenratorArgs(object):
             self.generate_args = self.gen_3args
 
         elif nparams == 4:
-            self.trials_df = trials_df
+            if self.trials_index is None:
+                self.trials_index = TrialRowsIndex(trials_df, [c for c in ('trial_id', 'sub_trial_num') if c in trials_df])
             self.generate_args = self.gen_4args
 
         else:
@@ -246,13 +337,58 @@ class CharColGenratorArgs(object):
         return row, self.ds_dir, self.subj_id
 
     def gen_4args(self, row):
-        trial = self.trials_df[self.trials_df.trial_id == row['trial_id']].iloc[0]
-        return row, self.ds_dir, self.subj_id, trial
+        return row, self.ds_dir, self.subj_id, self.trials_index.trial_of(row)
+
+    def vectorized_args(self, df):
+        return (df, self.ds_dir, self.subj_id, self.trials_df)[:self.nparams]
 
     def __call__(self, row):
         return self.generate_args(row)
 
 
+#--------------------------------------------------------------------------------------------
+class TrialRowsIndex(object):
+    """
+    Find the trials.csv row of a character, by the columns that identify a trial (the same key used for merging
+    trials and characters: subject, block, trial_id, sub_trial_num). The index is built on first use.
+    """
+
+    #-- The columns that identify a trial, in the order of the merge key
+    all_key_cols = 'subject', 'block', 'trial_id', 'sub_trial_num'
+
+    def __init__(self, trials_df, key_cols=('trial_id', 'sub_trial_num')):
+        """
+        :param key_cols: The columns by which a character's trial is found. If sub_trial_num is not one of them,
+                         the first sub-trial of the trial is used.
+        """
+        self.trials_df = trials_df
+        self.key_cols = tuple(key_cols)
+        self._row_inds = None
+        self._rows = dict()
+
+    @classmethod
+    def key_cols_of(cls, trials_df, chars_df):
+        """ The key columns that exist in both data frames """
+        return tuple(c for c in cls.all_key_cols if c in trials_df and c in chars_df)
+
+    def trial_of(self, char_row):
+        """ Get the trial row (Series) of the given character row """
+        if self._row_inds is None:
+            self._row_inds = dict()
+            key_values = zip(*[self.trials_df[c] for c in self.key_cols])
+            for i, key in enumerate(key_values):
+                self._row_inds.setdefault(key, i)
+
+        key = tuple(char_row[c] for c in self.key_cols)
+        if key not in self._row_inds:
+            raise ValueError('No row in trials.csv for ' + ', '.join(f'{c}={v}' for c, v in zip(self.key_cols, key)))
+
+        i = self._row_inds[key]
+        if i not in self._rows:
+            self._rows[i] = self.trials_df.iloc[i]
+        return self._rows[i]
+
+
 #--------------------------------------------------------------------------------------------
 class TrialColGenratorArgs(object):
     """
@@ -262,6 +398,8 @@ class TrialColGenratorArgs(object):
     def __init__(self, new_col_name, nparams, ds_dir, subj_id, chars_df):
         self.ds_dir = ds_dir
         self.subj_id = subj_id
+        self.nparams = nparams
+        self.chars_df = chars_df
         self.chars_df_cols = list(chars_df)
 
         if nparams == 1:
@@ -292,6 +430,9 @@ class TrialColGenratorArgs(object):
 
         return row, self.ds_dir, self.subj_id, chars_of_curr_trial
 
+    def vectorized_args(self, df):
+        return (df, self.ds_dir, self.subj_id, self.chars_df)[:self.nparams]
+
     def __call__(self, row):
         return self.generate_args(row)
 
@@ -321,7 +462,9 @@ class EliminateSpaces(object):
         self.nan_to_empty_string = nan_to_empty_string
 
     def __call__(self, row):
-        value = row[self.col_name]
+        return self._eliminate_spaces(row[self.col_name])
+
+    def _eliminate_spaces(self, value):
         if self.nan_to_empty_string and isinstance(value, float) and math.isnan(value):
             return ''
 
@@ -330,6 +473,22 @@ class EliminateSpaces(object):
             v = v.lower()
         return v
 
+    def vectorized(self, df, _, __):
+        values = df[self.col_name]
+
+        #-- Only a column of strings (and NaNs, if they are converted to '') behaves the same with the vectorized
+        #-- string functions; otherwise, process each value so invalid values fail as in the per-row form
+        all_strings = pd.api.types.infer_dtype(values, skipna=True) == 'string'
+        if not all_strings or not (self.nan_to_empty_string or values.notna().all()):
+            return [self._eliminate_spaces(v) for v in values]
+
+        result = values.str.replace(' ', '', regex=False)
+        if self.to_lower:
+            result = result.str.lower()
+        if self.nan_to_empty_string:
+            result = result.where(values.notna(), '')
+        return result
+
 
 #----------------------------------------------------------------------------------
 class ColMapper(object):
@@ -342,6 +501,11 @@ class ColMapper(object):
         value = row[self.col_name]
         return self.mapping.get(value, value)
 
+    def vectorized(self, df, _, __):
+        values = df[self.col_name]
+        mapped = values.isin(list(self.mapping))
+        return values.where(~mapped, values.map(self.mapping))
+
 
 #----------------------------------------------------------------------------------
 def integer_target_length(row):
@@ -349,6 +513,13 @@ def integer_target_length(row):
     return len(str(int(row['target'])))
 
 
+def _integer_target_length_vectorized(df, _, __):
+    return pd.to_numeric(df['target']).astype('int64').astype(str).str.len()
+
+
+integer_target_length.vectorized = _integer_target_length_vectorized
+
+
 #-------------------------------------------------------------------
 class ZScoreColumn(object):
     """
@@ -358,25 +529,28 @@ class ZScoreColumn(object):
     def __init__(self, col_name, grouping_fld=None, filter_func=None):
         """
         :param col_name: The column containing the values to z-score
-        :param grouping_fld: If specified, compute z score separately for each group of rows
+        :param grouping_fld: If specified, compute z score separately for each group of rows (a field name or a list of fields)
         :param filter_func: If specified, Compute z score only for some rows. filter_func is a function that gets a data frame and returns
                             a list for selecting rows (bool of same size; or list of indices to select)
         """
         self.col_name = col_name
         self.grouping_fld = grouping_fld   # z-score separately for each value of this field
-        self.filter_func = filter_func     # z-score only these rows. The others remain None.
+        self.filter_func = filter_func     # z-score only these rows. The others remain NaN.
 
     #------------------------------------
     def __call__(self, df, _, __):
 
         if self.filter_func is None:
-            result = compute_z_scores(df, self.col_name, self.grouping_fld)
-        else:
-            result = pd.Series([None] * df.shape[0])
-            included_rows = list(self.filter_func(df))
-            zscores = compute_z_scores(df[included_rows], self.col_name, self.grouping_fld)
-            result[included_rows] = list(zscores)
+            return compute_z_scores(df, self.col_name, self.grouping_fld)
 
+        included_rows = np.asarray(list(self.filter_func(df)))
+        if included_rows.dtype != bool:
+            mask = np.zeros(df.shape[0], dtype=bool)
+            mask[included_rows.astype(int)] = True
+            included_rows = mask
+
+        result = np.full(df.shape[0], np.nan)
+        result[included_rows] = compute_z_scores(df[included_rows], self.col_name, self.grouping_fld)
         return result
 
     @property
@@ -387,21 +561,24 @@ class ZScoreColumn(object):
 #-------------------------------------------------------------------
 def compute_z_scores(df, col_name, grouping_fld=None):
     """
-    Z-score a given column; potentially separately per length
-    """
-    if grouping_fld is None:
-        return pd.Series(_zscore(df[col_name]))
+    Z-score a given column; potentially separately per group of rows.
+    NaN values are ignored (and remain NaN). Rows whose group is NaN get NaN.
 
-    #-- Compute per group
-    result = np.array([None] * df.shape[0])
-    for group in df[grouping_fld].unique():
-        result[df[grouping_fld] == group] = _zscore(df[col_name][df[grouping_fld] == group])
-
-    return result
+    :param grouping_fld: A field name or a list of field names; compute the z scores separately for each group of
+                         rows with the same value/s in these field/s
+    :return: Array of float, one value per row in df
+    """
+    values = pd.Series(df[col_name].to_numpy(dtype=float, na_value=np.nan))
 
+    if grouping_fld is None:
+        mean = values.mean()
+        std = np.sqrt(((values - mean) ** 2).mean())
 
-def _zscore(values):
-    if sum(~values.isnull()) == 0:
-        return [float('nan')] * len(values)
     else:
-        return scipy.stats.zscore(values, nan_policy='omit')
+        grouping_flds = [grouping_fld] if isinstance(grouping_fld, str) else list(grouping_fld)
+        keys = [df[fld].to_numpy() for fld in grouping_flds]
+        mean = values.groupby(keys).transform('mean')
+        std = np.sqrt(((values - mean) ** 2).groupby(keys).transform('mean'))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ((values - mean) / std).to_numpy(dtype=float)
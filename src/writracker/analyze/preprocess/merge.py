@@ -5,20 +5,29 @@ and a single file with the trial data of all subjects.
 The combination of all sessions is called a "dataset"; it reflects a single task/condition.
 Each dataset is defined by a prefix (e.g., 'wencoder_1') and the number of blocks in it.
 """
+import contextlib
+import importlib.util
+import io
 import math
 import os
+import pickle
+import numpy as np
 import pandas as pd
-import glob
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 import writracker.analyze.preprocess.colgenerators as colgen
+from writracker.analyze.preprocess.mergecache import MergeCache
+from writracker import sessionindex
+from writracker import sessionjournal
 
 
 #-----------------------------------------------------------------------------
 class Merger(object):
 
     def __init__(self, new_cols=None, traj_file_prefix='trajectory_trial_', has_block_col=True,
-                 trials_csv_converters=None, set_response_in_ok_trials=False, min_ntrials_in_session=0, trace=False):
+                 trials_csv_converters=None, set_response_in_ok_trials=False, min_ntrials_in_session=0, trace=False,
+                 cache_dir=None):
         """
         :param new_cols: Specification of new columns to create in the trials.csv or characters.csv files.
                          See detais in ColGeneratorsManager class.
@@ -28,6 +37,8 @@ class Merger(object):
         :param has_block_col: Whether the output should include a "block" column (if yes, expecting it in the input too)
         :param min_ntrials_in_session: Ignore sessions with fewer trials than this number
         :param set_response_in_ok_trials: If True, set the response to be equal to the target in all trials with rc=='OK'
+        :param cache_dir: If specified, each session's data (after the DatasetLoaded phase) is cached in this directory,
+                         and sessions that did not change since the last merge are not re-loaded (see mergecache)
         """
         self.col_generation = colgen.ColGeneratorsManager(new_cols, trace=trace)
         self.trials_csv_converters = dict(response=parse_response_col_in_trials_csv)
@@ -36,12 +47,14 @@ class Merger(object):
         self.traj_file_prefix = traj_file_prefix
         self.has_block_col = has_block_col
         self.merge_errors = {}
+        self.validation_reports = []
         self.set_response_in_ok_trials = set_response_in_ok_trials
         self.min_ntrials_in_session = min_ntrials_in_session
         self.trace = trace
+        self.cache = None if cache_dir is None else MergeCache(cache_dir)
 
     #-------------------------------------------------------------------
-    def merge_dataset(self, subj_location, find_session_dirs, out_chars_fn=None, out_trials_fn=None):
+    def merge_dataset(self, subj_location, find_session_dirs, out_chars_fn=None, out_trials_fn=None, workers=None):
         """
         Merge character.csv files of multiple subjects into a single file
         and trials.csv files of multiple subjects into a single file
@@ -49,12 +62,59 @@ class Merger(object):
         :param subj_location: a dictionary of subject IDs and their locations (e.g., a directory)
         :param find_session_dirs: a function that finds the directories of relevant sessions in given subject's directory.
                                   The function should return a list of SessionDir objects
-        :param out_chars_fn: the output file name (CSV, one line per character)
-        :param out_trials_fn: the output file name (CSV, one line per trial)
+        :param out_chars_fn: the output file name (one line per character), or a list of file names. The format is
+                             determined by the file extension: CSV (the default), Parquet (.parquet) or Feather
+                             (.feather/.arrow). The columnar formats keep the exact values and types.
+        :param out_trials_fn: the output file name/s (one line per trial), as in out_chars_fn
+        :param workers: If > 1, the sessions are loaded (and their DatasetLoaded columns are generated) in this number
+                        of parallel processes. The result is the same as when loading serially; the printouts of each
+                        session are printed in the order of the sessions. This requires that the Merger (including
+                        the column generators) can be pickled - otherwise, the sessions are loaded serially.
         """
+        out_trials_fns = _as_filename_list(out_trials_fn)
+        out_chars_fns = _as_filename_list(out_chars_fn)
+        for fn in out_trials_fns + out_chars_fns:
+            _check_output_format_supported(fn)
+
         trials_data = []
         chars_data = []
-        self.merge_errors = dict(N_MISSING_IN_TRIALS_CSV=0, N_MISSING_TRAJ_FILES=0)
+        self.merge_errors = dict(N_DUPLICATE_TRIALS=0, N_MISSING_IN_TRIALS_CSV=0, N_MISSING_TRAJ_FILES=0)
+        self.validation_reports = []
+
+        sessions = self._find_sessions(subj_location, find_session_dirs)
+        parallel = workers is not None and workers > 1 and self._can_send_to_workers()
+        if self.cache is not None:
+            results = self._process_sessions_with_cache(list(sessions), workers if parallel else None)
+        elif parallel:
+            results = self._report_session_results(list(sessions), workers)
+        else:
+            results = (self._process_session(subj_id, ds_dir) for subj_id, ds_dir in sessions)
+
+        #-- If a session fails, the worker pool is shut down here (rather than when the generators are garbage-collected)
+        with contextlib.closing(results):
+            for curr_trials_df, curr_chars_df in results:
+                if curr_trials_df.empty:
+                    continue
+
+                trials_data.append(curr_trials_df)
+                chars_data.append(curr_chars_df)
+
+        all_trials_df = self._merge_trials(trials_data)
+        all_chars_df = self._merge_characters(chars_data)
+        all_trials_df, all_chars_df = self._add_columns_to_merged_trials_and_chars(all_trials_df, all_chars_df)
+        self.col_generation.generate_custom_columns(all_trials_df, all_chars_df, colgen.Phase.AllDatasetsLoaded)
+
+        for fn in out_trials_fns:
+            save_merged_data(all_trials_df, fn, csv_float_format='%.3g')
+
+        for fn in out_chars_fns:
+            save_merged_data(all_chars_df, fn, csv_float_format='%.5g')
+
+        return all_chars_df
+
+    #-------------------------------------------------------------------
+    def _find_sessions(self, subj_location, find_session_dirs):
+        """ Yield (subject ID, EncodedSessionDir) for all sessions of all subjects """
 
         for subj_id, subj_loc in subj_location.items():
 
@@ -67,41 +127,107 @@ class Merger(object):
                 continue
 
             for ds_dir in ds_dirs:
-                if self.trace:
-                    print(f'Processing dataset in {ds_dir.dir_name}')
-                curr_trials_df, curr_chars_df = self._load_session(ds_dir, subj_id)
-                if curr_trials_df.empty:
-                    continue
+                yield subj_id, ds_dir
 
-                self.col_generation.generate_custom_columns(curr_trials_df, curr_chars_df, colgen.Phase.DatasetLoaded, subj_id, ds_dir)
+    #-------------------------------------------------------------------
+    def _process_session(self, subj_id, ds_dir):
+        """ Load one session and generate its DatasetLoaded-phase columns """
+        if self.trace:
+            print(f'Processing dataset in {ds_dir.dir_name}')
 
-                trials_data.append(curr_trials_df)
-                chars_data.append(curr_chars_df)
+        curr_trials_df, curr_chars_df = self._load_session(ds_dir, subj_id)
+        if not curr_trials_df.empty:
+            self.col_generation.generate_custom_columns(curr_trials_df, curr_chars_df, colgen.Phase.DatasetLoaded, subj_id, ds_dir)
 
-        all_trials_df = self._merge_trials(trials_data)
-        all_chars_df = self._merge_characters(chars_data)
-        all_trials_df, all_chars_df = self._add_columns_to_merged_trials_and_chars(all_trials_df, all_chars_df)
-        self.col_generation.generate_custom_columns(all_trials_df, all_chars_df, colgen.Phase.AllDatasetsLoaded)
+        return curr_trials_df, curr_chars_df
+
+    #-------------------------------------------------------------------
+    def _run_sessions(self, sessions, workers):
+        """
+        Run _process_session() on several sessions - in worker processes if workers is specified - and capture
+        the printouts. Yield the results (see _process_session_job) in order.
+        """
+        if workers is None:
+            for subj_id, ds_dir in sessions:
+                yield _process_session_job((self, subj_id, ds_dir))
+            return
 
-        if out_trials_fn is not None:
-            all_trials_df.to_csv(out_trials_fn, index=False, float_format='%.3g')
+        with ProcessPoolExecutor(workers) as pool:
+            jobs = [(self, subj_id, ds_dir) for subj_id, ds_dir in sessions]
+            yield from pool.map(_process_session_job, jobs)
 
-        if out_chars_fn is not None:
-            all_chars_df.to_csv(out_chars_fn, index=False, float_format='%.5g')
+    #-------------------------------------------------------------------
+    def _report_session_results(self, sessions, workers):
+        """ Run the sessions (see _run_sessions) and report their results. Yield the data frames of each session. """
+        with contextlib.closing(self._run_sessions(sessions, workers)) as processed:
+            for result in processed:
+                yield self._report_session_result(result)
 
-        return all_chars_df
+    #-------------------------------------------------------------------
+    def _report_session_result(self, result):
+        """ Report what happened when processing a session (in _run_sessions). Return the session's data frames. """
+        trials_df, chars_df, merge_errors, validation_reports, output, error = result
+
+        print(output, end='')
+        if error is not None:
+            raise error
+
+        for error_type, n in merge_errors.items():
+            self.merge_errors[error_type] = self.merge_errors.get(error_type, 0) + n
+        self.validation_reports.extend(validation_reports)
+
+        return trials_df, chars_df
 
     #-------------------------------------------------------------------
-    def _copy_col_from_char1_to_trials(self, trials_df, chars_df, col_name):
-        char1_df = chars_df[chars_df.char_num == 1][self.merge_key() + [col_name]]
-        return trials_df.merge(char1_df, on=self.merge_key(), how='left')
+    def _process_sessions_with_cache(self, sessions, workers):
+        """
+        Get the sessions' data from the cache; process only the sessions that are not cached (or changed).
+        Sessions without a fingerprint (see MergeCache.fingerprint) are always processed, and are not cached.
+        """
+
+        fingerprints = [self.cache.fingerprint(self, subj_id, ds_dir) for subj_id, ds_dir in sessions]
+        cached = [None if fp is None else self.cache.load(subj_id, ds_dir, fp)
+                  for (subj_id, ds_dir), fp in zip(sessions, fingerprints)]
+
+        if self.trace:
+            print(f'{sum(c is not None for c in cached)}/{len(sessions)} sessions were found in the merge cache')
+
+        to_process = [session for session, c in zip(sessions, cached) if c is None]
+        with contextlib.closing(self._run_sessions(to_process, workers)) as processed:
+
+            for (subj_id, ds_dir), fingerprint, result in zip(sessions, fingerprints, cached):
+                if result is None:
+                    result = next(processed)
+                    if result[5] is None and fingerprint is not None:
+                        trials_df, chars_df, merge_errors, validation_reports, output, _ = result
+                        self.cache.save(subj_id, ds_dir, fingerprint, trials_df, chars_df, merge_errors,
+                                        [r.to_dict() for r in validation_reports], output)
+                else:
+                    trials_df, chars_df, merge_errors, validation_reports, output = result
+                    validation_reports = [SessionValidationReport.from_dict(r) for r in validation_reports]
+                    result = trials_df, chars_df, merge_errors, validation_reports, output, None
+
+                yield self._report_session_result(result)
 
     #-------------------------------------------------------------------
-    def _copy_col_from_trials_to_chars(self, trials_df, chars_df, col_name):
-        tdf = trials_df[self.merge_key() + [col_name]]
-        newdf = chars_df.merge(tdf, on=self.merge_key(), how='left')
-        assert newdf.shape[0] == chars_df.shape[0]
-        return newdf
+    def _can_send_to_workers(self):
+        try:
+            pickle.dumps(self)
+            return True
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            print(f'WARNING: the sessions will be loaded serially, because the column generators cannot be sent to worker processes ({e}). '
+                  'To load in parallel, use module-level functions rather than lambdas or local functions.')
+            return False
+
+    #-------------------------------------------------------------------
+    def _copy_col_from_char1_to_trials(self, trials_df, chars_df, col_name, index):
+        trials_df[col_name] = index.chars_to_trials(chars_df[col_name], chars_df.char_num == 1)
+        return trials_df
+
+    #-------------------------------------------------------------------
+    def _copy_col_from_trials_to_chars(self, trials_df, chars_df, col_name, index):
+        chars_df[col_name] = index.trials_to_chars(trials_df[col_name])
+        return chars_df
 
     #-------------------------------------------------------------------
     def _merge_trials(self, trials_df_per_subdir):
@@ -127,50 +253,65 @@ class Merger(object):
         Add each column both to trials_df and chars_df as needed.
         """
 
-        chars_df = self.update_prev_and_next_char(chars_df)
+        #-- Values are copied between trials and characters via an index of the trials (instead of joining on the merge key)
+        trials_df = trials_df.reset_index(drop=True)
+        chars_df = chars_df.reset_index(drop=True)
+        index = MergedTrialsIndex(trials_df, chars_df, self.merge_key())
+
+        chars_df = self.update_prev_and_next_char(chars_df, index)
 
         #-- Add RC from trials
-        chars_df = chars_df.merge(trials_df[self.merge_key() + ['rc']], on=self.merge_key(), how='left')
+        chars_df = self._copy_col_from_trials_to_chars(trials_df, chars_df, 'rc', index)
 
         multiple_target_lengths = 'target_len' in chars_df and len(chars_df.target_len.unique()) > 1
         if multiple_target_lengths and 'target_len' not in trials_df:
-            trials_df = self._copy_col_from_char1_to_trials(trials_df, chars_df, 'target_len')
+            trials_df = self._copy_col_from_char1_to_trials(trials_df, chars_df, 'target_len', index)
         z_grouping_fld = 'target_len' if multiple_target_lengths else None
 
         #-- The pre-char delay of character #1 is set to be the pre-trial delay (because t0 was set by WRecorder as the trial's starting point)
-        chars_df = self.update_pre_char_delay_at_trial_level(chars_df, 'pre_trial_delay', char_num=1)
-        trials_df = self._copy_col_from_char1_to_trials(trials_df, chars_df, 'pre_trial_delay')
+        chars_df = self.update_pre_char_delay_at_trial_level(chars_df, 'pre_trial_delay', char_num=1, index=index)
+        trials_df = self._copy_col_from_char1_to_trials(trials_df, chars_df, 'pre_trial_delay', index)
         trials_df['pre_trial_delay_z'] = colgen.compute_z_scores(trials_df, 'pre_trial_delay', grouping_fld=z_grouping_fld)
-        chars_df = self._copy_col_from_trials_to_chars(trials_df, chars_df, 'pre_trial_delay_z')
+        chars_df = self._copy_col_from_trials_to_chars(trials_df, chars_df, 'pre_trial_delay_z', index)
 
         #-- Delay from end-of-audio to start-of-char1
         if 'sound_file_length' in trials_df:
             trials_df['endaudio_to_char1_delay'] = trials_df.pre_trial_delay - trials_df.sound_file_length
             trials_df['endaudio_to_char1_delay_z'] = \
                 colgen.compute_z_scores(trials_df, 'endaudio_to_char1_delay', grouping_fld=z_grouping_fld)
-            chars_df = self._copy_col_from_trials_to_chars(trials_df, chars_df, 'endaudio_to_char1_delay')
-            chars_df = self._copy_col_from_trials_to_chars(trials_df, chars_df, 'endaudio_to_char1_delay_z')
+            chars_df = self._copy_col_from_trials_to_chars(trials_df, chars_df, 'endaudio_to_char1_delay', index)
+            chars_df = self._copy_col_from_trials_to_chars(trials_df, chars_df, 'endaudio_to_char1_delay_z', index)
 
         return trials_df, chars_df
 
     #-------------------------------------------------------------------
     def _load_session(self, ds_dir, subj_id):
-        trials_df = self._load_session_trials(f'{ds_dir.dir_name}/trials.csv', ds_dir, subj_id)
-        chars_df = self._load_session_characters(ds_dir, trials_df, subj_id)
+        if self.trace:
+            print('Loading trials file')
+
+        #-- trials.csv is read and validated once; the same data frame is used for the trials and the characters.
+        #-- Trials that were deleted in WEncoder but are still in the index files are skipped (the files are not modified)
+        with sessionjournal.open_live(f'{ds_dir.dir_name}/trials.csv') as fp:
+            raw_trials_df = pd.read_csv(fp, converters=self.trials_csv_converters)
+        report = self.validate_session(ds_dir.dir_name, raw_trials_df)
+        self._report_validation(report)
+
+        trials_df = self._load_session_trials(raw_trials_df, ds_dir, subj_id, report)
+        if trials_df.empty:
+            return trials_df, pd.DataFrame()
+
+        chars_df = self._load_session_characters(ds_dir, trials_df, subj_id, raw_trials_df, report)
         return trials_df, chars_df
 
     #-------------------------------------------------------------------
-    def _load_session_trials(self, trials_fn, ds_dir, subj_id):
+    def _load_session_trials(self, raw_df, ds_dir, subj_id, report):
         """
-        Add a DataFrame with the current dataset's trials to the trials_data array
+        Create a DataFrame with the current dataset's trials, from the session's trials.csv (raw_df)
         """
 
-        if self.trace:
-            print('Loading trials file')
-
-        raw_df = pd.read_csv(trials_fn, converters=self.trials_csv_converters)
-        if raw_df.shape[0] != (raw_df.trial_id.astype(str) + raw_df.sub_trial_num.astype(str)).nunique():
-            print(f'ERROR: duplicate trials in {ds_dir.dir_name}/trials.csv ({raw_df.shape[0]} rows but only {raw_df.trial_id.nunique()} unique trial IDs). This dataset was ignored.')
+        if len(report.duplicate_trials) > 0:
+            duplicates = ', '.join(f'{trial}/{subtrial}' for trial, subtrial in report.duplicate_trials)
+            print(f'ERROR: duplicate trials in {ds_dir.dir_name}/trials.csv (trial/sub-trial: {duplicates}). This dataset was ignored.')
             return pd.DataFrame()
 
         if raw_df.shape[0] < self.min_ntrials_in_session:
@@ -210,7 +351,7 @@ class Merger(object):
         return new_df
 
     #-------------------------------------------------------------------
-    def _load_session_characters(self, ds_dir, trials, subj_id):
+    def _load_session_characters(self, ds_dir, trials, subj_id, raw_trials_df, report):
         """
         Load characters.csv file of the current session, and add new columns to it.
         """
@@ -218,8 +359,9 @@ class Merger(object):
             print('Loading characters file')
 
         #-- Read characters.csv file -- only trials with rc=OK
-        curr_chars_df = pd.read_csv(ds_dir.filename, dtype=dict(char=str))
-        curr_chars_df = self.filter_good_trials(curr_chars_df, ds_dir.dir_name)
+        with sessionjournal.open_live(ds_dir.filename) as fp:
+            curr_chars_df = pd.read_csv(fp, dtype=dict(char=str))
+        curr_chars_df = self.filter_good_trials(curr_chars_df, ds_dir.dir_name, raw_trials_df, report)
 
         curr_chars_df['subject'] = subj_id
 
@@ -232,43 +374,41 @@ class Merger(object):
         return curr_chars_df
 
     #-------------------------------------------------------------------
-    def update_prev_and_next_char(self, data):
-        """ Update, in each row, the previous and next characters """
-        merge_key = self.merge_key() + ['char_num']
-
-        next_char_df = data.copy()
-        next_char_df['char_num'] = next_char_df.char_num - 1
-        next_char_df = next_char_df[merge_key + ['char']]
-        next_char_df.rename(columns={'char': 'next_char'}, inplace=True)
+    def update_prev_and_next_char(self, data, index=None):
+        """
+        Update, in each row, the previous and next characters
 
-        prev_char_df = data.copy()
-        prev_char_df['char_num'] = prev_char_df.char_num + 1
-        prev_char_df = prev_char_df[merge_key + ['char']]
-        prev_char_df.rename(columns={'char': 'prev_char'}, inplace=True)
+        :param index: MergedTrialsIndex of the characters. If provided, 'data' is updated in place (and returned).
+        """
+        if index is None:
+            data = data.reset_index(drop=True)
+            index = MergedTrialsIndex(data.iloc[:0], data, self.merge_key())
 
-        data = data.merge(next_char_df, on=merge_key, how='left')
-        data = data.merge(prev_char_df, on=merge_key, how='left')
+        prev_rows, next_rows = index.adjacent_chars(data.char_num)
+        data['next_char'] = _take_rows(data.char, next_rows)
+        data['prev_char'] = _take_rows(data.char, prev_rows)
 
         return data
 
     #-------------------------------------------------------------------
-    def update_pre_char_delay_at_trial_level(self, data, col_name, char_num=None, dec_pos=None):
+    def update_pre_char_delay_at_trial_level(self, data, col_name, char_num=None, dec_pos=None, index=None):
         """
         Set the pre-char delay of a particular character over all rows of the corresponding trial
 
         :param col_name: the name of the new column
         :param char_num: the number of the character to use (1 = leftmost)
         :param dec_pos: the decimal position of the digit to use (1 = rightmost)
+        :param index: MergedTrialsIndex of the characters. If provided, 'data' is updated in place (and returned).
         """
 
         assert (char_num is None) != (dec_pos is None)
 
-        char_data = data[(data.dec_pos == dec_pos) if char_num is None else data.char_num == char_num].reset_index(drop=True)
-        char_data[col_name] = char_data.pre_char_delay
+        if index is None:
+            data = data.reset_index(drop=True)
+            index = MergedTrialsIndex(data.iloc[:0], data, self.merge_key())
 
-        n = data.shape[0]
-        data = data.merge(char_data[self.merge_key() + [col_name]], on=self.merge_key(), how='left')
-        assert data.shape[0] == n
+        selected_chars = (data.dec_pos == dec_pos) if char_num is None else data.char_num == char_num
+        data[col_name] = index.chars_to_chars(data.pre_char_delay, selected_chars)
 
         return data
 
@@ -282,20 +422,19 @@ class Merger(object):
         return key
 
     #-------------------------------------------------------------------
-    def filter_good_trials(self, df, dir_name):
-
-        trials = pd.read_csv(dir_name + '/trials.csv')
-        target_ids = [None if math.isnan(tid) else tid for tid in trials.target_id]
-        trials_in_trials_csv = {(trial, subtrial, target) for trial, subtrial, target in zip(trials.trial_id, trials.sub_trial_num, target_ids)}
-
-        trials_with_traj_files, traj_file_names = self.find_traj_files(dir_name)
+    def filter_good_trials(self, df, dir_name, trials=None, report=None):
+        """
+        Keep only the rows of trials with rc=OK
 
-        self._check_if_trials_are_missing_in_trials_csv(trials_in_trials_csv, trials_with_traj_files, dir_name)
+        :param trials: The session's trials.csv as a data frame. If not specified, it is loaded from dir_name.
+        :param report: The session's SessionValidationReport, if the session was already validated (and reported).
+                       If not specified, the session is validated here.
+        """
+        if trials is None:
+            trials = sessionindex.get(dir_name).trials_df()
 
-        missing_traj_files = [fn for fn in trials.traj_file_name if fn not in traj_file_names]
-        if len(missing_traj_files) > 0:
-            print(f'ERROR in {dir_name}: trajectory files are missing for some trials: {missing_traj_files}')
-            self.merge_errors['N_MISSING_TRAJ_FILES'] += len(missing_traj_files)
+        if report is None:
+            self._report_validation(self.validate_session(dir_name, trials))
 
         good_trials = trials.trial_id[trials.rc == 'OK']
         df = df[df.trial_id.isin(good_trials)]
@@ -303,15 +442,52 @@ class Merger(object):
         return df
 
     #-------------------------------------------------------------------
-    def _check_if_trials_are_missing_in_trials_csv(self, trials_in_trials_csv, trials_with_traj_files, dir_name):
+    def validate_session(self, dir_name, trials=None):
+        """
+        Check the session's trials.csv and trajectory files: duplicate trials in trials.csv, trials whose trajectory
+        file is missing, and trajectory files of trials that are not in trials.csv
 
-        missing_in_trials_csv = [(trial, subtrial, target) for (trial, subtrial), target in trials_with_traj_files.items()
-                                 if (trial, subtrial, target) not in trials_in_trials_csv]
-        if len(missing_in_trials_csv) > 0:
-            print(f'WARNING in {dir_name}: some trials have trajectory files but they are not in trials.csv: ')
-            for trial, subtrial, target in missing_in_trials_csv:
+        :param trials: The session's trials.csv as a data frame. If not specified, it is loaded from dir_name.
+        :return: SessionValidationReport
+        """
+        if trials is None:
+            trials = sessionindex.get(dir_name).trials_df()
+
+        report = SessionValidationReport(dir_name)
+
+        #-- Duplicates are detected on the (trial_id, sub_trial_num) values, not on a string representation of them
+        trial_keys = trials[['trial_id', 'sub_trial_num']]
+        duplicates = trial_keys[trial_keys.duplicated()].drop_duplicates()
+        report.duplicate_trials = list(zip(duplicates.trial_id.tolist(), duplicates.sub_trial_num.tolist()))
+
+        trials_with_traj_files, traj_file_names = self.find_traj_files(dir_name)
+
+        target_ids = [None if math.isnan(tid) else tid for tid in trials.target_id]
+        trials_in_trials_csv = set(zip(trials.trial_id, trials.sub_trial_num, target_ids))
+        report.missing_in_trials_csv = [(trial, subtrial, target) for (trial, subtrial), target in trials_with_traj_files.items()
+                                        if (trial, subtrial, target) not in trials_in_trials_csv]
+
+        traj_file_names = set(traj_file_names)
+        report.missing_traj_files = [fn for fn in trials.traj_file_name if fn not in traj_file_names]
+
+        return report
+
+    #-------------------------------------------------------------------
+    def _report_validation(self, report):
+        """ Print the problems found by validate_session() and count them in merge_errors """
+
+        self.validation_reports.append(report)
+
+        if len(report.missing_in_trials_csv) > 0:
+            print(f'WARNING in {report.dir_name}: some trials have trajectory files but they are not in trials.csv: ')
+            for trial, subtrial, target in report.missing_in_trials_csv:
                 print(f'    Trial #{trial}/{subtrial} (target #{target})')
-            self.merge_errors['N_MISSING_IN_TRIALS_CSV'] += len(missing_in_trials_csv)
+
+        if len(report.missing_traj_files) > 0:
+            print(f'ERROR in {report.dir_name}: trajectory files are missing for some trials: {report.missing_traj_files}')
+
+        for error_type, n in report.error_counts().items():
+            self.merge_errors[error_type] = self.merge_errors.get(error_type, 0) + n
 
     #-------------------------------------------------------------------
     def find_traj_files(self, dir_name):
@@ -321,9 +497,8 @@ class Merger(object):
         """
         result = {}
 
-        traj_files = glob.glob(f'{dir_name}/trajectory_*.csv')
-        for filename in traj_files:
-            basename = os.path.basename(filename)
+        traj_files = sessionindex.get(dir_name).traj_files
+        for basename in traj_files:
             m = re.match(f'^{self.traj_file_prefix}(\\d+)(_(\\d+))?_target_(\\d+).csv$', basename)
             if m is None:
                 print(f'Warning: invalid trajectory file name "{basename}" in {dir_name}')
@@ -332,7 +507,217 @@ class Merger(object):
             subtrial_num = 1 if m.group(3) is None else int(m.group(3))
             result[(trial_id, subtrial_num)] = int(m.group(4))
 
-        return result, [os.path.basename(fn) for fn in traj_files]
+        return result, traj_files
+
+
+#-------------------------------------------------------------------
+class SessionValidationReport(object):
+    """
+    The problems found in one session's trials.csv and trajectory files (see Merger.validate_session)
+
+    - duplicate_trials: (trial_id, sub_trial_num) of trials that appear more than once in trials.csv
+    - missing_traj_files: trajectory files that appear in trials.csv but do not exist
+    - missing_in_trials_csv: (trial_id, sub_trial_num, target_id) of trajectory files that are not in trials.csv
+    """
+
+    def __init__(self, dir_name, duplicate_trials=(), missing_traj_files=(), missing_in_trials_csv=()):
+        self.dir_name = dir_name
+        self.duplicate_trials = [tuple(k) for k in duplicate_trials]
+        self.missing_traj_files = list(missing_traj_files)
+        self.missing_in_trials_csv = [tuple(k) for k in missing_in_trials_csv]
+
+    @property
+    def ok(self):
+        return len(self.duplicate_trials) == 0 and len(self.missing_traj_files) == 0 and len(self.missing_in_trials_csv) == 0
+
+    def error_counts(self):
+        """ The number of problems of each type, as counted in Merger.merge_errors """
+        return dict(N_DUPLICATE_TRIALS=len(self.duplicate_trials),
+                    N_MISSING_TRAJ_FILES=len(self.missing_traj_files),
+                    N_MISSING_IN_TRIALS_CSV=len(self.missing_in_trials_csv))
+
+    def to_dict(self):
+        return dict(dir_name=self.dir_name,
+                    duplicate_trials=[[_json_value(v) for v in k] for k in self.duplicate_trials],
+                    missing_traj_files=self.missing_traj_files,
+                    missing_in_trials_csv=[[_json_value(v) for v in k] for k in self.missing_in_trials_csv])
+
+    @staticmethod
+    def from_dict(d):
+        return SessionValidationReport(d['dir_name'], d['duplicate_trials'], d['missing_traj_files'], d['missing_in_trials_csv'])
+
+    def __repr__(self):
+        return f'SessionValidationReport({self.dir_name}: {self.error_counts()})'
+
+
+def _json_value(value):
+    """ Convert numpy scalars (e.g., trial IDs) to python values """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+#-------------------------------------------------------------------
+class MergedTrialsIndex(object):
+    """
+    Maps the rows of the merged trials and characters data frames to trials (according to the merge key), so values
+    can be copied between trial-level and character-level rows without joining on the merge key.
+    The composite key is hashed once; the data frames must have a RangeIndex, and their rows should not change
+    while the index is used (adding columns is fine).
+    """
+
+    def __init__(self, trials_df, chars_df, merge_key):
+        keys = pd.concat([trials_df[merge_key], chars_df[merge_key]], ignore_index=True)
+        codes = keys.groupby(merge_key, sort=False, dropna=False).ngroup().to_numpy()
+
+        self.n_trials = trials_df.shape[0]
+        self.trial_codes = codes[:self.n_trials]
+        self.char_codes = codes[self.n_trials:]
+        self.n_codes = codes.max() + 1 if len(codes) > 0 else 0
+
+        #-- The trials.csv row of each trial
+        self.trial_row_of_code = self._first_row_per_code(self.trial_codes, np.ones(self.n_trials, dtype=bool))
+
+    def _first_row_per_code(self, codes, selected):
+        """ For each trial: the first selected row (-1 if none) """
+        rows = np.flatnonzero(selected)[::-1]
+        result = np.full(self.n_codes, -1)
+        result[codes[rows]] = rows
+        return result
+
+    def trials_to_chars(self, trial_values):
+        """ Copy a trial-level column to the characters of each trial """
+        return _take_rows(trial_values, self.trial_row_of_code[self.char_codes])
+
+    def chars_to_trials(self, char_values, selected_chars):
+        """ Copy a character-level column to the trials, from one (selected) character per trial """
+        char_row_of_code = self._first_row_per_code(self.char_codes, np.asarray(selected_chars, dtype=bool))
+        return _take_rows(char_values, char_row_of_code[self.trial_codes])
+
+    def chars_to_chars(self, char_values, selected_chars):
+        """ Copy the value of one (selected) character to all characters of the same trial """
+        char_row_of_code = self._first_row_per_code(self.char_codes, np.asarray(selected_chars, dtype=bool))
+        return _take_rows(char_values, char_row_of_code[self.char_codes])
+
+    def adjacent_chars(self, char_nums):
+        """
+        Find the previous and next character of each character: the character with the same trial and
+        char_num - 1 / char_num + 1.
+
+        :return: tuple: (row of the previous character, row of the next character); -1 = none
+        """
+        char_nums = np.asarray(char_nums)
+        order = np.lexsort((char_nums, self.char_codes))
+        sorted_codes = self.char_codes[order]
+        sorted_nums = char_nums[order]
+
+        consecutive = (sorted_codes[1:] == sorted_codes[:-1]) & (sorted_nums[1:] == sorted_nums[:-1] + 1)
+
+        prev_rows = np.full(len(char_nums), -1)
+        next_rows = np.full(len(char_nums), -1)
+        prev_rows[order[1:][consecutive]] = order[:-1][consecutive]
+        next_rows[order[:-1][consecutive]] = order[1:][consecutive]
+        return prev_rows, next_rows
+
+
+def _take_rows(values, rows):
+    """ Get values[rows] as an array; -1 = missing value (NaN) """
+    return values.reset_index(drop=True).reindex(rows).values
+
+
+#-------------------------------------------------------------------
+#-- Columns saved as categorical in the columnar output formats
+categorical_cols = 'subject', 'block', 'char', 'rc'
+
+_columnar_formats = {'.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+
+def _output_format(filename):
+    return _columnar_formats.get(os.path.splitext(filename)[1].lower(), 'csv')
+
+
+def _as_filename_list(filenames):
+    if filenames is None:
+        return []
+    return [filenames] if isinstance(filenames, str) else list(filenames)
+
+
+def _check_output_format_supported(filename):
+    """ Fail before merging (rather than after) if the output file cannot be saved """
+    fmt = _output_format(filename)
+    if fmt == 'csv':
+        return
+
+    engines = ('pyarrow', 'fastparquet') if fmt == 'parquet' else ('pyarrow', )
+    if all(importlib.util.find_spec(engine) is None for engine in engines):
+        raise ImportError(f'Saving {filename} in {fmt} format requires the {" or ".join(engines)} package')
+
+
+#-------------------------------------------------------------------
+def save_merged_data(df, filename, csv_float_format=None):
+    """
+    Save merged trials/characters data. The format is determined by the file extension (see Merger.merge_dataset).
+    In Parquet/Feather format, the values are saved exactly, and the columns in categorical_cols are saved as categorical.
+    """
+    fmt = _output_format(filename)
+    if fmt == 'csv':
+        df.to_csv(filename, index=False, float_format=csv_float_format)
+        return
+
+    df = df.reset_index(drop=True)
+    for col_name in list(df):
+        if col_name in categorical_cols:
+            df[col_name] = df[col_name].astype('category')
+        elif df[col_name].dtype == object:
+            #-- The columnar formats require a single type per column
+            inferred_type = pd.api.types.infer_dtype(df[col_name], skipna=True)
+            if inferred_type == 'mixed-integer-float':
+                df[col_name] = pd.to_numeric(df[col_name])
+            elif inferred_type.startswith('mixed'):
+                df[col_name] = [v if pd.isnull(v) else str(v) for v in df[col_name]]
+
+    if fmt == 'parquet':
+        df.to_parquet(filename, index=False)
+    else:
+        df.to_feather(filename)
+
+
+#-------------------------------------------------------------------
+def load_merged_data(filename):
+    """ Load a file saved by save_merged_data() (or by Merger.merge_dataset) """
+    fmt = _output_format(filename)
+    if fmt == 'parquet':
+        return pd.read_parquet(filename)
+    elif fmt == 'feather':
+        return pd.read_feather(filename)
+    else:
+        return pd.read_csv(filename)
+
+
+#-------------------------------------------------------------------
+def _process_session_job(args):
+    """
+    Load one session (possibly in a worker process, see Merger.merge_dataset) and capture its printouts
+
+    Return a tuple: (trials DataFrame, characters DataFrame, merge_errors counters of this session,
+    SessionValidationReport list of this session, printed output, exception)
+    """
+    merger, subj_id, ds_dir = args
+    all_merge_errors = merger.merge_errors
+    all_validation_reports = merger.validation_reports
+    merger.merge_errors = {error_type: 0 for error_type in all_merge_errors}
+    merger.validation_reports = []
+
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            trials_df, chars_df = merger._process_session(subj_id, ds_dir)
+        return trials_df, chars_df, merger.merge_errors, merger.validation_reports, output.getvalue(), None
+
+    except Exception as e:
+        return None, None, None, None, output.getvalue(), e
+
+    finally:
+        merger.merge_errors = all_merge_errors
+        merger.validation_reports = all_validation_reports
 
 
 #-------------------------------------------------------------------
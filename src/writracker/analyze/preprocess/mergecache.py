@@ -0,0 +1,311 @@
+"""
+On-disk cache of the sessions loaded by Merger.merge_dataset.
+
+For each session, the cache keeps the trials and characters data frames as they are after the DatasetLoaded phase,
+along with the session's printouts, error counters and validation reports. A cache entry is used only if the session's
+fingerprint did not change. The fingerprint covers the session's input files and trajectory files (their size and
+modification time), and the Merger's settings and DatasetLoaded-phase column generators.
+
+The data frames are saved in Feather format if pyarrow is installed (and the data frame can be saved this way),
+and as pickle files otherwise.
+"""
+import enum
+import functools
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import types
+
+import numpy as np
+import pandas as pd
+
+from writracker import commonio
+from writracker import sessionindex
+from writracker import sessionjournal
+import writracker.analyze.preprocess.colgenerators as colgen
+
+
+#-- Change this whenever the content of the cached data frames changes, to invalidate existing cache entries
+_cache_version = '2'
+
+_index_col = '__cache_index__'
+
+
+#-------------------------------------------------------------------------------------------------
+class MergeCache(object):
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    #-------------------------------------------------------------
+    def fingerprint(self, merger, subj_id, ds_dir):
+        """
+        A hash of everything that affects the result of loading the given session
+
+        :return: The hash, or None if the session cannot be cached - i.e., if the identity of some setting or column
+                 generator cannot be determined reliably (see _identity)
+        """
+        try:
+            return self._fingerprint(merger, subj_id, ds_dir)
+        except UnknownIdentityError as e:
+            if merger.trace:
+                print(f'{ds_dir.dir_name} cannot be cached: {e}')
+            return None
+
+    def _fingerprint(self, merger, subj_id, ds_dir):
+        h = hashlib.sha1(_cache_version.encode('utf-8'))
+
+        h.update(_identity((subj_id, ds_dir.dir_name, ds_dir.filename, ds_dir.block_unique)).encode('utf-8'))
+
+        for filename in f'{ds_dir.dir_name}/trials.csv', ds_dir.filename, sessionjournal.journal_path(ds_dir.dir_name):
+            h.update(repr(_file_state(filename)).encode('utf-8'))
+
+        #-- Trajectory files are loaded from their binary version if it exists (see commonio.resolve_trajectory_file)
+        for traj_file in sessionindex.get(ds_dir.dir_name).traj_files:
+            filename = f'{ds_dir.dir_name}/{traj_file}'
+            h.update(repr((traj_file, _file_state(filename),
+                           _file_state(commonio.binary_trajectory_filename(filename)))).encode('utf-8'))
+
+        settings = (merger.trials_csv_converters, merger.traj_file_prefix, merger.has_block_col,
+                    merger.set_response_in_ok_trials, merger.min_ntrials_in_session)
+        generators = [g for g in merger.col_generation.generators if g.phase == colgen.Phase.DatasetLoaded]
+        h.update(_identity((settings, generators)).encode('utf-8'))
+
+        return h.hexdigest()
+
+    #-------------------------------------------------------------
+    def load(self, subj_id, ds_dir, fingerprint):
+        """
+        Get a session's cached data
+
+        :return: tuple (trials_df, chars_df, merge_errors, validation_reports (as dicts), printed output),
+                 or None if the session is not in the cache
+        """
+        base_filename = self._base_filename(subj_id, ds_dir)
+        try:
+            with open(base_filename + '.json', 'r', encoding='utf-8') as fp:
+                info = json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+        if info.get('fingerprint') != fingerprint:
+            return None
+
+        try:
+            trials_df = _load_df(base_filename + '.trials', info['trials_format'])
+            chars_df = _load_df(base_filename + '.chars', info['chars_format'])
+        except (OSError, ValueError, ImportError, pickle.UnpicklingError) as e:
+            print(f'WARNING: the merge cache of {ds_dir.dir_name} could not be loaded ({e}), the session will be re-loaded')
+            return None
+
+        return trials_df, chars_df, info['merge_errors'], info['validation_reports'], info['output']
+
+    #-------------------------------------------------------------
+    def save(self, subj_id, ds_dir, fingerprint, trials_df, chars_df, merge_errors, validation_reports, output):
+        base_filename = self._base_filename(subj_id, ds_dir)
+
+        info = dict(fingerprint=fingerprint,
+                    dir_name=ds_dir.dir_name,
+                    subject=str(subj_id),
+                    trials_format=_save_df(trials_df, base_filename + '.trials'),
+                    chars_format=_save_df(chars_df, base_filename + '.chars'),
+                    merge_errors=merge_errors,
+                    validation_reports=validation_reports,
+                    output=output)
+
+        #-- The info file is written last: an entry without it is not used
+        with open(base_filename + '.json.tmp', 'w', encoding='utf-8') as fp:
+            json.dump(info, fp)
+        os.replace(base_filename + '.json.tmp', base_filename + '.json')
+
+    #-------------------------------------------------------------
+    def _base_filename(self, subj_id, ds_dir):
+        session_id = hashlib.sha1(_identity((subj_id, os.path.abspath(ds_dir.dir_name), ds_dir.filename)).encode('utf-8')).hexdigest()
+        return f'{self.cache_dir}/{session_id}'
+
+
+#-------------------------------------------------------------------------------------------------
+def _save_df(df, base_filename):
+    """ Save a data frame, including its index. Return the format used ('feather' or 'pickle'). """
+
+    if _feather_available() and df.shape[1] > 0 and _index_col not in df:
+        try:
+            df.rename_axis(_index_col).reset_index().to_feather(base_filename + '.feather')
+            return 'feather'
+        except (TypeError, ValueError, ImportError):
+            pass   # e.g. columns with mixed types - save as pickle
+
+    df.to_pickle(base_filename + '.pkl')
+    return 'pickle'
+
+
+def _load_df(base_filename, fmt):
+    if fmt == 'feather':
+        return pd.read_feather(base_filename + '.feather').set_index(_index_col).rename_axis(None)
+    elif fmt == 'pickle':
+        return pd.read_pickle(base_filename + '.pkl')
+    else:
+        raise ValueError(f'Unknown cache format "{fmt}"')
+
+
+def _feather_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+#-------------------------------------------------------------------------------------------------
+class UnknownIdentityError(Exception):
+    """ The identity of an object (e.g., a column generator) cannot be determined reliably, so it cannot be cached """
+    pass
+
+
+def _identity(obj, _visiting=None):
+    """
+    A string that identifies an object (e.g., a column generator), and remains the same across runs.
+
+    Functions are identified by their name, their code (including its constants and nested functions), their default
+    values, the values captured in their closure, and the functions and plain values they use from their module's
+    globals. Other objects are identified by their attributes and their class, including the code of the class's
+    methods (and those of its base classes).
+
+    :raises UnknownIdentityError: For objects whose identity cannot be determined (e.g., objects with neither
+                                  attributes nor a meaningful repr)
+    """
+    if _visiting is None:
+        _visiting = set()
+
+    if obj is None or isinstance(obj, (str, bytes, int, float, complex, bool)):
+        return repr(obj)
+
+    if isinstance(obj, enum.Enum):
+        return str(obj)
+
+    if isinstance(obj, (list, tuple)):
+        return '[' + ','.join(_identity(v, _visiting) for v in obj) + ']'
+
+    if isinstance(obj, (set, frozenset)):
+        return '{' + ','.join(sorted(_identity(v, _visiting) for v in obj)) + '}'
+
+    if isinstance(obj, dict):
+        return '{' + ','.join(sorted(f'{_identity(k, _visiting)}:{_identity(v, _visiting)}' for k, v in obj.items())) + '}'
+
+    if isinstance(obj, np.ndarray):
+        return f'ndarray({obj.dtype},{obj.shape},{hashlib.sha1(obj.tobytes()).hexdigest()})' if obj.dtype != object \
+            else f'ndarray({obj.shape},{_identity(obj.tolist(), _visiting)})'
+
+    if isinstance(obj, (pd.Series, pd.DataFrame, pd.Index)):
+        return f'{type(obj).__name__}({hashlib.sha1(pd.util.hash_pandas_object(obj).values.tobytes()).hexdigest()})'
+
+    if isinstance(obj, types.CodeType):
+        return _code_identity(obj, _visiting)
+
+    if inspect.isbuiltin(obj) or inspect.isclass(obj) or inspect.ismodule(obj) or isinstance(obj, np.ufunc):
+        return f'{getattr(obj, "__module__", "")}.{getattr(obj, "__qualname__", obj.__name__)}'
+
+    #-- Functions, methods and callable objects may refer to themselves (e.g., recursion)
+    if id(obj) in _visiting:
+        return f'<recursive {type(obj).__qualname__}>'
+    _visiting.add(id(obj))
+    try:
+        return _object_identity(obj, _visiting)
+    finally:
+        _visiting.discard(id(obj))
+
+
+def _object_identity(obj, _visiting):
+
+    if inspect.ismethod(obj):
+        return f'{_identity(obj.__func__, _visiting)}@{_identity(obj.__self__, _visiting)}'
+
+    if isinstance(obj, functools.partial):
+        return f'partial({_identity((obj.func, obj.args, obj.keywords), _visiting)})'
+
+    if inspect.isfunction(obj):
+        return _function_identity(obj, _visiting)
+
+    if hasattr(obj, '__dict__'):
+        cls = type(obj)
+        return f'{cls.__module__}.{cls.__qualname__}{_methods_identity(cls, _visiting)}({_identity(vars(obj), _visiting)})'
+
+    if type(obj).__repr__ is object.__repr__ or callable(obj):
+        #-- The default repr is the object's address, and callables may behave differently with the same repr
+        raise UnknownIdentityError(f'the identity of {obj!r} cannot be determined')
+
+    return repr(obj)
+
+
+def _function_identity(func, _visiting):
+
+    closure = [] if func.__closure__ is None else [_cell_identity(cell, _visiting) for cell in func.__closure__]
+
+    #-- The module's functions (helpers) and plain values used by the function
+    used_globals = []
+    for name in sorted(_code_names(func.__code__)):
+        value = func.__globals__.get(name)
+        if (inspect.isfunction(value) and value.__module__ == func.__module__) or _is_plain_value(value):
+            used_globals.append(f'{name}={_identity(value, _visiting)}')
+
+    return '{}.{}:{}({};{};{};{})'.format(func.__module__, func.__qualname__, _code_identity(func.__code__, _visiting),
+                                          _identity(func.__defaults__, _visiting), _identity(func.__kwdefaults__, _visiting),
+                                          ','.join(closure), ','.join(used_globals))
+
+
+def _methods_identity(cls, _visiting):
+    """ The functions defined in a class and its base classes (except for built-in classes) """
+    methods = []
+    for c in cls.__mro__:
+        if c.__module__ == 'builtins':
+            continue
+        for name, value in sorted(vars(c).items()):
+            if isinstance(value, (staticmethod, classmethod)):
+                funcs = value.__func__,
+            elif isinstance(value, property):
+                funcs = value.fget, value.fset, value.fdel
+            else:
+                funcs = value,
+            if any(inspect.isfunction(f) for f in funcs):
+                funcs_id = ','.join(_identity(f, _visiting) if inspect.isfunction(f) else '' for f in funcs)
+                methods.append(f'{c.__qualname__}.{name}={funcs_id}')
+
+    return '[' + ','.join(methods) + ']'
+
+
+def _code_identity(code, _visiting):
+    consts = ','.join(_identity(c, _visiting) for c in code.co_consts)
+    return hashlib.sha1(code.co_code + repr(code.co_names).encode('utf-8') + consts.encode('utf-8')).hexdigest()
+
+
+def _code_names(code):
+    """ The global names used by a code object and its nested code objects (e.g., lambdas) """
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            names.update(_code_names(c))
+    return names
+
+
+def _cell_identity(cell, _visiting):
+    try:
+        return _identity(cell.cell_contents, _visiting)
+    except ValueError:
+        return '<empty cell>'
+
+
+def _is_plain_value(value):
+    if value is None or isinstance(value, (str, bytes, int, float, complex, bool, enum.Enum)):
+        return True
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(_is_plain_value(v) for v in value)
+    if isinstance(value, dict):
+        return all(_is_plain_value(k) and _is_plain_value(v) for k, v in value.items())
+    return False
+
+
+def _file_state(filename):
+    if not os.path.exists(filename):
+        return None
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
@@ -1,5 +1,8 @@
 
 import csv
+import os
+
+import numpy as np
 
 
 #-------------------------------------------------------------------------------------------------
@@ -10,6 +13,12 @@ def load_trajectory(filename):
     The file starts with name=value lines.
     Then, there must be a line saying "trajectory", followed by a CSV format
     """
+    filename = resolve_trajectory_file(filename)
+    if is_binary_trajectory_file(filename):
+        records = load_binary_trajectory(filename)
+        return [TrajectoryPoint(x, y, prs, t) for x, y, prs, t in
+                zip(records['x'].tolist(), records['y'].tolist(), records['pressure'].tolist(), records['time'].tolist())]
+
     with open(filename, 'r') as fp:
         reader = csv.DictReader(fp)
         trajectory = []
@@ -39,8 +48,183 @@ class TrajectoryPoint(object):
     A single point recorded from the pen
     """
 
+    __slots__ = ('x', 'y', 'z', 't')
+
     def __init__(self, x, y, z, t):
         self.x = x
         self.y = y
         self.z = z
         self.t = t
+
+
+#============================================================================================================
+#region        Binary trajectory files
+#============================================================================================================
+
+# A binary trajectory file is a header followed by fixed-size little-endian records, one per sample.
+# The records always have all the fields below; the header's "columns" bitmask says which of them exist
+# in the corresponding CSV file (so the CSV file can be restored with the same columns and values).
+# CSV files with other columns are not converted, as these columns would be lost.
+
+traj_binary_magic = b'WTTRAJ'
+traj_binary_version = 2
+traj_binary_extension = '.wtraj'
+
+traj_binary_header_dtype = np.dtype([('magic', 'S6'), ('version', '<u2'), ('columns', '<u2'), ('reserved', '<u2'),
+                                     ('n_records', '<u8')])
+
+traj_binary_dtype = np.dtype([('char_num', '<i4'), ('stroke', '<i4'), ('pen_down', '<i4'),
+                              ('x', '<f8'), ('y', '<f8'), ('pressure', '<f8'), ('time', '<f8'), ('on_paper', '<i4')])
+
+traj_binary_columns = traj_binary_dtype.names
+
+#-- The record format of each file version. Version 1 files had no on_paper field.
+_traj_binary_dtypes = {
+    1: np.dtype([(c, traj_binary_dtype[c]) for c in traj_binary_columns if c != 'on_paper']),
+    traj_binary_version: traj_binary_dtype,
+}
+
+
+#--------------------------------------
+def binary_trajectory_filename(filename):
+    """ The name of the binary file corresponding with a CSV trajectory file """
+    return os.path.splitext(filename)[0] + traj_binary_extension
+
+
+#--------------------------------------
+def is_binary_trajectory_file(filename):
+    with open(filename, 'rb') as fp:
+        return fp.read(len(traj_binary_magic)) == traj_binary_magic
+
+
+#--------------------------------------
+def resolve_trajectory_file(filename):
+    """
+    Get the file from which a trajectory should be loaded: for a CSV file that has a binary version which is
+    at least as new as the CSV file, the binary file is used.
+    """
+    bin_filename = binary_trajectory_filename(filename)
+    if bin_filename != filename and os.path.isfile(bin_filename) and \
+            (not os.path.isfile(filename) or os.stat(bin_filename).st_mtime_ns >= os.stat(filename).st_mtime_ns):
+        return bin_filename
+
+    return filename
+
+
+#--------------------------------------
+def load_binary_trajectory(filename, with_columns=False):
+    """
+    Load a binary trajectory file. The file is memory-mapped, not read.
+
+    :return: A read-only NumPy structured array (traj_binary_dtype; for older files, some fields may be missing),
+             one entry per sample.
+             If with_columns=True, return a tuple: (array, names of the columns in the original CSV file)
+    """
+    header = np.fromfile(filename, dtype=traj_binary_header_dtype, count=1)
+    if len(header) == 0 or header['magic'][0] != traj_binary_magic:
+        raise ValueError('{} is not a binary trajectory file'.format(filename))
+    version = int(header['version'][0])
+    if version not in _traj_binary_dtypes:
+        raise ValueError('Unsupported binary trajectory file version ({}) in {}'.format(version, filename))
+    dtype = _traj_binary_dtypes[version]
+
+    n_records = int(header['n_records'][0])
+    expected_size = traj_binary_header_dtype.itemsize + n_records * dtype.itemsize
+    if os.path.getsize(filename) != expected_size:
+        raise ValueError('Invalid binary trajectory file {}: expecting {} records'.format(filename, n_records))
+
+    if n_records == 0:
+        records = np.zeros(0, dtype=dtype)
+    else:
+        records = np.memmap(filename, dtype=dtype, mode='r', offset=traj_binary_header_dtype.itemsize,
+                            shape=(n_records,))
+
+    if with_columns:
+        columns_mask = int(header['columns'][0])
+        columns = [c for i, c in enumerate(traj_binary_columns) if columns_mask & (1 << i)]
+        return records, columns
+    else:
+        return records
+
+
+#--------------------------------------
+def save_binary_trajectory(filename, records, columns=traj_binary_columns):
+    """
+    Save a binary trajectory file
+
+    :param records: A NumPy structured array with (some of) the fields of traj_binary_dtype
+    :param columns: The columns that exist in the corresponding CSV file
+    """
+    out = np.zeros(len(records), dtype=traj_binary_dtype)
+    for name in records.dtype.names:
+        if name in traj_binary_columns:
+            out[name] = records[name]
+
+    header = np.zeros(1, dtype=traj_binary_header_dtype)
+    header['magic'] = traj_binary_magic
+    header['version'] = traj_binary_version
+    header['columns'] = sum(1 << traj_binary_columns.index(c) for c in columns)
+    header['n_records'] = len(out)
+
+    with open(filename, 'wb') as fp:
+        fp.write(header.tobytes())
+        fp.write(out.tobytes())
+
+
+#--------------------------------------
+def csv_to_binary_trajectory(csv_filename, bin_filename=None):
+    """
+    Convert a trajectory CSV file (recorder or encoder format) to a binary file
+    :return: The binary file name
+    """
+    if bin_filename is None:
+        bin_filename = binary_trajectory_filename(csv_filename)
+
+    with open(csv_filename, 'r') as fp:
+        reader = csv.DictReader(fp)
+        columns = [c for c in traj_binary_columns if c in (reader.fieldnames or [])]
+        missing = [c for c in ('x', 'y', 'pressure', 'time') if c not in columns]
+        if len(missing) > 0:
+            raise ValueError('Invalid trajectory file {}: missing columns ({})'.format(csv_filename, ', '.join(missing)))
+        unknown = [c for c in reader.fieldnames if c not in traj_binary_columns]
+        if len(unknown) > 0:
+            raise ValueError('Trajectory file {} cannot be converted to binary: unsupported columns ({})'.format(
+                csv_filename, ', '.join(unknown)))
+
+        rows = [tuple(parse_traj_value(line, c, reader.line_num, csv_filename) for c in columns) for line in reader]
+
+    records = np.array(rows, dtype=[(c, traj_binary_dtype[c]) for c in columns]) if len(rows) > 0 \
+        else np.zeros(0, dtype=traj_binary_dtype)
+    save_binary_trajectory(bin_filename, records, columns)
+
+    return bin_filename
+
+
+#--------------------------------------
+def binary_to_csv_trajectory(bin_filename, csv_filename=None):
+    """
+    Convert a binary trajectory file to CSV, with the columns of the CSV file from which it was created
+    :return: The CSV file name
+    """
+    if csv_filename is None:
+        csv_filename = os.path.splitext(bin_filename)[0] + '.csv'
+
+    records, columns = load_binary_trajectory(bin_filename, with_columns=True)
+
+    with open(csv_filename, 'w') as fp:
+        writer = csv.writer(fp, lineterminator='\n')
+        writer.writerow(columns)
+        values = [records[c].tolist() for c in columns]
+        for row in zip(*values):
+            writer.writerow([_format_traj_value(v) for v in row])
+
+    return csv_filename
+
+
+#--------------------------------------
+def _format_traj_value(value):
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+#endregion
@@ -4,10 +4,10 @@ Functions that take care of generating character-level information according to
 import csv
 import inspect
 import os
+import threading
 import numpy as np
 from collections import OrderedDict
-
-import math
+from concurrent.futures import ThreadPoolExecutor
 
 import writracker.utils as u
 
@@ -19,12 +19,22 @@ class BaseValueGenerator(object):
     Each call to generate_values() returns a value per character.
     This value can be either a scalar or a list of values, to be stored in different CSV fields.
     There are two different subclasses - one to call the generator function once per character, and one to call it once per trial.
+
+    A generator may also have a vectorized form, which computes the values of all characters (in all trials) at once:
+    a function that gets a CharTable and returns a sequence of values (one per character) - or, if there are several
+    output fields, a sequence of such columns. If 'func' has a 'vectorized' method, it is used by default.
+
+    A generator declares the fields it reads from the values generated by previous generators (in_fields). This is
+    used to schedule the generators (see schedule_value_generators). If 'func' has an 'in_fields' attribute, it is used
+    by default.
     """
 
-    def __init__(self, func, out_fields):
+    def __init__(self, func, out_fields, vectorized=None, in_fields=None):
         """
         :param func: A function that can compute a character-level value. The function signature is described in the sub-classes below
         :param out_fields: Name(s) of the functino's output fields
+        :param vectorized: The vectorized form of 'func' (see above)
+        :param in_fields: Name(s) of the fields that the function reads. None = unknown (may read any field).
         """
         if isinstance(out_fields, str):
             out_fields = [out_fields]
@@ -37,8 +47,15 @@ class BaseValueGenerator(object):
         self.out_fields = out_fields
 
         self.func = func
+        self.vectorized = vectorized if vectorized is not None else getattr(func, 'vectorized', None)
         self.save_as_char_attr = False
 
+        if in_fields is None:
+            in_fields = getattr(func, 'in_fields', None)
+        if isinstance(in_fields, str):
+            in_fields = [in_fields]
+        self.in_fields = None if in_fields is None else tuple(in_fields)
+
     #--------------------------------------------------
     def save_values_on_character(self, gen_values, character, csv_row):
         """
@@ -59,6 +76,53 @@ class BaseValueGenerator(object):
                 except AttributeError:
                     raise AttributeError("Can't set attribute '{:}' of character".format(field))
 
+    #--------------------------------------------------
+    def generate_columns(self, table):
+        """
+        Generate the values of all characters in a CharTable.
+        Return a list with one column (list of values) per output field.
+        """
+        if self.vectorized is None:
+            return self._generate_columns_per_trial(table)
+
+        columns = self.vectorized(table)
+        if len(self.out_fields) == 1:
+            columns = [columns]
+
+        if len(columns) != len(self.out_fields):
+            raise ValueError("the generator {:} was expected to return {:} columns ({:}) but it returned {:} columns".
+                             format(self.vectorized, len(self.out_fields), ", ".join(self.out_fields), len(columns)))
+
+        columns = [col.tolist() if isinstance(col, np.ndarray) else list(col) for col in columns]
+        for col in columns:
+            if len(col) != len(table):
+                raise ValueError("the generator {:} returned {:} values, expected one per character ({:})".format(self.vectorized, len(col), len(table)))
+
+        if self.save_as_char_attr:
+            for i, char in enumerate(table.characters):
+                self.save_values_on_character(columns[0][i] if len(columns) == 1 else [col[i] for col in columns], char, dict())
+
+        return columns
+
+    def _generate_columns_per_trial(self, table):
+        """ Generate the values of a CharTable by calling generate_values() for each trial """
+        columns = [[None] * len(table) for _ in self.out_fields]
+
+        for trial, rows in table.rows_per_trial():
+            csv_row_per_char = OrderedDict((table.characters[r].char_num, table.row_values(r, self.in_fields)) for r in rows)
+            row_of_char = {table.characters[r].char_num: r for r in rows}
+
+            values_per_char = self.generate_values(trial, csv_row_per_char)
+            for value, char in zip(values_per_char, trial.characters):
+                if char.char_num not in row_of_char:
+                    continue
+                csv_row = dict()
+                self.save_values_on_character(value, char, csv_row)
+                for col, field in zip(columns, self.out_fields):
+                    col[row_of_char[char.char_num]] = csv_row[field]
+
+        return columns
+
 
 #-----------------------------------------------------------------------------------------------------
 class ValueGenerator(BaseValueGenerator):
@@ -77,13 +141,16 @@ class ValueGenerator(BaseValueGenerator):
     If 'same_value_for_all_chars' is False, the generator function creates one value/tuple per character in the trial.
     """
 
-    def __init__(self, func, out_fields):
-        super().__init__(func, out_fields)
+    def __init__(self, func, out_fields, vectorized=None, in_fields=None):
+        super().__init__(func, out_fields, vectorized, in_fields)
 
         func_signature = inspect.signature(self.func)
         self.trial_extra_values_arg = 'trial_extra_values' in func_signature.parameters
         self.char_extra_values_arg = 'extra_values' in func_signature.parameters
 
+        if self.in_fields is None and not (self.trial_extra_values_arg or self.char_extra_values_arg):
+            self.in_fields = ()
+
         #-- Choose the appropriate generate_values method based on the function signature
         if self.trial_extra_values_arg and self.char_extra_values_arg:
             self._gen_func = self._gen_with_both_extra_values
@@ -134,13 +201,16 @@ class TrialLevelValueGenerator(BaseValueGenerator):
     If 'same_value_for_all_chars' is False, the generator function creates one value/tuple per character in the trial.
     """
 
-    def __init__(self, func, out_fields, same_value_for_all_chars=True):
-        super().__init__(func, out_fields)
+    def __init__(self, func, out_fields, same_value_for_all_chars=True, vectorized=None, in_fields=None):
+        super().__init__(func, out_fields, vectorized, in_fields)
         self.same_value_for_all_chars = same_value_for_all_chars
 
         func_signature = inspect.signature(self.func)
         self.extra_values_arg = 'extra_values' in func_signature.parameters
 
+        if self.in_fields is None and not self.extra_values_arg:
+            self.in_fields = ()
+
 
     def generate_values(self, trial, extra_values):
         if self.extra_values_arg:
@@ -161,6 +231,108 @@ class TrialLevelValueGenerator(BaseValueGenerator):
         return result
 
 
+#-----------------------------------------------------------------------------------------------------
+class CharTable(object):
+    """
+    The characters of several trials, with one row per character. This is the input of vectorized value generators,
+    which compute a column (a value per character) for all characters at once.
+    """
+
+    def __init__(self, trials, char_filter=None):
+        self.trials = list(trials)
+        self.characters = []
+        trial_index = []
+
+        for i, trial in enumerate(self.trials):
+            characters = trial.characters if char_filter is None else [c for c in trial.characters if char_filter(c, trial)]
+
+            #-- One row per character number (if a number repeats, the last character is used)
+            chars_by_num = OrderedDict()
+            for char in characters:
+                chars_by_num[char.char_num] = char
+
+            self.characters.extend(chars_by_num.values())
+            trial_index.extend([i] * len(chars_by_num))
+
+        #-- For each row: the index of its trial in self.trials
+        self.trial_index = np.array(trial_index, dtype=int)
+        self.char_num = np.array([c.char_num for c in self.characters], dtype=int)
+
+        #-- The values generated so far (column name -> list of values)
+        self.columns = OrderedDict()
+
+        self._memoized = dict()
+        self._memoize_locks = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.characters)
+
+    #--------------------------------------------------
+    def per_trial(self, trial_values):
+        """ Convert a list with one value per trial into a list with one value per character """
+        trial_values = list(trial_values)
+        return [trial_values[i] for i in self.trial_index.tolist()]
+
+    def trial_attr(self, attr_name):
+        """ A trial attribute, for each character """
+        return self.per_trial(getattr(trial, attr_name) for trial in self.trials)
+
+    def rows_per_trial(self):
+        """ Iterate over the trials that have characters. For each trial, return (trial, list of row numbers) """
+        boundaries = np.flatnonzero(np.diff(self.trial_index)) + 1
+        for rows in np.split(np.arange(len(self)), boundaries) if len(self) > 0 else []:
+            yield self.trials[self.trial_index[rows[0]]], rows.tolist()
+
+    def row_values(self, row, fields=None):
+        """ The values generated so far for one character (name -> value); only the given fields, if specified """
+        if fields is None:
+            return {name: col[row] for name, col in self.columns.items()}
+        return {name: self.columns[name][row] for name in fields if name in self.columns}
+
+    def memoize(self, key, compute):
+        """
+        Get a value that was computed from the table (e.g. an intermediate result that several generators need).
+        The value is computed (by calling compute()) only once, even if several threads request it.
+        """
+        with self._lock:
+            if key in self._memoized:
+                return self._memoized[key]
+            key_lock = self._memoize_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if key not in self._memoized:
+                self._memoized[key] = compute()
+            return self._memoized[key]
+
+    def column(self, name):
+        """ A previously-generated column, as a float array (None = NaN) """
+        return np.array([np.nan if v is None else v for v in self.columns[name]], dtype=float)
+
+    #--------------------------------------------------
+    def char_row(self, char_num_delta):
+        """
+        For each character, find the row of the character in the same trial whose number is char_num + char_num_delta.
+        Return an array of row numbers (-1 if there is no such character).
+        """
+        def compute():
+            row_of_char = {(t, n): r for r, (t, n) in enumerate(zip(self.trial_index.tolist(), self.char_num.tolist()))}
+            return np.array([row_of_char.get((t, n + char_num_delta), -1)
+                             for t, n in zip(self.trial_index.tolist(), self.char_num.tolist())], dtype=int)
+
+        return self.memoize(('char_row', char_num_delta), compute)
+
+    @property
+    def char_times(self):
+        """ Arrays with the time of each character's first point and last point """
+        def compute():
+            t0 = np.array([c.strokes[0].trajectory[0].t for c in self.characters], dtype=float)
+            t_end = np.array([c.strokes[-1].trajectory[-1].t for c in self.characters], dtype=float)
+            return t0, t_end
+
+        return self.memoize('char_times', compute)
+
+
 #-----------------------------------------------------------------------------------------------------
 class CharBoundingBox(object):
 
@@ -187,8 +359,13 @@ class CharBoundingBox(object):
         return self.ymin + self.height / 2
 
 
+#-- The fields saved for each character, before the fields of the value generators
+_base_fields = 'trial_id', 'sub_trial_num', 'target_id', 'target', 'char_num', 'char'
+
+
 #-----------------------------------------------------------------------------------------------------
-def generate_char_level_custom_values(trials, value_generators=(), trial_filter=None, char_filter=None, out_filename=None, append=False):
+def generate_char_level_custom_values(trials, value_generators=(), trial_filter=None, char_filter=None, out_filename=None, append=False,
+                                      vectorized=None, out_fields=None, n_threads=None):
     """
     Compute an aggregate value (or values) per trajectory section, and potentially save to CSV
 
@@ -198,12 +375,36 @@ def generate_char_level_custom_values(trials, value_generators=(), trial_filter=
     :param char_filter: Function for filtering trials: function(character, trial) -> bool (return False for trials to exclude)
                              (return False for trajectory sections to exclude)
     :param out_filename: File name in which the return value will be saved (CSV format)
+    :param vectorized: Whether to compute the values with generate_char_level_columns() - all characters at once.
+                       None = do so if all value generators have a vectorized form.
+    :param out_fields: The generated fields to save (None = all). Generators that are not needed for computing these
+                       fields are not called (see schedule_value_generators).
+    :param n_threads: Max. number of threads for running independent value generators in parallel (vectorized mode only).
+                      1 = run the generators one by one.
     """
     assert len(value_generators) > 0, "No value generators were provided"
     for generator in value_generators:
         assert isinstance(generator, BaseValueGenerator), \
             'Invalid value generator ({:}): expecting a value-genrator object'.format(generator)
 
+    stages = schedule_value_generators(value_generators, out_fields)
+    value_generators = _scheduled_in_declared_order(value_generators, stages)
+
+    if vectorized is None:
+        vectorized = all(generator.vectorized is not None for generator in value_generators)
+
+    if out_fields is None:
+        generated_fields = [field for func_spec in value_generators for field in func_spec.out_fields]
+    else:
+        generated_fields = [f for f in OrderedDict.fromkeys(out_fields) if f not in _base_fields]
+    csv_fieldnames = list(_base_fields) + generated_fields
+
+    if vectorized:
+        columns = _generate_char_level_columns(trials, stages, value_generators, trial_filter, char_filter, n_threads)
+        if out_filename is not None:
+            _save_columns_csv(out_filename, csv_fieldnames, columns, append)
+        return
+
     #-- Filter trials
     if trial_filter is not None:
         trials = [t for t in trials if trial_filter(t)]
@@ -230,15 +431,13 @@ def generate_char_level_custom_values(trials, value_generators=(), trial_filter=
 
     #-- Save to CSV
     if out_filename is not None:
-        csv_fieldnames = ['trial_id', 'sub_trial_num', 'target_id', 'target', 'char_num', 'char'] + \
-                        [field for func_spec in value_generators for field in func_spec.out_fields]
 
         if not os.path.exists(out_filename):
             append = False
 
         with open(out_filename, 'a' if append else 'w', encoding='utf-8') as fp:
 
-            writer = csv.DictWriter(fp, csv_fieldnames, lineterminator='\n')
+            writer = csv.DictWriter(fp, csv_fieldnames, lineterminator='\n', extrasaction='ignore')
 
             if not append:
                 writer.writeheader()
@@ -247,6 +446,166 @@ def generate_char_level_custom_values(trials, value_generators=(), trial_filter=
                 writer.writerow(row)
 
 
+#---------------------------------------------------------------------------------
+def _save_columns_csv(out_filename, csv_fieldnames, columns, append):
+    """ Save the result of generate_char_level_columns() to a CSV file """
+
+    if not os.path.exists(out_filename):
+        append = False
+
+    with open(out_filename, 'a' if append else 'w', encoding='utf-8') as fp:
+
+        writer = csv.writer(fp, lineterminator='\n')
+
+        if not append:
+            writer.writerow(csv_fieldnames)
+
+        writer.writerows(zip(*[columns[f] for f in csv_fieldnames]))
+
+
+#---------------------------------------------------------------------------------
+def generate_char_level_columns(trials, value_generators, trial_filter=None, char_filter=None, out_fields=None, n_threads=None):
+    """
+    Compute the values of all characters in the given trials, one value generator at a time: generators that have
+    a vectorized form compute all characters at once (the others are called per trial).
+    Generators that do not depend on each other run in parallel threads.
+
+    Arguments are as in generate_char_level_custom_values().
+
+    :return: OrderedDict: column name -> list of values (one per character)
+    """
+    stages = schedule_value_generators(value_generators, out_fields)
+    value_generators = _scheduled_in_declared_order(value_generators, stages)
+    return _generate_char_level_columns(trials, stages, value_generators, trial_filter, char_filter, n_threads)
+
+
+def _scheduled_in_declared_order(value_generators, stages):
+    """ The generators that were scheduled, in the order they were declared (which determines the column order) """
+    scheduled = {id(generator) for stage in stages for generator in stage}
+    return [generator for generator in value_generators if id(generator) in scheduled]
+
+
+def _generate_char_level_columns(trials, stages, value_generators, trial_filter, char_filter, n_threads):
+    """
+    Run the generators stage by stage; return the columns ordered by the generators' declaration order (value_generators)
+    """
+
+    if trial_filter is not None:
+        trials = [t for t in trials if trial_filter(t)]
+
+    table = CharTable(trials, char_filter)
+
+    columns = table.columns
+    columns['trial_id'] = table.trial_attr('trial_id')
+    columns['sub_trial_num'] = table.trial_attr('sub_trial_num')
+    columns['target_id'] = table.trial_attr('target_id')
+    columns['target'] = table.trial_attr('stimulus')
+    columns['char_num'] = table.char_num.tolist()
+    columns['char'] = _response_char_column(table)
+
+    max_stage_size = max([len(stage) for stage in stages] + [1])
+    n_threads = max_stage_size if n_threads is None else min(n_threads, max_stage_size)
+
+    if n_threads <= 1:
+        for stage in stages:
+            for generator in stage:
+                _save_generated_columns(generator, generator.generate_columns(table), columns)
+
+    else:
+        #-- The generators of a stage read only columns from previous stages, so the columns are updated after each stage
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for stage in stages:
+                results = [executor.submit(generator.generate_columns, table) for generator in stage]
+                for generator, result in zip(stage, results):
+                    _save_generated_columns(generator, result.result(), columns)
+
+    ordered_columns = OrderedDict((field, columns[field]) for field in _base_fields)
+    for generator in value_generators:
+        for field in generator.out_fields:
+            ordered_columns[field] = columns[field]
+
+    return ordered_columns
+
+
+def _save_generated_columns(generator, generated_columns, columns):
+    for field, col in zip(generator.out_fields, generated_columns):
+        columns[field] = col
+
+
+#---------------------------------------------------------------------------------
+def schedule_value_generators(value_generators, out_fields=None):
+    """
+    Arrange value generators according to their dependencies: each generator depends on the earlier generators that
+    produce its in_fields (a generator with in_fields=None depends on all earlier generators), and on earlier
+    generators that read or produce the same fields it produces. Running the generators stage by stage yields the
+    same values as running them one by one in the original order.
+
+    :param out_fields: The fields that are required (None = all). Generators that are not needed for computing these
+                       fields are skipped.
+    :return: A list of stages; each stage is a list of generators that depend only on generators in previous stages
+    """
+    value_generators = list(value_generators)
+    n = len(value_generators)
+
+    #-- For each generator: the earlier generators whose output it reads
+    reads = []
+    latest_producer = dict()
+    for i, generator in enumerate(value_generators):
+        if generator.in_fields is None:
+            reads.append(set(range(i)))
+        else:
+            reads.append({latest_producer[f] for f in generator.in_fields if f in latest_producer})
+        for f in generator.out_fields:
+            latest_producer[f] = i
+
+    #-- Find the generators needed for the requested fields
+    if out_fields is None:
+        needed = set(range(n))
+    else:
+        missing = [f for f in out_fields if f not in latest_producer and f not in _base_fields]
+        if len(missing) > 0:
+            raise ValueError('None of the value generators produces the field/s {:}'.format(', '.join(missing)))
+
+        needed = set()
+        pending = [latest_producer[f] for f in out_fields if f in latest_producer]
+        while len(pending) > 0:
+            i = pending.pop()
+            if i not in needed:
+                needed.add(i)
+                pending.extend(reads[i])
+
+    #-- Assign each generator to the stage after all the generators it depends on
+    stage_of = dict()
+    for i in sorted(needed):
+        generator = value_generators[i]
+        deps = set(reads[i])
+        for j in range(i):
+            prev = value_generators[j]
+            if any(f in prev.out_fields for f in generator.out_fields):
+                deps.add(j)  # both produce the same field: the later one should win
+            elif prev.in_fields is None or any(f in prev.in_fields for f in generator.out_fields):
+                deps.add(j)  # the earlier one may read a field that this generator overwrites
+        stage_of[i] = 1 + max([stage_of[j] for j in deps if j in needed] + [-1])
+
+    stages = [[] for _ in range(max(stage_of.values()) + 1)] if len(stage_of) > 0 else []
+    for i in sorted(needed):
+        stages[stage_of[i]].append(value_generators[i])
+
+    return stages
+
+
+#---------------------------------------------------------------------------------
+def _response_char_column(table):
+    """ The 'char' column: the response character of each character (see _populate_response) """
+    result = []
+    for trial, rows in table.rows_per_trial():
+        characters = [table.characters[r] for r in rows]
+        csv_row_per_char = OrderedDict((c.char_num, dict(char='')) for c in characters)
+        _populate_response(characters, csv_row_per_char, trial)
+        result.extend(row['char'] for row in csv_row_per_char.values())
+    return result
+
+
 #---------------------------------------------------------------------------------
 def _apply_value_generators_to_trial(value_generators, trial, char_filter):
 
@@ -342,14 +701,29 @@ class GetTrialBoundingBox(object):
     #----------------------------------------------------------------
     def __call__(self, trial):
 
-        points = [pt for pt in trial.traj_points if pt.z > 0] if self.only_on_paper else trial.traj_points
-        bbox = get_bounding_box_traj(points,
-                                     fraction_of_x_points=self.fraction_of_x_points,
-                                     fraction_of_y_points=self.fraction_of_y_points)
+        bbox = get_trial_bounding_box(trial, fraction_of_x_points=self.fraction_of_x_points,
+                                      fraction_of_y_points=self.fraction_of_y_points,
+                                      points='on_paper' if self.only_on_paper else 'all')
 
         values = tuple(getattr(bbox, col.fld_name) for col in self.columns)
         return values[0] if len(self.columns) == 1 else values
 
+    #----------------------------------------------------------------
+    def vectorized(self, table):
+        trial_inds = np.unique(table.trial_index)
+
+        def compute():
+            trajectories = [table.trials[i].on_paper_points if self.only_on_paper else table.trials[i].traj_points for i in trial_inds]
+            return _bounding_box_arrays(trajectories, self.fraction_of_x_points, self.fraction_of_y_points)
+
+        bbox_arrays = table.memoize(('trial_bounding_box', self.only_on_paper, self.fraction_of_x_points, self.fraction_of_y_points), compute)
+        trial_values = _bounding_box_columns(bbox_arrays, self.columns)
+
+        #-- Each trial's value, for each of its characters
+        row_inds = np.searchsorted(trial_inds, table.trial_index)
+        columns = [col[row_inds] for col in trial_values]
+        return columns[0] if len(self.columns) == 1 else columns
+
 
 #-----------------------------------------------------------------------------------------------------
 class NormalizeByCharWidth(object):
@@ -363,6 +737,7 @@ class NormalizeByCharWidth(object):
         """
         self.src_cols = src_cols
         self.trial_width_col = trial_width_col
+        self.in_fields = tuple(src_cols) + (trial_width_col, )
 
     def __call__(self, trial, character, extra_values):
         char_width = extra_values[self.trial_width_col] / len(trial.characters)
@@ -371,6 +746,12 @@ class NormalizeByCharWidth(object):
 
         return tuple(extra_values[col] / char_width for col in self.src_cols)
 
+    def vectorized(self, table):
+        char_width = table.column(self.trial_width_col) / np.array(table.per_trial(len(t.characters) for t in table.trials), dtype=float)
+        valid = char_width > 0
+        return [[v if ok else None for v, ok in zip((table.column(col) / char_width).tolist(), valid.tolist())]
+                for col in self.src_cols]
+
 
 #-----------------------------------------------------------------------------------------------------
 class GetCharBoundingBox(object):
@@ -401,10 +782,25 @@ class GetCharBoundingBox(object):
 
     #---------------------------------------------------------------
     def __call__(self, trial, character):
-        bbox = get_bounding_box(character, self.fraction_of_x_points, self.fraction_of_y_points)
+        char_inds = _cached_on_trial(trial, 'char_inds', lambda: {id(c): i for i, c in enumerate(trial.characters)})
+        char_ind = char_inds.get(id(character))
+        if char_ind is None:
+            bbox = get_bounding_box(character, self.fraction_of_x_points, self.fraction_of_y_points)
+        else:
+            bbox = _nonempty_bbox(get_char_bounding_boxes(trial, self.fraction_of_x_points, self.fraction_of_y_points)[char_ind])
         flds = tuple(getattr(bbox, col.fld_name) for col in self.columns)
         return flds[0] if len(self.columns) == 1 else flds
 
+    #---------------------------------------------------------------
+    def vectorized(self, table):
+        def compute():
+            trajectories = [[stroke.trajectory for stroke in c.strokes if stroke.on_paper] for c in table.characters]
+            return _bounding_box_arrays(trajectories, self.fraction_of_x_points, self.fraction_of_y_points, grouped=True)
+
+        bbox_arrays = table.memoize(('char_bounding_box', self.fraction_of_x_points, self.fraction_of_y_points), compute)
+        columns = _bounding_box_columns(bbox_arrays, self.columns)
+        return columns[0] if len(self.columns) == 1 else columns
+
 
 #------------------------------------------------------------------------------------
 def get_bounding_box(character, fraction_of_x_points=None, fraction_of_y_points=None):
@@ -418,8 +814,8 @@ def get_bounding_box(character, fraction_of_x_points=None, fraction_of_y_points=
     :param fraction_of_x_points: Percentage of x coordinates that must be in the trajectory. Value between 0 and 1.
     :param fraction_of_y_points: Percentage of y coordinates that must be in the trajectory. Value between 0 and 1.
     """
-    points = [pt for stroke in character.strokes if stroke.on_paper for pt in stroke.trajectory]
-    return get_bounding_box_traj(points, fraction_of_x_points=fraction_of_x_points, fraction_of_y_points=fraction_of_y_points)
+    trajectories = [stroke.trajectory for stroke in character.strokes if stroke.on_paper]
+    return _nonempty_bbox(_get_bounding_boxes([trajectories], fraction_of_x_points, fraction_of_y_points, grouped=True)[0])
 
 
 #----------------------------------------------------------------
@@ -434,26 +830,153 @@ def get_bounding_box_traj(trajectory, fraction_of_x_points=None, fraction_of_y_p
     :param fraction_of_x_points: Percentage of x coordinates that must be in the trajectory. Value between 0 and 1.
     :param fraction_of_y_points: Percentage of y coordinates that must be in the trajectory. Value between 0 and 1.
     """
+    return _nonempty_bbox(_get_bounding_boxes([trajectory], fraction_of_x_points, fraction_of_y_points)[0])
 
-    (x) = ([float(pt.x) for pt in trajectory])
-    (y) = ([float(pt.y) for pt in trajectory])
 
-    if fraction_of_x_points is not None and 0 < fraction_of_x_points < 1:
-        xmin, xmax = find_interval_containing(x, fraction_of_x_points, in_place=True)
-    else:
-        xmin = min(x)
-        xmax = max(x)
+#----------------------------------------------------------------
+def _nonempty_bbox(bbox):
+    if bbox is None:
+        raise ValueError('Cannot compute the bounding box of an empty trajectory')
+    return bbox
 
-    if fraction_of_y_points is not None and 0 < fraction_of_x_points < 1:
-        ymin, ymax = find_interval_containing(y, fraction_of_y_points, in_place=True)
-    else:
-        ymin = min(y)
-        ymax = max(y)
 
-    w = xmax - xmin
-    h = ymax - ymin
+#----------------------------------------------------------------
+def get_char_bounding_boxes(trial, fraction_of_x_points=None, fraction_of_y_points=None):
+    """
+    Get the bounding box of each character in the trial (see get_bounding_box), as a list in the order of
+    trial.characters. The list contains None for characters with no on-paper points.
+
+    The bounding boxes of all characters are computed together, and cached on the trial.
+    """
+    def compute():
+        return _get_bounding_boxes([[stroke.trajectory for stroke in c.strokes if stroke.on_paper] for c in trial.characters],
+                                   fraction_of_x_points, fraction_of_y_points, grouped=True)
+
+    return _cached_on_trial(trial, ('characters', fraction_of_x_points, fraction_of_y_points), compute)
+
+
+#----------------------------------------------------------------
+def get_stroke_bounding_boxes(trial, fraction_of_x_points=None, fraction_of_y_points=None):
+    """
+    Get the bounding box of each stroke's trajectory, as a list in the order of trial.strokes
+    (None for strokes without points). The result is cached on the trial.
+    """
+    def compute():
+        return _get_bounding_boxes([s.trajectory for s in trial.strokes], fraction_of_x_points, fraction_of_y_points)
+
+    return _cached_on_trial(trial, ('strokes', fraction_of_x_points, fraction_of_y_points), compute)
+
+
+#----------------------------------------------------------------
+def get_trial_bounding_box(trial, fraction_of_x_points=None, fraction_of_y_points=None, points='on_paper'):
+    """
+    Get the bounding box of the trial's trajectory. The result is cached on the trial.
+
+    :param points: Which of the trial's points to include: 'all', 'on_paper' (z > 0), or 'on_paper_char'
+                   (z > 0 and belongs to a character)
+    """
+    def compute():
+        traj = dict(all=trial.traj_points, on_paper=trial.on_paper_points, on_paper_char=trial.on_paper_char_points)[points]
+        return _nonempty_bbox(_get_bounding_boxes([traj], fraction_of_x_points, fraction_of_y_points)[0])
+
+    return _cached_on_trial(trial, ('trial', points, fraction_of_x_points, fraction_of_y_points), compute)
 
-    return CharBoundingBox(xmin=xmin, ymin=ymin, width=w, height=h)
+
+#----------------------------------------------------------------
+def _cached_on_trial(trial, key, compute):
+    """
+    Get a value from the trial's cache (trial.cached_values), or compute it if it's not there.
+    The cache is cleared if the trial's strokes, characters or trajectories were replaced, added or removed
+    (see _trial_structure); changing the coordinates of existing points requires clearing the cache explicitly.
+    """
+    cache = getattr(trial, 'cached_values', None)
+    if cache is None:
+        return compute()
+
+    structure, objects = _trial_structure(trial)
+    if cache.get('structure') != structure:
+        cache.clear()
+        cache['structure'] = structure
+        cache['structure_objects'] = objects   # Keep them alive, so their ids are not reused by new objects
+
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+
+def _trial_structure(trial):
+    """
+    The identity of the trial's points, strokes and characters, and of each stroke's trajectory (and its length)
+
+    :return: tuple: (the structure, as a tuple of ids and values; the objects whose ids are used)
+    """
+    points = getattr(trial, '_points', None)
+    trajectories = [s.trajectory for s in trial.strokes]
+    strokes = tuple((id(s), s.on_paper, id(traj), len(traj)) for s, traj in zip(trial.strokes, trajectories))
+    characters = tuple((id(c), tuple(id(s) for s in c.strokes)) for c in trial.characters)
+
+    objects = (points, list(trial.strokes), trajectories, list(trial.characters), [list(c.strokes) for c in trial.characters])
+    return (id(points), strokes, characters), objects
+
+
+#----------------------------------------------------------------
+def _get_bounding_boxes(trajectories, fraction_of_x_points, fraction_of_y_points, grouped=False):
+    """
+    Get the bounding boxes of several trajectories, computed together.
+
+    :param trajectories: List of trajectories (lists of points or PointsView objects). If grouped=True, each element
+                         is a list of trajectories, which are treated as a single trajectory
+    :return: List of CharBoundingBox objects (None for empty trajectories)
+    """
+    xmin, xmax, ymin, ymax, lengths = _bounding_box_arrays(trajectories, fraction_of_x_points, fraction_of_y_points, grouped)
+
+    return [CharBoundingBox(xmin=x0, ymin=y0, width=x1 - x0, height=y1 - y0) if n > 0 else None
+            for x0, x1, y0, y1, n in zip(xmin.tolist(), xmax.tolist(), ymin.tolist(), ymax.tolist(), lengths)]
+
+
+#----------------------------------------------------------------
+def _bounding_box_arrays(trajectories, fraction_of_x_points, fraction_of_y_points, grouped=False):
+    """
+    Same as _get_bounding_boxes(), but return arrays: xmin, xmax, ymin, ymax, and the number of points in each
+    trajectory (the min/max are NaN for empty trajectories)
+    """
+    if not grouped:
+        trajectories = [[traj] for traj in trajectories]
+
+    x = [np.asarray(traj.x, dtype=float) if hasattr(traj, 'x') else np.array([pt.x for pt in traj], dtype=float)
+         for group in trajectories for traj in group]
+    y = [np.asarray(traj.y, dtype=float) if hasattr(traj, 'y') else np.array([pt.y for pt in traj], dtype=float)
+         for group in trajectories for traj in group]
+    x = np.concatenate(x) if len(x) > 0 else np.zeros(0)
+    y = np.concatenate(y) if len(y) > 0 else np.zeros(0)
+
+    lengths = [sum(len(traj) for traj in group) for group in trajectories]
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype=int)])
+
+    #-- The y dimension is trimmed only if the fraction of x points is in (0, 1): keep this behavior, which the
+    #-- existing characters.csv files reflect.
+    trim_y = fraction_of_y_points is not None and 0 < fraction_of_x_points < 1
+
+    xmin, xmax = find_intervals_containing(x, offsets, fraction_of_x_points)
+    ymin, ymax = find_intervals_containing(y, offsets, fraction_of_y_points if trim_y else None)
+
+    return xmin, xmax, ymin, ymax, lengths
+
+
+#----------------------------------------------------------------
+def _bounding_box_columns(bbox_arrays, columns):
+    """
+    Convert the result of _bounding_box_arrays() to columns: one array per BBoxAttr in 'columns'.
+    The values are computed as in CharBoundingBox.
+    """
+    xmin, xmax, ymin, ymax, lengths = bbox_arrays
+    if 0 in lengths:
+        raise ValueError('Cannot compute the bounding box of an empty trajectory')
+
+    width = xmax - xmin
+    height = ymax - ymin
+    values = dict(xmin=xmin, ymin=ymin, width=width, height=height, xmid=xmin + width / 2, ymid=ymin + height / 2)
+    return [values[col.fld_name] for col in columns]
 
 
 #----------------------------------------------------------------
@@ -471,24 +994,65 @@ def find_interval_containing(values, p_contained, in_place=False):
     if p_contained == 1:
         return min(values), max(values)
 
-    n_values = len(values)
-    n_required_values = round(math.ceil(n_values * p_contained))
-
     if in_place:
         values.sort()
-    else:
-        values = sorted(values)
-
-    #-- Now we find, within "values" array, a sub-array of length n_required_values, with minimal difference between start and end.
-    #-- Namely, we need to find the i for which (values[i+n_required_values] - values[i]) is minimal
-    values = np.array(values)
-    diffs = values[(n_required_values-1):] - values[:(len(values) - n_required_values + 1)]
-    minval = min(diffs)
-    min_inds = np.where(diffs == minval)[0]
-    if len(min_inds) == 1:
-        ind = min_inds[0]
-    else:
-        i = int(math.floor((len(min_inds) + 1) / 2))
-        ind = min_inds[i - 1]
 
-    return values[ind], values[ind + n_required_values - 1]
+    lo, hi = find_intervals_containing(np.asarray(values, dtype=float), np.array([0, len(values)]), p_contained)
+    return lo[0], hi[0]
+
+
+#----------------------------------------------------------------
+def find_intervals_containing(values, offsets, p_contained):
+    """
+    For each segment of an array, find the smallest interval that contains a given percentage of the segment's values.
+    All segments are processed together.
+
+    :param values: Array of numbers
+    :param offsets: Segment i is values[offsets[i]:offsets[i+1]]
+    :param p_contained: The percentage of values we want contained in each interval (value between 0 and 1).
+                        If None or 1, the interval is the segment's min..max
+    :return: tuple of 2 arrays: the minimum and maximum of each segment's interval (NaN for empty segments)
+    """
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=int)
+    n_segments = len(offsets) - 1
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+
+    #-- Sort the values within each segment
+    segment_ids = np.repeat(np.arange(n_segments), lengths)
+    values = values[np.lexsort((values, segment_ids))]
+
+    lo = np.full(n_segments, np.nan)
+    hi = np.full(n_segments, np.nan)
+
+    if p_contained is None or not 0 < p_contained < 1:
+        lo[nonempty] = values[starts[nonempty]]
+        hi[nonempty] = values[starts[nonempty] + lengths[nonempty] - 1]
+        return lo, hi
+
+    #-- In each segment, find a window of n_required values with minimal difference between its first and last value.
+    #-- Windows are enumerated for all segments together.
+    n_required = np.ceil(lengths * p_contained).astype(int)
+    n_windows = np.where(nonempty, lengths - n_required + 1, 0)
+    window_offsets = np.concatenate([[0], np.cumsum(n_windows)])
+    window_segment = np.repeat(np.arange(n_segments), n_windows)
+    window_start = starts[window_segment] + np.arange(window_offsets[-1]) - window_offsets[:-1][window_segment]
+    window_end = window_start + n_required[window_segment] - 1
+    diffs = values[window_end] - values[window_start]
+
+    min_diff = np.full(n_segments, np.inf)
+    if nonempty.any():
+        min_diff[nonempty] = np.minimum.reduceat(diffs, window_offsets[:-1][nonempty])
+
+    #-- If several windows have the minimal difference, choose the middle one (the lower one if their number is even)
+    min_windows = np.flatnonzero(diffs == min_diff[window_segment])
+    min_windows_segment = window_segment[min_windows]
+    n_min_windows = np.bincount(min_windows_segment, minlength=n_segments)
+    first_min_window = np.searchsorted(min_windows_segment, np.arange(n_segments))
+    chosen = min_windows[(first_min_window + (n_min_windows - 1) // 2)[nonempty]]
+
+    lo[nonempty] = values[window_start[chosen]]
+    hi[nonempty] = values[window_end[chosen]]
+    return lo, hi
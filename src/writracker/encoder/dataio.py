@@ -4,11 +4,19 @@ Load and save encoder result files
 import re
 import csv
 import os
+import io
+import contextlib
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
 
 from writracker.encoder import charvalues
 from writracker import commonio
+from writracker import sessionindex
+from writracker import sessionjournal
 from writracker.encoder import datatypes
 import writracker.utils as u
 
@@ -24,42 +32,87 @@ strokes_cols = 'trial_id', 'sub_trial_num', 'char_num', 'stroke', 'on_paper'
 #============================================================================================================
 
 #-------------------------------------------------------------------------------------------------
-def load_experiment(dir_names, block_nums=None, trial_index_filter=None):
+def load_experiment(dir_names, block_nums=None, trial_index_filter=None, columnar=False, workers=None, lazy=False,
+                    max_loaded_trials=None):
     """
     Load full experiment (including trajectories)
 
     :param dir_names: The directory with WEncoder data, or a list of directories
     :param block_nums: If provided, a list of block numbers to assign to each directory in the 'dir_names' argument
     :param trial_index_filter: A function that gets a trials.csv row (as dict) and returns T/F (whether to load it or not)
+    :param columnar: If True, each trial's points are stored in arrays (trial.points) and each stroke's trajectory is
+                     a view on these arrays (see datatypes.TrialPoints). This saves memory and time.
+    :param workers: If > 1, the index files and trajectories are loaded in this number of parallel processes.
+                    The result is the same as when loading serially; the warnings/errors of each trial are printed
+                    in the order of the trials.
+    :param lazy: If True, the trajectory files are not loaded up front: each trial's trajectory is loaded when its
+                 points are first accessed. Missing trajectory files are still detected up front (as in eager mode),
+                 but trials whose trajectory file has no points are not skipped: an error is printed when the
+                 trajectory is loaded, and the trial's strokes have no points.
+    :param max_loaded_trials: In lazy mode: if specified, at most this number of trials have their trajectory loaded
+                 in memory at any time (the least recently used ones are unloaded, and will be re-loaded from
+                 the file when needed - so changes made to their points are lost).
     """
 
     multi_dir = u.is_collection(dir_names)
     if not multi_dir:
         dir_names = dir_names,
 
-    trials = []
-
-    for block_num, dir_name in enumerate(dir_names):
-
-        index = _load_trials_index(dir_name)
-        all_strokes = _load_strokes_file(dir_name)
-
-        for trial_spec in index:
-
-            #-- Skip filtered trials
-            if trial_index_filter is not None and not trial_index_filter(trial_spec):
-                continue
-
-            trial_key = trial_spec['trial_id'], trial_spec['sub_trial_num']
-            if trial_key not in all_strokes:
-                print('ERROR: Invalid data in {}: no strokes for trial #{} (sub-trial={})'
-                      .format(dir_name, trial_spec['trial_id'], trial_spec['sub_trial_num']))
-                continue
-
-            trial_strokes = all_strokes[trial_key]
+    pool = ProcessPoolExecutor(workers) if workers is not None and workers > 1 else None
+    loaded_trials = _LoadedTrials(max_loaded_trials) if lazy else None
+
+    try:
+        #-- Load the index files of all sessions
+        sessions = list(pool.map(_load_session_index, dir_names)) if pool else [_load_session_index(d) for d in dir_names]
+
+        #-- Find the trials to load
+        trials_to_load = []
+        for block_num, (dir_name, (index, all_strokes)) in enumerate(zip(dir_names, sessions)):
+
+            for trial_spec in index:
+
+                #-- Skip filtered trials
+                if trial_index_filter is not None and not trial_index_filter(trial_spec):
+                    continue
+
+                trial_key = trial_spec['trial_id'], trial_spec['sub_trial_num']
+                if trial_key not in all_strokes:
+                    print('ERROR: Invalid data in {}: no strokes for trial #{} (sub-trial={})'
+                          .format(dir_name, trial_spec['trial_id'], trial_spec['sub_trial_num']))
+                    continue
+
+                trials_to_load.append((block_num, dir_name, trial_spec, all_strokes[trial_key]))
+
+        #-- Load the trajectories
+        jobs = [(dir_name + os.sep + trial_spec['traj_file_name'], trial_strokes)
+                for block_num, dir_name, trial_spec, trial_strokes in trials_to_load]
+        if lazy:
+            for traj_filename, _ in jobs:
+                if not os.path.isfile(commonio.resolve_trajectory_file(traj_filename)):
+                    raise FileNotFoundError('Trajectory file not found: {}'.format(traj_filename))
+            traj_results = ((None, True) for _ in jobs)
+        elif pool:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            traj_results = pool.map(_load_trial_trajectory_job, jobs, chunksize=chunksize)
+        else:
+            traj_results = (_load_trial_trajectory(traj_filename, trial_strokes, columnar) for traj_filename, trial_strokes in jobs)
+
+        trials = []
+        for (block_num, dir_name, trial_spec, trial_strokes), traj_result in zip(trials_to_load, traj_results):
+
+            if pool and not lazy:
+                #-- Report what happened in the worker process
+                trial_strokes, trial_points, ok, output, error = traj_result
+                print(output, end='')
+                if error is not None:
+                    raise error
+                if ok and not columnar:
+                    _columnar_to_point_lists(trial_strokes)
+                    trial_points = None
+            else:
+                trial_points, ok = traj_result
 
-            traj_filename = dir_name + os.sep + trial_spec['traj_file_name']
-            if not _load_trajectory(traj_filename, trial_strokes):
+            if not ok:
                 continue
 
             characters = _create_characters(trial_strokes, trial_spec['trial_id'], trial_spec['target_id'],
@@ -83,13 +136,142 @@ def load_experiment(dir_names, block_nums=None, trial_index_filter=None):
                                          time_in_day=trial_spec['time_in_day'],
                                          date=trial_spec['date'],
                                          characters=characters,
-                                         strokes=trial_strokes)
+                                         strokes=trial_strokes,
+                                         points=trial_points)
+
+            if lazy:
+                _TrialTrajectoryLoader(trial, dir_name + os.sep + trial_spec['traj_file_name'], columnar, loaded_trials)
 
             trials.append(trial)
 
+    finally:
+        if pool:
+            pool.shutdown()
+
     return datatypes.CodedDataset(trials)
 
 
+#-------------------------------------------------------------------------------------------------
+def _load_session_index(dir_name):
+    """ Load the trials.csv and strokes.csv files of one session """
+    return _load_trials_index(dir_name), _load_strokes_file(dir_name)
+
+
+#-------------------------------------------------------------------------------------------------
+def _load_trial_trajectory(traj_filename, trial_strokes, columnar):
+    """
+    Load one trial's trajectory into its strokes
+    Return a tuple: (TrialPoints or None, whether the trajectory was loaded)
+    """
+    if columnar:
+        trial_points = _load_trajectory_columnar(traj_filename, trial_strokes)
+        return trial_points, trial_points is not None
+    else:
+        return None, _load_trajectory(traj_filename, trial_strokes)
+
+
+#-------------------------------------------------------------------------------------------------
+def _load_trial_trajectory_job(args):
+    """
+    Load one trial's trajectory in a worker process. The trajectory is always loaded in columnar mode, because
+    arrays are much faster to send back to the main process than point objects.
+
+    Return a tuple: (strokes, TrialPoints or None, whether the trajectory was loaded, printed output, exception)
+    """
+    traj_filename, trial_strokes = args
+
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            trial_points, ok = _load_trial_trajectory(traj_filename, trial_strokes, True)
+        return trial_strokes, trial_points, ok, output.getvalue(), None
+
+    except Exception as e:
+        return None, None, False, output.getvalue(), e
+
+
+#-------------------------------------------------------------------------------------------------
+class _TrialTrajectoryLoader(object):
+    """
+    Loads a trial's trajectory when it's first accessed (in lazy mode of load_experiment)
+    """
+
+    def __init__(self, trial, traj_filename, columnar, loaded_trials):
+        self.trial = trial
+        self.traj_filename = traj_filename
+        self.columnar = columnar
+        self.loaded_trials = loaded_trials
+        self.loaded = False
+
+        trial.trajectory_loader = self
+        for stroke in trial.strokes:
+            stroke.trajectory_loader = self
+
+    def load(self):
+        if self.loaded:
+            self.loaded_trials.used(self)
+            return
+
+        self.loaded = True
+        try:
+            trial_points, ok = _load_trial_trajectory(self.traj_filename, self.trial.strokes, self.columnar)
+        except Exception:
+            self.loaded = False
+            raise
+
+        if not ok:
+            #-- In eager mode, the trial would have been skipped
+            print('ERROR: the trajectory of trial #{} (sub-trial={}) could not be loaded from {}; its strokes have no points'
+                  .format(self.trial.trial_id, self.trial.sub_trial_num, self.traj_filename))
+
+        self.trial.points = trial_points
+        self.trial.cached_values.clear()
+        self.loaded_trials.used(self)
+
+    def unload(self):
+        self.loaded = False
+        self.trial.points = None
+        self.trial.cached_values.clear()
+        for stroke in self.trial.strokes:
+            stroke.trajectory = []
+
+
+#-------------------------------------------------------------------------------------------------
+class _LoadedTrials(object):
+    """
+    The trials whose trajectory is loaded (in lazy mode), in least-recently-used order
+    """
+
+    def __init__(self, max_trials):
+        if max_trials is not None and max_trials < 1:
+            raise ValueError('Invalid max_loaded_trials ({}): expecting a positive number'.format(max_trials))
+        self.max_trials = max_trials
+        self._loaders = OrderedDict()
+
+    def used(self, loader):
+        if self.max_trials is None:
+            return
+
+        key = id(loader)
+        if key in self._loaders:
+            self._loaders.move_to_end(key)
+            return
+
+        self._loaders[key] = loader
+        while len(self._loaders) > self.max_trials:
+            _, evicted = self._loaders.popitem(last=False)
+            evicted.unload()
+
+
+#-------------------------------------------------------------------------------------------------
+def _columnar_to_point_lists(strokes):
+    """ Replace each stroke's trajectory (a PointsView) with a list of TrajectoryPoint objects """
+    for stroke in strokes:
+        traj = stroke.trajectory
+        stroke.trajectory = [commonio.TrajectoryPoint(*p) for p in zip(traj.x.tolist(), traj.y.tolist(),
+                                                                        traj.z.tolist(), traj.t.tolist())]
+
+
 #-------------------------------------------------------------------------------------
 def is_encoder_results_directory(dir_name):
 
@@ -119,11 +301,10 @@ def _load_trials_index(dir_name):
     Load information from the trials.csv file
     """
     index_fn = trial_index_filename(dir_name)
-    if not os.path.isfile(index_fn):
+    df = sessionindex.get(dir_name).trials_df()
+    if df is None:
         return []
 
-    df = pd.read_csv(index_fn, encoding="utf-8", dtype=dict(response='string'))
-
     missing_fields = [f for f in ['trial_id', 'sub_trial_num', 'response'] if f not in df]
     if len(missing_fields) > 0:
         raise ValueError(f'Invalid format for {index_fn}: the file does not contain the field/s {", ".join(missing_fields)}')
@@ -132,9 +313,12 @@ def _load_trials_index(dir_name):
     if 'sound_file_length' in df:
         df.sound_file_length = df.sound_file_length.fillna(0)
 
+    #-- Line numbers (for error messages) are known only if no rows were removed
+    has_line_nums = not sessionjournal.has_tombstones(dir_name)
+
     result = []
     for i, row in df.iterrows():
-        location = 'line {} in {}'.format(i+2, os.path.basename(index_fn))  # type: ignore
+        location = 'line {} in {}'.format(i+2, os.path.basename(index_fn)) if has_line_nums else os.path.basename(index_fn)  # type: ignore
 
         row.trial_id = u.parse_int('trial_id', row.trial_id, location)
         row.sub_trial_num = u.parse_int('sub_trial_num', row.sub_trial_num, location)
@@ -177,30 +361,6 @@ def save_trial(raw_trial, response, trial_rc, characters, sub_trial_num, out_dir
     append_to_characters_file(out_dir, raw_trial, sub_trial_num, trial_rc, response, characters, strokes)
 
 
-#----------------------------------------------------------
-def remove_trial_from_index_file(filename, trial_id, sub_trial_num=None):
-    """
-    Remove a trial from an index file
-    """
-
-    file_exists = os.path.isfile(filename)
-    if not file_exists:
-        return
-
-    with open(filename, 'r', encoding="utf-8") as fp:
-        reader = csv.DictReader(fp)
-        u.validate_csv_format(filename, reader, ['trial_id', 'sub_trial_num'])
-        data = [row for row in reader]
-
-    with open(filename, 'w', encoding="utf-8") as fp:
-        writer = csv.DictWriter(fp, reader.fieldnames, lineterminator='\n')
-        writer.writeheader()
-        for r in data:
-            should_discard = int(r['trial_id']) == trial_id and (sub_trial_num is None or int(r['sub_trial_num']) == sub_trial_num)
-            if not should_discard:
-                writer.writerow(r)
-
-
 #----------------------------------------------------------
 def trial_index_filename(dir_name):
     return dir_name + os.sep + 'trials.csv'
@@ -211,23 +371,16 @@ def load_coded_trials_nums(dir_name):
     """
     Load information from the trials.csv file
     """
-    index_fn = trial_index_filename(dir_name)
-    if not os.path.isfile(index_fn):
+    index = sessionindex.get(dir_name)
+    if not index.exists:
         return []
 
-    #with open(index_fn, 'r', encoding="cp437", errors='ignore') as fp:
-    with open(index_fn, 'r', encoding="utf-8", errors='ignore') as fp:
-        reader = csv.DictReader(fp)
+    missing_fields = [f for f in trials_index_cols if f not in index.fieldnames]
+    if len(missing_fields) > 0:
+        raise ValueError("Invalid format for CSV file {:}: the file does not contain the field/s {:}"
+                         .format(trial_index_filename(dir_name), ", ".join(missing_fields)))
 
-        u.validate_csv_format(index_fn, reader, trials_index_cols)
-
-        result = []
-        for row in reader:
-            location = 'line {} in {}'.format(reader.line_num, index_fn)
-            trial_id = u.parse_int('trial_id', row['trial_id'], location)
-            result.append(trial_id)
-
-    return result
+    return [trial_id for trial_id, sub_trial_num in index.trial_keys]
 
 
 #-------------------------------------------------------------------------------------------------
@@ -263,22 +416,42 @@ def append_to_trial_index(dir_name, trial_id, sub_trial_num, target_id, target,
             writer.writeheader()
         writer.writerow(entry)
 
+    sessionindex.get(dir_name).trial_appended(entry)
+
 
 #----------------------------------------------------------
 def delete_trial(dir_name, trial_id, sub_trial_num=None):
     """
-    Remove a trial from the output directory
+    Remove a trial from the output directory.
+
+    The trial's rows are not removed from the index files; they are marked as deleted in the session's journal,
+    and removed when the session is compacted (see compact_session). A tombstone is recorded only if the trial has
+    rows in the index files - in trials.csv, or (even if it's not in trials.csv) in strokes.csv or characters.csv.
     """
 
-    trajfiles = traj_filenames(trial_index_filename(dir_name), trial_id, sub_trial_num)
+    index = sessionindex.get(dir_name)
+    trajfiles = index.traj_file_names(trial_id, sub_trial_num)
+
     for filename in trajfiles:
         full_path = dir_name + os.sep + filename
-        if os.path.isfile(full_path):
-            os.remove(full_path)
+        for fn in full_path, commonio.binary_trajectory_filename(full_path):
+            if os.path.isfile(fn):
+                os.remove(fn)
 
-    remove_trial_from_index_file(trial_index_filename(dir_name), trial_id, sub_trial_num)
-    remove_trial_from_index_file(dir_name + os.sep + 'strokes.csv', trial_id, sub_trial_num)
-    remove_trial_from_index_file(dir_name + os.sep + 'characters.csv', trial_id, sub_trial_num)
+    has_rows = len(index.trial_rows(trial_id, sub_trial_num)) > 0 or \
+        any(sessionjournal.has_live_rows(dir_name, fn, trial_id, sub_trial_num) for fn in ('strokes.csv', 'characters.csv'))
+    if has_rows:
+        sessionjournal.add_tombstone(dir_name, trial_id, sub_trial_num)
+        index.trial_deleted(trial_id, sub_trial_num)
+
+
+#----------------------------------------------------------
+def compact_session(dir_name):
+    """
+    Remove the deleted trials from the session's index files (trials.csv, strokes.csv, characters.csv).
+    After this, the index files contain exactly the session's trials.
+    """
+    sessionjournal.compact(dir_name)
 
 
 #endregion
@@ -287,16 +460,181 @@ def delete_trial(dir_name, trial_id, sub_trial_num=None):
 #============================================================================================================
 
 
+#-- Saved next to characters.csv: a hash of each trial's input, to allow re-computing only the trials that changed
+characters_hashes_filename = 'characters_hashes.csv'
+_characters_hashes_cols = 'trial_id', 'sub_trial_num', 'traj_state', 'traj_hash', 'n_rows', 'hash'
+
+#-- Change this whenever the content of characters.csv changes (e.g. new columns), to force re-creating the files
+_characters_file_version = '1'
+
+
 #--------------------------------------------------------------------
-def save_characters_file(session_dir):
+def save_characters_file(session_dir, incremental=True):
     """
     Create the characters.csv file for a particular session and save it
+
+    :param incremental: If True, only the trials whose input (trials.csv row, strokes, trajectory file) has changed
+                        since the file was last created are re-computed. The rows of other trials are copied from the
+                        existing characters.csv file.
+    :return: The number of trials that were re-computed
+    """
+    compact_session(session_dir)
+
+    out_filename = session_dir + os.sep + 'characters.csv'
+    hashes_filename = session_dir + os.sep + characters_hashes_filename
+
+    index = sessionindex.get(session_dir)
+    trial_keys = [key for key in index.trial_keys if any(row['rc'] == 'OK' for row in index.trial_rows(*key))]
+
+    if incremental and os.path.isfile(out_filename):
+        old_hashes = _load_characters_hashes(hashes_filename)
+        old_fieldnames, old_rows = _load_characters_rows(out_filename)
+    else:
+        old_hashes, old_fieldnames, old_rows = {}, None, {}
+
+    #-- Find the trials that changed
+    strokes_rows = _load_strokes_rows(session_dir)
+    new_hashes = OrderedDict()
+    for key in trial_keys:
+        old_hash = old_hashes.get(key)
+        traj_filenames = [session_dir + os.sep + fn for fn in index.traj_file_names(*key)]
+        traj_state, traj_hash = _traj_files_hash(traj_filenames, old_hash)
+        new_hashes[key] = dict(trial_id=key[0], sub_trial_num=key[1], traj_state=traj_state, traj_hash=traj_hash,
+                               hash=_trial_input_hash(index.trial_rows(*key), strokes_rows.get(key, []), traj_hash))
+
+    changed = {key for key, h in new_hashes.items()
+               if key not in old_hashes or old_hashes[key]['hash'] != h['hash'] or len(old_rows.get(key, [])) != old_hashes[key]['n_rows']}
+
+    #-- Compute the changed trials
+    if len(changed) > 0 or old_fieldnames is None:
+        exp = load_experiment(session_dir, trial_index_filter=lambda trial: trial['rc'] == 'OK' and (trial['trial_id'], trial['sub_trial_num']) in changed)
+        columns = charvalues.generate_char_level_columns(exp.trials, _default_value_generators, trial_filter=lambda trial: trial.rc == 'OK')
+        fieldnames = list(columns)
+
+        if old_fieldnames is not None and old_fieldnames != fieldnames and len(changed) < len(new_hashes):
+            #-- The file format has changed: the existing rows cannot be used
+            return save_characters_file(session_dir, incremental=False)
+
+        new_rows = OrderedDict((key, []) for key in changed)
+        for row in zip(*columns.values()):
+            new_rows[(row[0], row[1])].append(row)
+
+    else:
+        fieldnames = old_fieldnames
+        new_rows = {}
+
+    #-- Save characters.csv, in the order of trials.csv
+    rows_per_trial = [new_rows[key] if key in changed else old_rows.get(key, []) for key in trial_keys]
+    if len(changed) > 0 or old_fieldnames is None or sum(len(r) for r in rows_per_trial) != sum(len(r) for r in old_rows.values()):
+        with open(out_filename + '.tmp', 'w', encoding='utf-8') as fp:
+            writer = csv.writer(fp, lineterminator='\n')
+            writer.writerow(fieldnames)
+            for rows in rows_per_trial:
+                writer.writerows(rows)
+        os.replace(out_filename + '.tmp', out_filename)
+
+    for key, rows in zip(trial_keys, rows_per_trial):
+        new_hashes[key]['n_rows'] = len(rows)
+    _save_characters_hashes(hashes_filename, new_hashes)
+
+    return len(changed)
+
+
+#--------------------------------------------------------------------
+def _trial_input_hash(trial_rows, strokes_rows, traj_hash):
+    """ A hash of all the data from which a trial's characters.csv rows are computed """
+    h = hashlib.sha1(_characters_file_version.encode('utf-8'))
+    for row in trial_rows + strokes_rows:
+        h.update(repr(sorted(row.items())).encode('utf-8', errors='surrogateescape'))
+    h.update(traj_hash.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _traj_files_hash(filenames, old_hash):
     """
+    Get a hash of the content of the trajectory files - i.e., of the files from which the trajectories are loaded,
+    which may be their binary version (see commonio.resolve_trajectory_file).
+    The files are re-read only if their size/modification time differ from the previous time (in old_hash)
 
-    exp = load_experiment(session_dir, trial_index_filter=lambda trial: trial['rc'] == 'OK')
+    :return: tuple: (the files' size and modification time, hash)
+    """
+    filenames = [commonio.resolve_trajectory_file(fn) for fn in filenames]
+    stats = [os.stat(fn) if os.path.isfile(fn) else None for fn in filenames]
+    state = ';'.join('' if st is None else '{}:{}'.format(st.st_size, st.st_mtime_ns) for st in stats)
+    if old_hash is not None and old_hash['traj_state'] == state:
+        return state, old_hash['traj_hash']
+
+    h = hashlib.sha1()
+    for fn, st in zip(filenames, stats):
+        if st is not None:
+            with open(fn, 'rb') as fp:
+                h.update(fp.read())
+        h.update(b'\0')
+    return state, h.hexdigest()
+
+
+def _load_strokes_rows(dir_name):
+    """ The rows of strokes.csv (as dicts of strings), per (trial_id, sub_trial_num) """
+    filename = dir_name + os.sep + 'strokes.csv'
+    if not os.path.isfile(filename):
+        return {}
+
+    result = {}
+    with open(filename, 'r', encoding='utf-8', errors='surrogateescape') as fp:
+        for row in csv.DictReader(fp):
+            try:
+                key = int(row['trial_id']), int(row['sub_trial_num'])
+            except (ValueError, TypeError):
+                continue  # invalid rows are reported when loading the strokes
+            result.setdefault(key, []).append(row)
+
+    return result
+
+
+def _load_characters_rows(filename):
+    """
+    Load an existing characters.csv file
+    :return: tuple: (field names, dict with the rows (lists of strings) per (trial_id, sub_trial_num))
+    """
+    with open(filename, 'r', encoding='utf-8') as fp:
+        reader = csv.reader(fp)
+        fieldnames = next(reader, None)
+        if fieldnames is None or fieldnames[:2] != ['trial_id', 'sub_trial_num']:
+            return None, {}
+
+        rows = {}
+        for row in reader:
+            try:
+                rows.setdefault((int(row[0]), int(row[1])), []).append(row)
+            except (ValueError, IndexError):
+                return None, {}
 
-    charvalues.generate_char_level_custom_values(exp.trials, value_generators=_default_value_generators, trial_filter=lambda trial: trial.rc == 'OK',
-                                                 out_filename=session_dir + '/characters.csv')
+    return fieldnames, rows
+
+
+def _load_characters_hashes(filename):
+    if not os.path.isfile(filename):
+        return {}
+
+    with open(filename, 'r', encoding='utf-8') as fp:
+        reader = csv.DictReader(fp)
+        if any(c not in (reader.fieldnames or []) for c in _characters_hashes_cols):
+            return {}
+
+        result = {}
+        for row in reader:
+            row['n_rows'] = int(row['n_rows'])
+            result[(int(row['trial_id']), int(row['sub_trial_num']))] = row
+
+    return result
+
+
+def _save_characters_hashes(filename, hashes):
+    with open(filename + '.tmp', 'w', encoding='utf-8') as fp:
+        writer = csv.DictWriter(fp, _characters_hashes_cols, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(hashes.values())
+    os.replace(filename + '.tmp', filename)
 
 
 #--------------------------------------------------------------------
@@ -449,6 +787,10 @@ def _get_extends(_, character):
     return '' if character.extends is None else character.extends
 
 
+def _get_extends_vectorized(table):
+    return ['' if c.extends is None else c.extends for c in table.characters]
+
+
 #-------------------------------------------------------
 def _get_pre_char_delay(trial, character):
     """
@@ -461,6 +803,12 @@ def _get_pre_char_delay(trial, character):
     return round(delay, 3)
 
 
+def _get_pre_char_delay_vectorized(table):
+    t0, _ = table.char_times
+    delays = [t if c.char_num == 1 else c.pre_char_delay for t, c in zip(t0.tolist(), table.characters)]
+    return _round_non_negative(table, delays, 'WARNING: negative pre-char-delay for character #{} in trial #{}')
+
+
 #-------------------------------------------------------
 def _get_char_t0(trial, character):
     """ the time when the character started """
@@ -471,18 +819,41 @@ def _get_char_t0(trial, character):
     return round(t0, 3)
 
 
+def _get_char_t0_vectorized(table):
+    t0, _ = table.char_times
+    return _round_non_negative(table, t0.tolist(), 'WARNING: negative t0 for character #{} in trial {}')
+
+
+def _round_non_negative(table, values, warning):
+    """ Round values to 3 decimal digits; negative values become None (and the warning is printed) """
+    result = [round(v, 3) for v in values]
+    for i in np.flatnonzero(np.array(values, dtype=float) < 0):
+        print(warning.format(table.char_num[i], table.trials[table.trial_index[i]].trial_id))
+        result[i] = None
+    return result
+
+
 #-------------------------------------------------------
 def _get_char_duration(_, character):
     """ The time it took to write this character """
     return round(character.duration, 3)
 
 
+def _get_char_duration_vectorized(table):
+    t0, t_end = table.char_times
+    return [round(d, 3) for d in (t_end - t0).tolist()]
+
+
 #-------------------------------------------------------
 def _get_post_char_delay(_, character):
     """ The delay between this character and the next one """
     return round(character.post_char_delay, 3)
 
 
+def _get_post_char_delay_vectorized(table):
+    return [round(c.post_char_delay, 3) for c in table.characters]
+
+
 #-------------------------------------------------------
 class GetPreCharDistance(object):
     """ The horizontal distance between this character and the previous one (rely on the previously-calculated bounding box) """
@@ -496,6 +867,7 @@ class GetPreCharDistance(object):
         self.between_centers = between_centers
         self.x_col = x_col
         self.width_col = width_col
+        self.in_fields = (x_col, ) if between_centers else (x_col, width_col)
 
     def __call__(self, _, character, trial_extra_values):
         charnum = character.char_num
@@ -509,6 +881,9 @@ class GetPreCharDistance(object):
         else:
             return char_inf[self.x_col] - (prev_char_inf[self.x_col] + prev_char_inf[self.width_col])
 
+    def vectorized(self, table):
+        return _char_distance(table, table.char_row(-1), np.arange(len(table)), self.between_centers, self.x_col, self.width_col)
+
 
 #-------------------------------------------------------
 class GetPostCharDistance(object):
@@ -523,6 +898,7 @@ class GetPostCharDistance(object):
         self.between_centers = between_centers
         self.x_col = x_col
         self.width_col = width_col
+        self.in_fields = (x_col, ) if between_centers else (x_col, width_col)
 
     def __call__(self, _, character, trial_extra_values):
         charnum = character.char_num
@@ -537,6 +913,24 @@ class GetPostCharDistance(object):
         else:
             return next_char_inf[self.x_col] - (char_inf[self.x_col] + char_inf[self.width_col])
 
+    def vectorized(self, table):
+        return _char_distance(table, np.arange(len(table)), table.char_row(1), self.between_centers, self.x_col, self.width_col)
+
+
+#-------------------------------------------------------
+def _char_distance(table, left_rows, right_rows, between_centers, x_col, width_col):
+    """
+    The horizontal distance between pairs of characters (rows in the CharTable); None if one of the rows is -1
+    """
+    x = table.column(x_col)
+    if between_centers:
+        distance = x[right_rows] - x[left_rows]
+    else:
+        distance = x[right_rows] - (x[left_rows] + table.column(width_col)[left_rows])
+
+    valid = np.logical_and(left_rows >= 0, right_rows >= 0)
+    return [d if ok else None for d, ok in zip(distance.tolist(), valid.tolist())]
+
 
 #-- The list of the value-generators (each becomes one/several columns in the resulting CSV file)
 __cgen = charvalues.ValueGenerator
@@ -545,16 +939,16 @@ _default_value_generators = (
     __cgen(charvalues.GetCharBoundingBox(0.9, 0.9), ('x', 'width', 'y', 'height')),
     __tgen(charvalues.GetTrialBoundingBox(0.9, 0.9, columns=charvalues.BBoxAttr.width), 'trial_width'),
     __cgen(charvalues.NormalizeByCharWidth(('x', 'width'), trial_width_col='trial_width'), ('x_norm', 'width_norm')),
-    __cgen(lambda t, c: t.response, 'response'),
-    __cgen(_get_char_t0, 't0'),
-    __cgen(_get_char_duration, 'duration'),
-    __cgen(_get_pre_char_delay, 'pre_char_delay'),
-    __cgen(_get_post_char_delay, 'post_char_delay'),
+    __cgen(lambda t, c: t.response, 'response', vectorized=lambda table: table.trial_attr('response')),
+    __cgen(_get_char_t0, 't0', vectorized=_get_char_t0_vectorized),
+    __cgen(_get_char_duration, 'duration', vectorized=_get_char_duration_vectorized),
+    __cgen(_get_pre_char_delay, 'pre_char_delay', vectorized=_get_pre_char_delay_vectorized),
+    __cgen(_get_post_char_delay, 'post_char_delay', vectorized=_get_post_char_delay_vectorized),
     __cgen(GetPreCharDistance(False), 'pre_char_distance'),
     __cgen(GetPostCharDistance(False), 'post_char_distance'),
     __cgen(GetPreCharDistance(True), 'pre_char_cdistance'),
     __cgen(GetPostCharDistance(True), 'post_char_cdistance'),
-    __cgen(_get_extends, 'extends'),
+    __cgen(_get_extends, 'extends', vectorized=_get_extends_vectorized),
 )
 
 
@@ -574,7 +968,7 @@ def _load_strokes_file(dir_name):
     if not os.path.isfile(filename):
         return []
 
-    with open(filename, 'r', encoding="utf-8", errors='ignore') as fp:
+    with sessionjournal.open_live(filename, errors='ignore') as fp:
         reader = csv.DictReader(fp)
         u.validate_csv_format(filename, reader, strokes_cols)
 
@@ -607,6 +1001,9 @@ def save_strokes_file(trials, out_dir):
     Save the strokes file from scratch - given a list of trials.
     """
 
+    #-- The journal's tombstones refer to offsets in the current index files, so it must not survive a rewrite
+    compact_session(out_dir)
+
     index_fn = out_dir + os.sep + 'strokes.csv'
 
     with open(index_fn, 'w') as fp:
@@ -733,10 +1130,151 @@ def _load_trajectory(traj_filename, trial_strokes):
     return True
 
 
+#--------------------------------------------------------------------------------------------------------------------
+def _load_trajectory_columnar(traj_filename, trial_strokes):
+    """
+    Load the trajectory points into one TrialPoints object (ordered by the trial's strokes), and set each stroke's
+    trajectory to a view on it.
+
+    Return the TrialPoints, or None if there are no points
+    """
+    filename = commonio.resolve_trajectory_file(traj_filename)
+
+    columns = _load_traj_columns(filename)
+    if columns is None:
+        #-- The file has invalid values: the row-by-row parser reports the exact location of the error
+        points_per_stroke = _load_traj_points_per_row(filename)
+        all_points = [pt for points in points_per_stroke.values() for pt in points]
+        columns = [np.repeat(list(points_per_stroke.keys()), [len(points) for points in points_per_stroke.values()])] + \
+                  [np.array([getattr(pt, attr) for pt in all_points], dtype=float) for attr in ('x', 'y', 'z', 't')]
+
+    stroke_nums, x, y, pressure, t = columns
+    if len(stroke_nums) == 0:
+        print(f'ERROR: No points in trajectory file {traj_filename}. Trajectory not loaded.')
+        return None
+
+    order, segments = _stroke_segments(stroke_nums)
+
+    #-- Arrange the points in the order of the trial's strokes
+    point_inds = []
+    stroke_ranges = []
+    n_points = 0
+    for stroke in trial_strokes:
+        if stroke.stroke_num in segments:
+            start, end = segments[stroke.stroke_num]
+            point_inds.append(order[start:end])
+            stroke_ranges.append((n_points, n_points + end - start))
+            n_points += end - start
+        else:
+            print('WARNING: stroke #{} not found in {}'.format(stroke.stroke_num, traj_filename))
+            stroke_ranges.append((n_points, n_points))
+
+    point_inds = np.concatenate(point_inds) if len(point_inds) > 0 else np.zeros(0, dtype=int)
+    points = datatypes.TrialPoints(np.asarray(x)[point_inds], np.asarray(y)[point_inds],
+                                   np.asarray(pressure)[point_inds], np.asarray(t)[point_inds])
+
+    for stroke, (start, stop) in zip(trial_strokes, stroke_ranges):
+        stroke.trajectory = datatypes.PointsView(points, start, stop, owner=stroke)
+
+    return points
+
+
 #--------------------------------------------------------------------------------------------------------------------
 def _load_traj_points(filename):
     """
-    Load a trajectory file
+    Load a trajectory file (CSV or binary)
+    Return a dict with a list of points for each stroke_num
+    """
+    filename = commonio.resolve_trajectory_file(filename)
+
+    columns = _load_traj_columns(filename)
+    if columns is None:
+        #-- The file has invalid values: the row-by-row parser reports the exact location of the error
+        return _load_traj_points_per_row(filename)
+
+    return _group_traj_points_by_stroke(*columns)
+
+
+#--------------------------------------------------------------------------------------------------------------------
+def _load_traj_columns(filename):
+    """
+    Load a trajectory file (CSV or binary) into arrays: stroke, x, y, pressure, time.
+    Return None if the CSV file has invalid values.
+    """
+    if commonio.is_binary_trajectory_file(filename):
+        records = commonio.load_binary_trajectory(filename)
+        return [records['stroke'], records['x'], records['y'], records['pressure'], records['time']]
+
+    return _read_traj_columns(filename)
+
+
+#--------------------------------------------------------------------------------------------------------------------
+def _read_traj_columns(filename):
+    """
+    Read a trajectory CSV file into NumPy arrays: stroke, x, y, pressure, time.
+    Return None if some values are invalid.
+    """
+    try:
+        df = pd.read_csv(filename, usecols=['stroke', 'x', 'y', 'pressure', 'time'], na_filter=False,
+                         float_precision='round_trip')
+    except (ValueError, pd.errors.ParserError):
+        return None
+
+    if not pd.api.types.is_integer_dtype(df.stroke):
+        return None
+
+    values = [df.stroke.values]
+    for col in 'x', 'y', 'pressure', 'time':
+        if not pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]):
+            return None
+        col_values = df[col].values.astype(float)
+        if np.isnan(col_values).any():
+            return None
+        values.append(col_values)
+
+    return values
+
+
+#--------------------------------------------------------------------------------------------------------------------
+def _group_traj_points_by_stroke(stroke_nums, x, y, pressure, t):
+    """
+    Create the trajectory points and group them by stroke (keeping the order of the points in each stroke)
+    Return a dict with a list of points for each stroke_num, in order of the strokes' first appearance
+    """
+    order, segments = _stroke_segments(stroke_nums)
+
+    points = [commonio.TrajectoryPoint(*p) for p in zip(np.asarray(x)[order].tolist(), np.asarray(y)[order].tolist(),
+                                                          np.asarray(pressure)[order].tolist(), np.asarray(t)[order].tolist())]
+
+    return {stroke_num: points[start:end] for stroke_num, (start, end) in segments.items()}
+
+
+#--------------------------------------------------------------------------------------------------------------------
+def _stroke_segments(stroke_nums):
+    """
+    Group the points by stroke
+
+    Return a tuple: (order, segments)
+    - order: the indices of the points, sorted by stroke (keeping the order of the points in each stroke)
+    - segments: a dict with the (start, end) of each stroke_num in 'order', in order of the strokes' first appearance
+    """
+    if len(stroke_nums) == 0:
+        return np.zeros(0, dtype=int), {}
+
+    order = np.argsort(stroke_nums, kind='stable')
+    sorted_stroke_nums = np.asarray(stroke_nums)[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(sorted_stroke_nums)) + 1])
+    ends = np.append(starts[1:], len(order))
+
+    #-- order[start] is the position of the stroke's first point in the file
+    stroke_order = np.argsort(order[starts], kind='stable')
+    return order, {int(sorted_stroke_nums[starts[i]]): (int(starts[i]), int(ends[i])) for i in stroke_order}
+
+
+#--------------------------------------------------------------------------------------------------------------------
+def _load_traj_points_per_row(filename):
+    """
+    Load a trajectory CSV file, validating each row separately
     Return a dict with a list of points for each stroke_num
     """
     result = {}
@@ -778,6 +1316,11 @@ def save_trajectory(strokes, filename):
                            x=dot.x, y=dot.y, pressure=max(0, dot.z), time="{:.3f}".format(dot.t))
                 writer.writerow(row)
 
+    #-- Keep an existing binary version of the file up to date
+    bin_filename = commonio.binary_trajectory_filename(filename)
+    if os.path.isfile(bin_filename):
+        commonio.csv_to_binary_trajectory(filename, bin_filename)
+
     return filename
 
 
@@ -789,6 +1332,23 @@ def create_traj_file_name(out_dir, sub_trial_num, trial, trial_id):
     return filename
 
 
+#-------------------------------------------------------------------------------------
+def convert_trajectories_to_binary(dir_name):
+    """
+    Create a binary version of all trajectory files in the given directory. The binary files are loaded
+    instead of the CSV files (see commonio.resolve_trajectory_file) until the CSV file is modified.
+
+    :return: The number of converted files
+    """
+    n_converted = 0
+    for fn in os.listdir(dir_name):
+        if re.match('trajectory_.*\\.csv$', fn):
+            commonio.csv_to_binary_trajectory(dir_name + os.sep + fn)
+            n_converted += 1
+
+    return n_converted
+
+
 #-------------------------------------------------------------------------------------
 def _load_trajectory_filenames(dir_name):
     """ Load the names of all trajectory files in the given directory """
@@ -814,17 +1374,7 @@ def traj_filenames(filename, trial_id, sub_trial_num=None):
     Get trajectory file names for this trial
     """
 
-    file_exists = os.path.isfile(filename)
-    if not file_exists:
-        return []
-
-    def relevant_row(r):
-        return int(r['trial_id']) == trial_id and (sub_trial_num is None or int(r['sub_trial_num']) == sub_trial_num)
-
-    with open(filename, 'r', encoding="utf-8") as fp:
-        reader = csv.DictReader(fp)
-        u.validate_csv_format(filename, reader, ['trial_id', 'sub_trial_num', 'traj_file_name'])
-        return [row['traj_file_name'] for row in reader if relevant_row(row)]
+    return sessionindex.get(os.path.dirname(filename) or '.').traj_file_names(trial_id, sub_trial_num)
 
 
 #endregion
@@ -1,4 +1,7 @@
 from _operator import attrgetter
+from collections.abc import Sequence
+
+import numpy as np
 
 
 #-------------------------------------------------------------------------------------
@@ -39,7 +42,13 @@ class CodedTrial(object):
     """
 
     def __init__(self, block, trial_id, sub_trial_num, target_id, stimulus, time_in_session, rc, response,
-                 sound_file_length, traj_file_name, time_in_day, date, characters, strokes):
+                 sound_file_length, traj_file_name, time_in_day, date, characters, strokes, points=None):
+        """
+        :param points: In columnar mode: the trial's TrialPoints, of which each stroke's trajectory is a PointsView
+        """
+
+        #-- In lazy mode: an object whose load() method loads the trajectory into the strokes (and self.points)
+        self.trajectory_loader = None
 
         self.block = block
         self.trial_id = trial_id
@@ -56,25 +65,74 @@ class CodedTrial(object):
         self.date = date
         self.characters = characters
         self.strokes = strokes
+        self._points = points
+
+        #-- Values computed from the trajectory (e.g. bounding boxes; see charvalues). They are re-computed if the
+        #-- strokes/characters/trajectories are replaced or resized; clear this if the points' coordinates change.
+        self.cached_values = dict()
+
+    @property
+    def points(self):
+        if self.trajectory_loader is not None:
+            self.trajectory_loader.load()
+        return self._points
+
+    @points.setter
+    def points(self, value):
+        self._points = value
+
+    @property
+    def is_columnar(self):
+        """
+        Whether the trial's points are stored in self.points, with the strokes as consecutive parts of it
+        (this stops being the case if a stroke's trajectory is replaced or modified)
+        """
+        if self.points is None:
+            return False
+
+        pos = 0
+        for stroke in self.strokes:
+            traj = stroke.trajectory
+            if not (isinstance(traj, PointsView) and traj.points is self.points and traj.start == pos):
+                return False
+            pos = traj.stop
+
+        return pos == len(self.points)
 
     @property
     def traj_points(self):
+        if self.is_columnar:
+            return PointsView(self.points, 0, len(self.points))
         return [pt for s in self.strokes for pt in s]
 
     @property
     def on_paper_points(self):
         """ All points (from any stroke) with z > 0 """
+        if self.is_columnar:
+            return PointsView(self.points, indices=np.flatnonzero(self.points.z > 0))
         return [pt for pt in self.traj_points if pt.z > 0]
 
     @property
     def on_paper_char_points(self):
         """ All points (from any stroke) with z > 0 that belong to a character """
+        if self.is_columnar:
+            in_char = np.repeat([s.char_num > 0 for s in self.strokes], [len(s.trajectory) for s in self.strokes])
+            return PointsView(self.points, indices=np.flatnonzero(np.logical_and(in_char, self.points.z > 0)))
         return [pt for s in self.strokes if s.char_num > 0 for pt in s if pt.z > 0]
 
     def mirror_in_place(self, x=False, y=False):
         if not (x or y):
             return
 
+        self.cached_values.clear()
+
+        if self.is_columnar:
+            if x:
+                np.negative(self.points.x, out=self.points.x)
+            if y:
+                np.negative(self.points.y, out=self.points.y)
+            return
+
         if x:
             for pt in self.traj_points:
                 pt.x = -pt.x
@@ -141,7 +199,20 @@ class Stroke(object):
         self.stroke_num = stroke_num
         self.char_num = char_num
         self.on_paper = on_paper
-        self.trajectory = []
+        self._trajectory = []
+
+        #-- In lazy mode: an object whose load() method loads the trajectory
+        self.trajectory_loader = None
+
+    @property
+    def trajectory(self):
+        if self.trajectory_loader is not None:
+            self.trajectory_loader.load()
+        return self._trajectory
+
+    @trajectory.setter
+    def trajectory(self, value):
+        self._trajectory = value
 
 
     @property
@@ -164,3 +235,190 @@ class Stroke(object):
 
     def __iter__(self):
         return self.trajectory.__iter__()
+
+
+#============================================================================================================
+#region        Columnar trajectories
+#============================================================================================================
+
+#-------------------------------------------------------------------------------------
+class TrialPoints(object):
+    """
+    A trial's trajectory, stored as contiguous arrays (x, y, z, t)
+    """
+
+    def __init__(self, x, y, z, t):
+        self.x = np.ascontiguousarray(x, dtype=float)
+        self.y = np.ascontiguousarray(y, dtype=float)
+        self.z = np.ascontiguousarray(z, dtype=float)
+        self.t = np.ascontiguousarray(t, dtype=float)
+
+    def __len__(self):
+        return len(self.x)
+
+
+#-------------------------------------------------------------------------------------
+class ArrayPoint(object):
+    """
+    A single point in TrialPoints. It behaves like commonio.TrajectoryPoint: changing its x/y/z/t
+    changes the underlying arrays.
+    """
+
+    __slots__ = ('points', 'index')
+
+    def __init__(self, points, index):
+        self.points = points
+        self.index = index
+
+    @property
+    def x(self):
+        return float(self.points.x[self.index])
+
+    @x.setter
+    def x(self, value):
+        self.points.x[self.index] = value
+
+    @property
+    def y(self):
+        return float(self.points.y[self.index])
+
+    @y.setter
+    def y(self, value):
+        self.points.y[self.index] = value
+
+    @property
+    def z(self):
+        return float(self.points.z[self.index])
+
+    @z.setter
+    def z(self, value):
+        self.points.z[self.index] = value
+
+    @property
+    def t(self):
+        return float(self.points.t[self.index])
+
+    @t.setter
+    def t(self, value):
+        self.points.t[self.index] = value
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayPoint) and other.points is self.points and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.points), self.index))
+
+    def __repr__(self):
+        return 'ArrayPoint(x={}, y={}, z={}, t={})'.format(self.x, self.y, self.z, self.t)
+
+
+#-------------------------------------------------------------------------------------
+class PointsView(Sequence):
+    """
+    A sequence of points from a TrialPoints: either a range (start..stop) or arbitrary indices.
+
+    The view can be used like a list of points. The x/y/z/t properties return the corresponding arrays
+    (for a range, these are views on the TrialPoints arrays, not copies).
+
+    A view that serves as a stroke's trajectory can be modified like a list (append, extend, etc.):
+    this replaces the stroke's trajectory with a list of the points.
+    """
+
+    def __init__(self, points, start=None, stop=None, indices=None, owner=None):
+        """
+        :param owner: The Stroke whose trajectory is this view
+        """
+        self.points = points
+        self.start = start
+        self.stop = stop
+        self.indices = indices
+        self.owner = owner
+
+    @property
+    def _selector(self):
+        return slice(self.start, self.stop) if self.indices is None else self.indices
+
+    @property
+    def x(self):
+        return self.points.x[self._selector]
+
+    @property
+    def y(self):
+        return self.points.y[self._selector]
+
+    @property
+    def z(self):
+        return self.points.z[self._selector]
+
+    @property
+    def t(self):
+        return self.points.t[self._selector]
+
+    def __len__(self):
+        return self.stop - self.start if self.indices is None else len(self.indices)
+
+    def _positions(self):
+        return range(self.start, self.stop) if self.indices is None else self.indices.tolist()
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [ArrayPoint(self.points, i) for i in self._positions()[item]]
+
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('Point index out of range')
+
+        return ArrayPoint(self.points, self.start + item if self.indices is None else int(self.indices[item]))
+
+    def __iter__(self):
+        points = self.points
+        for i in self._positions():
+            yield ArrayPoint(points, i)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    #-- Modifying the view: convert the stroke's trajectory to a list
+
+    def _detach(self):
+        if self.owner is None:
+            raise TypeError('This sequence of points cannot be modified')
+        points_list = list(self)
+        self.owner.trajectory = points_list
+        return points_list
+
+    def append(self, point):
+        self._detach().append(point)
+
+    def extend(self, points):
+        self._detach().extend(points)
+
+    def insert(self, index, point):
+        self._detach().insert(index, point)
+
+    def remove(self, point):
+        self._detach().remove(point)
+
+    def pop(self, index=-1):
+        return self._detach().pop(index)
+
+    def clear(self):
+        self._detach().clear()
+
+    def reverse(self):
+        self._detach().reverse()
+
+    def sort(self, *args, **kwargs):
+        self._detach().sort(*args, **kwargs)
+
+    def __setitem__(self, item, value):
+        self._detach()[item] = value
+
+    def __delitem__(self, item):
+        del self._detach()[item]
+
+#endregion
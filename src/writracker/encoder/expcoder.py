@@ -278,6 +278,7 @@ def code_experiment(trials, out_dir):
         rc = coder.encode(trial)
 
         if rc == 'quit':
+            writracker.encoder.dataio.compact_session(out_dir)
             return
 
         elif rc == 'next':
@@ -299,6 +300,8 @@ def code_experiment(trials, out_dir):
         else:
             raise Exception(f'Invalid RC {rc}')
 
+    writracker.encoder.dataio.compact_session(out_dir)
+
     if _all_trials_are_coded(out_dir, trials):
         qw.QMessageBox.information(None, 'Finished encoding',
                                    f'Congratulations! You have finished encoding this session. The results are in\n{out_dir}')
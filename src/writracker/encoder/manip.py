@@ -58,6 +58,8 @@ class UiStroke(object):
 #-------------------------------------------------------------------------------------
 class UiTrajPoint(object):
 
+    __slots__ = ('dot', 'ui')
+
     def __init__(self, dot):
         self.dot = dot
         self.ui = None
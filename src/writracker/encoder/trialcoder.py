@@ -959,6 +959,8 @@ def _plot_dots_for_split(dot_list, graphics_view, screen_size, expand_ratio, off
 class UiTrajPointForSplit(object):
     """ A single trajectory point in the split-stroke dialog """
 
+    __slots__ = ('dot', 'color', 'graphics_item')
+
     def __init__(self, dot, color):
         self.dot = dot
         self.color = color
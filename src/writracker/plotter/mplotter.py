@@ -5,6 +5,8 @@ from collections import namedtuple
 import csv
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 
+from writracker import commonio
+
 
 Point = namedtuple('Point', ['x', 'y', 'z', 't'])
 MovieSegment = namedtuple('MovieSegment', ['kind', 'ds_num', 'data', 'n_frames', 'frame1'])
@@ -90,6 +92,10 @@ class MoviePlotter(object):
 
     #--------------------------------------------------------------------------
     def _load_points_from_csv(self, csv_path):
+        csv_path = commonio.resolve_trajectory_file(csv_path)
+        if commonio.is_binary_trajectory_file(csv_path):
+            return self._load_points_from_binary(csv_path)
+
         points = []
         with open(csv_path, newline='') as csvfile:
             reader = csv.DictReader(csvfile)
@@ -112,6 +118,24 @@ class MoviePlotter(object):
 
         return points
 
+    #--------------------------------------------------------------------------
+    def _load_points_from_binary(self, path):
+        records, columns = commonio.load_binary_trajectory(path, with_columns=True)
+
+        valid = np.any([records[c] != 0 for c in ('x', 'y', 'pressure', 'time')], axis=0)
+        if 'on_paper' in columns:
+            valid &= records['on_paper'] != 0
+        if 'char_num' in columns:
+            valid &= records['char_num'] != 0
+        records = records[valid]
+
+        points = [Point(*p) for p in zip(records['x'].tolist(), records['y'].tolist(),
+                                         records['pressure'].tolist(), records['time'].tolist())]
+        if len(points) == 0:
+            raise ValueError("No valid points loaded from {}.".format(path))
+
+        return points
+
     #--------------------------------------------------------------------------
     def _align_and_rescale_dataset_points(self):
         w, h = self._dataset_dimensions()
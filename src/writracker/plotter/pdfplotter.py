@@ -355,8 +355,8 @@ class OneFilePdfPlotter(object):
 
         if self.config.strokes_to_plot in (StrokesToPlot.ExcludeFar, StrokesToPlot.ExcludeFarAndLast):
             points = [(pt, s.char_num) for s in trial.strokes for pt in s if s.char_num > 0 and pt.z > 0]
-            trial_bbox = cval.get_bounding_box_traj([pt[0] for pt in points],
-                                                    fraction_of_x_points=xy_bbox_fraction, fraction_of_y_points=xy_bbox_fraction)
+            trial_bbox = cval.get_trial_bounding_box(trial, fraction_of_x_points=xy_bbox_fraction, fraction_of_y_points=xy_bbox_fraction,
+                                                     points='on_paper_char')
 
             excessive_strokes = [s for s in trial.strokes if s.char_num == 0]
             if self.config.strokes_to_plot == StrokesToPlot.ExcludeFarAndLast:
@@ -371,7 +371,7 @@ class OneFilePdfPlotter(object):
 
             #-- Add the excessive strokes only if they are not too far
             points.extend([(pt, 0)
-                           for s in strokes_to_include_only_if_close_enough if len(s.trajectory) > 0 and not self._stroke_is_too_far(s, trial_bbox)
+                           for s in strokes_to_include_only_if_close_enough if len(s.trajectory) > 0 and not self._stroke_is_too_far(trial, s, trial_bbox)
                            for pt in s if pt.z > 0])
             return points
 
@@ -383,7 +383,7 @@ class OneFilePdfPlotter(object):
             return points
 
     #-------------------------------------------------------------
-    def _stroke_is_too_far(self, stroke, trial_bounding_box):
+    def _stroke_is_too_far(self, trial, stroke, trial_bounding_box):
         """
         Check whether an out-of-char stroke is too far from the within-char strokes
         The calculation is according to the bounding box of all within-char strokes together versus the bounding box of the out-of-char stroke,
@@ -392,7 +392,8 @@ class OneFilePdfPlotter(object):
         xy_bbox_fraction = 0.95
         distance_threshold = 2  # A stroke is considered as "far" if its distance from the closest boundary is twice the trial height/width
 
-        stroke_bbox = cval.get_bounding_box_traj(stroke.trajectory, fraction_of_x_points=xy_bbox_fraction, fraction_of_y_points=xy_bbox_fraction)
+        stroke_bboxes = cval.get_stroke_bounding_boxes(trial, fraction_of_x_points=xy_bbox_fraction, fraction_of_y_points=xy_bbox_fraction)
+        stroke_bbox = [bbox for s, bbox in zip(trial.strokes, stroke_bboxes) if s is stroke][0]
 
         return stroke_bbox.xmin > trial_bounding_box.xmax + trial_bounding_box.width * distance_threshold or \
               stroke_bbox.xmax < trial_bounding_box.xmin - trial_bounding_box.width * distance_threshold or \
@@ -442,9 +443,10 @@ class OneFilePdfPlotter(object):
         if not self.config.bounding_box and not self.config.temporal_gaps:
             return
 
-        bounding_boxes = [cval.get_bounding_box(c, fraction_of_x_points=self.config.fraction_of_x_points,
-                                                fraction_of_y_points=self.config.fraction_of_y_points)
-                          for c in trial.characters]
+        bounding_boxes = cval.get_char_bounding_boxes(trial, fraction_of_x_points=self.config.fraction_of_x_points,
+                                                      fraction_of_y_points=self.config.fraction_of_y_points)
+        if None in bounding_boxes:
+            raise ValueError('Invalid trial #{}: some characters have no on-paper points'.format(trial.trial_id))
 
         trial.correct_writing_order = sum(np.diff([box.xmin for box in bounding_boxes]) < 0) == 0  # type: ignore
 
@@ -1,6 +1,9 @@
 from datetime import datetime, date
 from PyQt5.QtWidgets import *
 import pandas as pd
+import threading
+import queue
+import time
 import csv
 import os
 import math
@@ -8,6 +11,10 @@ import math
 
 trials_csv_filename = 'trials.csv'
 
+traj_file_columns = ['x', 'y', 'pressure', 'time']
+
+traj_max_unsaved_ms = 200   # At most this many milliseconds of trajectory samples may be lost if WriTracker crashes
+
 
 #-------------------------------------------------------------------------------------------------------------
 class Target:
@@ -55,11 +62,14 @@ class Trial:
 
 #-------------------------------------------------------------------------------------------------------------
 class Trajectory:
-	def __init__(self, filename, filepath):
+	def __init__(self, filename, filepath, max_unsaved_ms=traj_max_unsaved_ms):
 		self.filename = filename
 		self.filepath = filepath
-		self.file_handle = None
-		self.start_time = datetime.now().strftime("%M:%S:%f")[:-2]
+		self.max_unsaved_ms = max_unsaved_ms
+		self.writer = None
+		self.start_time = None
+		self.last_sample_time = None
+		self.reset_start_time()
 
 	def __str__(self):
 		return self.full_path
@@ -68,32 +78,64 @@ class Trajectory:
 	def full_path(self):
 		return self.filepath + os.sep + self.filename
 
-	def open_traj_file(self, row):
+	@property
+	def is_open(self):
+		return self.writer is not None
+
+	# Open the trajectory file for the current trial (write the header if the file is new).
+	# The file remains open until close() is called; samples are written by a background thread.
+	def open(self):
+		if self.writer is not None:
+			return
 		try:
-			with open(self.full_path, mode='a+', encoding='utf-8') as traj_file:
-				self.file_handle = csv.DictWriter(traj_file, ['x', 'y', 'pressure', 'time'], lineterminator='\n')
-				if row == "header":
-					# check first if file is empty
-					traj_file.seek(0, os.SEEK_END)
-					if traj_file.tell() == 0:
-						self.file_handle.writeheader()
-				else:
-					self.file_handle.writerow(row)
+			self.writer = TrajectoryWriter(self.full_path, max_unsaved_ms=self.max_unsaved_ms)
 		except (IOError, FileNotFoundError):
-			QMessageBox().critical(None, "Warning! file access error",
-								   "WriTracker couldn't save Trajectory file. Last trial trajectory"
-								   " wasn't saved. If the problem repeats, restart the session.",
-								   QMessageBox.Ok)
-			raise Exception("Error writing trajectory file in:" + self.filepath + os.sep + self.filename)
+			self._file_access_error()
+		self.writer.start()
+
+	# Write all pending samples to the file and close it
+	def close(self):
+		if self.writer is None:
+			return
+		writer = self.writer
+		self.writer = None
+		writer.close()
+		if writer.error is not None:
+			self._file_access_error()
 
 	def add_row(self, x_cord, y_cord, pressure):
-		time_abs = datetime.now().strftime("%M:%S:%f")[:-2]
-		time_relative = datetime.strptime(time_abs, "%M:%S:%f") - datetime.strptime(self.start_time, "%M:%S:%f")
-		row = dict(x=x_cord, y=y_cord, pressure=pressure, time=time_relative.total_seconds())
-		self.open_traj_file(row)
-
+		self.add_rows([(x_cord, y_cord, pressure, self.sample_time())])
+
+	# The current time (or the given time.perf_counter() value), in seconds relative to the trial start, in 0.1 ms resolution
+	def sample_time(self, clock_time=None):
+		if clock_time is None:
+			clock_time = time.perf_counter()
+		return round(clock_time - self.start_time, 4)
+
+	# Queue samples for writing. Each row is a tuple of (x, y, pressure, time).
+	def add_rows(self, rows):
+		if self.writer is None:
+			self.open()
+		if self.writer.error is not None:
+			self.writer.close()
+			self.writer = None
+			self._file_access_error()
+		self.writer.add_rows(rows)
+		if len(rows) > 0:
+			self.last_sample_time = rows[-1][3]
+
+	def _file_access_error(self):
+		QMessageBox().critical(None, "Warning! file access error",
+							   "WriTracker couldn't save Trajectory file. Last trial trajectory"
+							   " wasn't saved. If the problem repeats, restart the session.",
+							   QMessageBox.Ok)
+		raise Exception("Error writing trajectory file in:" + self.filepath + os.sep + self.filename)
+
+	# Sample times are measured using a monotonic high-resolution clock, so they are not affected by
+	# changes of the system clock and do not wrap around
 	def reset_start_time(self):
-		self.start_time = datetime.now().strftime("%M:%S:%f")[:-2]
+		self.start_time = time.perf_counter()
+		self.last_sample_time = None
 
 	# This function rotates trajectory file by angle degrees. Angle must be one of the following: 0, 90, 270.
 	# Angle of 0 will cause 180 degrees rotation. This is due to mismatch between the tablet & PyQt Coordinate system.
@@ -109,7 +151,9 @@ class Trajectory:
 			cos_ang = 0
 			sin_ang = -1
 
-		fields = ['x', 'y', 'pressure', 'time']
+		self.close()   # make sure all samples are on disk before reading the file
+
+		fields = traj_file_columns
 		try:
 			raw_points = pd.read_csv(self.full_path, usecols=fields)
 		except (IOError, FileNotFoundError):
@@ -135,6 +179,105 @@ class Trajectory:
 			return False
 
 
+#-------------------------------------------------------------------------------------------------------------
+class TrajectoryWriter(threading.Thread):
+	"""
+	Write the trajectory samples of one trial to a CSV file, in a background thread.
+
+	The file is opened once and kept open until close() is called. Samples are queued by the GUI thread and
+	accumulated in memory by the writer thread, which writes them to the file (and flushes to disk) when enough
+	samples were accumulated, or when the oldest unsaved sample is max_unsaved_ms old - whichever comes first.
+	So if the program crashes, at most max_unsaved_ms of samples are lost.
+	"""
+
+	_close_request = object()
+
+	def __init__(self, full_path, max_unsaved_ms=traj_max_unsaved_ms, max_buffered_rows=1000, max_queued_chunks=10000):
+		"""
+		:param full_path: The trajectory file. If it exists, new samples are appended to it.
+		:param max_unsaved_ms: Maximal time (ms) that a sample remains in memory before being saved to disk
+		:param max_buffered_rows: Write the buffered samples once there are this many of them
+		:param max_queued_chunks: Size of the queue between the GUI thread and the writer thread. When it is full,
+								  add_rows() blocks until the writer thread catches up.
+		"""
+		super().__init__(name='TrajectoryWriter', daemon=True)
+		self.full_path = full_path
+		self.max_unsaved_sec = max_unsaved_ms / 1000
+		self.max_buffered_rows = max_buffered_rows
+		self.error = None
+		self._queue = queue.Queue(maxsize=max_queued_chunks)
+
+		#-- The file is opened here (rather than in the thread) so that access errors are reported to the caller
+		self._fp = open(full_path, mode='a+', encoding='utf-8')
+		self._writer = csv.writer(self._fp, lineterminator='\n')
+		self._fp.seek(0, os.SEEK_END)
+		if self._fp.tell() == 0:
+			self._writer.writerow(traj_file_columns)
+			self._flush()
+
+	#-----------------------------------------------------------------
+	def add_rows(self, rows):
+		"""
+		Queue samples for writing
+
+		:param rows: A list of (x, y, pressure, time) tuples
+		"""
+		self._queue.put(rows)
+
+	#-----------------------------------------------------------------
+	def close(self):
+		"""
+		Write all pending samples, close the file, and wait for the writer thread to finish
+		"""
+		self._queue.put(self._close_request)
+		self.join()
+
+	#-----------------------------------------------------------------
+	def run(self):
+		buffer = []
+		flush_deadline = None
+		closing = False
+
+		while not closing:
+			timeout = None if flush_deadline is None else max(0.0, flush_deadline - time.monotonic())
+			try:
+				chunk = self._queue.get(timeout=timeout)
+			except queue.Empty:
+				chunk = None
+
+			if chunk is self._close_request:
+				closing = True
+			elif chunk is not None:
+				if flush_deadline is None:
+					flush_deadline = time.monotonic() + self.max_unsaved_sec
+				buffer.extend(chunk)
+
+			if len(buffer) > 0 and (closing or len(buffer) >= self.max_buffered_rows or time.monotonic() >= flush_deadline):
+				self._write(buffer)
+				buffer = []
+				flush_deadline = None
+
+		try:
+			self._fp.close()
+		except (IOError, OSError) as e:
+			self.error = self.error or e
+
+	#-----------------------------------------------------------------
+	def _write(self, rows):
+		if self.error is not None:
+			return  # The error was already reported; just drain the queue so that the GUI thread never blocks
+		try:
+			self._writer.writerows(rows)
+			self._flush()
+		except (IOError, OSError) as e:
+			self.error = e
+
+	def _flush(self):
+		self._fp.flush()
+		os.fsync(self._fp.fileno())
+
+
+
 #----------------------------------------------------------------------------------
 def save_trials(results_path, targets):
 	"""
@@ -0,0 +1,98 @@
+"""
+Batch processing of the packets received from the tablet
+"""
+import numpy as np
+
+
+pressure_scale = 327.67   # Divide the tablet's raw pressure by this value to normalize it to a 0-100 range
+time_resolution = 0.0001  # The resolution of the trajectory files' time column (seconds)
+
+
+#-------------------------------------------------------------------------------------------------------------
+class PacketBatch(object):
+    """
+    The pen samples extracted from one batch of tablet packets (all arrays have one entry per sample)
+    """
+
+    def __init__(self, x, y, pressure, press, release):
+        self.x = x
+        self.y = y
+        self.pressure = pressure
+        self.press = press          # The pen touched the tablet in this sample
+        self.release = release      # The pen left the tablet in this sample
+
+    @property
+    def n_samples(self):
+        return len(self.x)
+
+    @property
+    def move(self):
+        """ The pen moved while touching the tablet """
+        return np.logical_and(self.pressure > 0, np.logical_not(self.press))
+
+    @property
+    def last_sample(self):
+        """ (x, y, pressure) of the last sample in the batch """
+        return int(self.x[-1]), int(self.y[-1]), int(self.pressure[-1])
+
+    def trajectory_rows(self, time, prev_time=None):
+        """
+        Get the rows to write to the trajectory file: (x, y, pressure, time) per sample.
+        When the pen leaves the tablet, an additional zero-pressure sample is added.
+
+        :param time: The time of the last row (i.e., when the batch was received)
+        :param prev_time: The time of the previous batch. If specified, the rows' times are spread evenly between
+                          prev_time (exclusive) and time, in 0.1 ms resolution, so they are strictly increasing (if the
+                          interval is too short for this, the last rows get times slightly after 'time').
+                          Otherwise all rows get the same time.
+        """
+        counts = np.where(self.release, 2, 1)
+        x = np.repeat(self.x, counts).tolist()
+        y = np.repeat(self.y, counts).tolist()
+        pressure = np.repeat(self.pressure, counts).tolist()
+
+        if prev_time is None:
+            times = [time] * len(x)
+        else:
+            time = max(time, prev_time + time_resolution * len(x))
+            times = np.round(prev_time + (time - prev_time) * np.arange(1, len(x) + 1) / len(x), 4).tolist()
+
+        return list(zip(x, y, pressure, times))
+
+
+#-------------------------------------------------------------------------------------------------------------
+def process_packets(packets, prev_x, prev_y, prev_pressure):
+    """
+    Convert a batch of tablet packets into pen samples.
+
+    A packet with x=y=0 marks the end of the valid data. Packets in which the pen did not move (same x,y as
+    the previous sample) are dropped.
+
+    :param packets: A NumPy structured array with the fields pkX, pkY and pkNormalPressure
+    :param prev_x: x coordinate of the last sample from the previous batch
+    :param prev_y: y coordinate of the last sample from the previous batch
+    :param prev_pressure: Normalized pressure of the last sample from the previous batch
+    :return: PacketBatch
+    """
+    x = np.asarray(packets['pkX'], dtype=np.int64)
+    y = np.asarray(packets['pkY'], dtype=np.int64)
+    raw_pressure = np.asarray(packets['pkNormalPressure'])
+
+    #-- Ignore everything from the first zero packet
+    zero_packets = np.flatnonzero(np.logical_and(x == 0, y == 0))
+    if len(zero_packets) > 0:
+        n = zero_packets[0]
+        x, y, raw_pressure = x[:n], y[:n], raw_pressure[:n]
+
+    #-- Drop packets that repeat the previous pen position
+    moved = np.logical_or(x != np.append(prev_x, x[:-1]), y != np.append(prev_y, y[:-1]))
+    x, y, raw_pressure = x[moved], y[moved], raw_pressure[moved]
+
+    pressure = (raw_pressure / pressure_scale).astype(np.int64)
+
+    #-- Detect the pen touching / leaving the tablet
+    pressure_before = np.append(prev_pressure, pressure[:-1])
+    press = np.logical_and(pressure_before == 0, pressure > 0)
+    release = np.logical_and(pressure_before > 0, pressure == 0)
+
+    return PacketBatch(x, y, pressure, press, release)
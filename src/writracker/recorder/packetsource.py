@@ -0,0 +1,214 @@
+"""
+Sources of tablet packets for the recorder.
+
+The recorder reads pen samples from a PacketSource. The default source is the Wintab tablet (Windows only);
+the replay sources feed recorded or synthetic handwriting, which allows running the recorder without a tablet.
+"""
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from writracker.recorder import packets
+from writracker.recorder.wintab_params import PACKET
+
+
+packet_dtype = np.dtype(PACKET)
+max_packets_per_read = 100        # The number of packets read from the tablet in each poll (like wintab.GetPackets)
+default_device_queue_size = 128   # The number of packets the tablet driver queue can hold
+
+
+#-------------------------------------------------------------------------------------------------------------
+class PacketSource(object):
+    """
+    A source of tablet packets
+    """
+
+    def open(self, h_wnd):
+        """ Start receiving packets. h_wnd is the handle of the receiving window """
+        pass
+
+    def close(self):
+        pass
+
+    def get_packets(self):
+        """ Get the packets received since the previous call, as a NumPy array of packet_dtype """
+        raise NotImplementedError()
+
+    def tablet_name(self):
+        """ The name of the connected tablet, or None if there is no tablet """
+        return None
+
+
+#-------------------------------------------------------------------------------------------------------------
+class WintabPacketSource(PacketSource):
+    """
+    Packets from a Wintab tablet
+    """
+
+    def __init__(self):
+        #-- wintab loads the Wintab DLL, so it's imported only when a tablet is actually used
+        from writracker.recorder import wintab
+        self.wintab = wintab
+
+    def open(self, h_wnd):
+        self.wintab.hctx = self.wintab.OpenTabletContexts(h_wnd)
+
+    def close(self):
+        self.wintab.CloseTabletContext(self.wintab.hctx)
+
+    def get_packets(self):
+        return self.wintab.GetPacketsArray()
+
+    def tablet_name(self):
+        return self.wintab.getTabletInfo()
+
+
+#-------------------------------------------------------------------------------------------------------------
+class ReplayPacketSource(PacketSource):
+    """
+    Replay a sequence of pen samples in real time (or faster/slower).
+
+    The samples become available according to their time stamps. Like the tablet driver, the source keeps
+    the available packets in a queue of a limited size, and packets that arrive when the queue is full are
+    lost. Each get_packets() call returns up to max_packets_per_read packets from the queue.
+
+    Statistics: n_delivered, n_dropped, and latencies (per delivered packet, the time in seconds from the
+    moment it became available until get_packets() returned it).
+    """
+
+    def __init__(self, x, y, pressure, t, speed=1.0, queue_size=default_device_queue_size):
+        """
+        :param x: x coordinates (tablet units)
+        :param y: y coordinates (tablet units)
+        :param pressure: Normalized pressure (0-100), as saved in the trajectory files
+        :param t: Time of each sample, in seconds
+        :param speed: Replay speed: 1 = real time, 2 = twice as fast, etc.
+        :param queue_size: Maximal number of packets waiting to be read
+        """
+        assert speed > 0, 'Invalid speed ({})'.format(speed)
+
+        self.packets = np.zeros(len(x), dtype=packet_dtype)
+        self.packets['pkX'] = x
+        self.packets['pkY'] = y
+        self.packets['pkNormalPressure'] = np.ceil(np.asarray(pressure, dtype=float) * packets.pressure_scale)
+        self.packets['pkSerialNumber'] = np.arange(len(x))
+
+        t = np.asarray(t, dtype=float)
+        self.arrival_offsets = (t - t[0]) / speed if len(t) > 0 else t
+        self.queue_size = queue_size
+
+        self.start_time = None
+        self.n_arrived = 0      # The number of samples that became available so far
+        self.queue = []         # Indices of the packets waiting to be read
+        self.n_delivered = 0
+        self.n_dropped = 0
+        self.latencies = []
+        self.last_arrival_times = np.zeros(0)   # The arrival times of the packets returned by the last get_packets()
+
+    @property
+    def n_packets(self):
+        return len(self.packets)
+
+    @property
+    def finished(self):
+        """ Whether all packets were either delivered or dropped """
+        return self.start_time is not None and self.n_arrived == self.n_packets and len(self.queue) == 0
+
+    def get_packets(self):
+        now = time.perf_counter()
+        if self.start_time is None:
+            #-- The replay starts on the first poll
+            self.start_time = now
+
+        #-- Move the packets that arrived so far into the queue; packets that don't fit are lost
+        n_arrived = int(np.searchsorted(self.arrival_offsets, now - self.start_time, side='right'))
+        new_packets = range(self.n_arrived, n_arrived)
+        n_queued = min(len(new_packets), max(self.queue_size - len(self.queue), 0))
+        self.queue.extend(new_packets[:n_queued])
+        self.n_dropped += len(new_packets) - n_queued
+        self.n_arrived = n_arrived
+
+        #-- Read from the queue
+        inds = np.array(self.queue[:max_packets_per_read], dtype=int)
+        del self.queue[:max_packets_per_read]
+
+        self.last_arrival_times = self.start_time + self.arrival_offsets[inds]
+        self.latencies.extend((now - self.last_arrival_times).tolist())
+        self.n_delivered += len(inds)
+
+        return self.packets[inds]
+
+
+#-------------------------------------------------------------------------------------------------------------
+class TrajectoryFileReplaySource(ReplayPacketSource):
+    """
+    Replay trajectory files saved by the recorder (trajectory_*.csv). The files are played one after another.
+    """
+
+    def __init__(self, filenames, speed=1.0, queue_size=default_device_queue_size, gap=1.0):
+        """
+        :param filenames: A trajectory file name, or a list of file names
+        :param gap: Time gap (in seconds) between the end of one file and the beginning of the next one
+        """
+        if isinstance(filenames, str):
+            filenames = [filenames]
+
+        x, y, pressure, t = [], [], [], []
+        start_time = 0
+        for filename in filenames:
+            df = pd.read_csv(filename)
+            if len(df) == 0:
+                continue
+            x.append(df.x.values)
+            y.append(df.y.values)
+            pressure.append(df.pressure.values)
+            t.append(df.time.values - df.time.values[0] + start_time)
+            start_time = t[-1][-1] + gap
+
+        x, y, pressure, t = [np.concatenate(values or [np.zeros(0)]) for values in (x, y, pressure, t)]
+
+        super().__init__(x, y, pressure, t, speed=speed, queue_size=queue_size)
+
+
+#-------------------------------------------------------------------------------------------------------------
+class SyntheticHandwritingSource(ReplayPacketSource):
+    """
+    Replay generated handwriting: strokes made of cursive-like loops, with the pen lifted between strokes
+    """
+
+    def __init__(self, n_strokes=10, stroke_duration=1.0, sampling_rate=200, speed=1.0,
+                 queue_size=default_device_queue_size, seed=0):
+        """
+        :param n_strokes: Number of strokes to generate
+        :param stroke_duration: Duration of each stroke (in seconds)
+        :param sampling_rate: Number of samples per second
+        """
+        rng = np.random.default_rng(seed)
+
+        n_on_paper = int(stroke_duration * sampling_rate)
+        n_in_air = int(0.2 * sampling_rate)
+        phase = np.linspace(0, 4 * math.pi, n_on_paper)
+
+        x, y, pressure = [], [], []
+        for i in range(n_strokes):
+            x0 = 100 + (i % 10) * 180 + rng.integers(0, 20)
+            y0 = 200 + (i // 10) * 150 + rng.integers(0, 20)
+            stroke_x = x0 + 60 * phase / (4 * math.pi) + 25 * np.sin(phase)
+            stroke_y = y0 + 40 * np.cos(phase)
+            stroke_pressure = 20 + 60 * np.sin(np.linspace(0, math.pi, n_on_paper))
+
+            #-- Approach the stroke with the pen up
+            x.append(stroke_x[0] - n_in_air + np.arange(n_in_air))
+            y.append(np.full(n_in_air, stroke_y[0]))
+            pressure.append(np.zeros(n_in_air))
+
+            x.append(stroke_x)
+            y.append(stroke_y)
+            pressure.append(stroke_pressure)
+
+        x, y, pressure = [np.round(np.concatenate(values or [np.zeros(0)])).astype(int) for values in (x, y, pressure)]
+        t = np.arange(len(x)) / sampling_rate
+
+        super().__init__(x, y, pressure, t, speed=speed, queue_size=queue_size)
@@ -12,10 +12,10 @@ import subprocess                  # This originally used only to check if WACOM
 import sys
 import os
 import time
-from win32com.shell import shell, shellcon
 import numpy as np
 
-from writracker.recorder import dataio, wintab
+from writracker.recorder import dataio, packets, packetsource
+from writracker.recorder.wintab_params import X_AXIS_OUTPUT_RANGE_MAX
 import writracker.utils as u
 import writracker.recorder
 
@@ -28,13 +28,15 @@ TABLET_POLL_TIME = 50   # defines the polling frequency for tablet packets, in m
 # -------------------------------------------------------------------------------------------------------------
 # noinspection PyPep8Naming
 class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define window = QMainWindow() or Qwidget()
-	def __init__(self, parent=None):
+	def __init__(self, parent=None, packet_source=None):
 		super(MainWindow, self).__init__(parent)
 
 		self.title = "WriTracker Recorder"
 		# Establish tablet connection & Start polling
+		# packet_source: where the tablet packets come from (default: the Wintab tablet)
+		self.packet_source = packetsource.WintabPacketSource() if packet_source is None else packet_source
 		h_wnd = int(self.winId())                            # Get current window's window handle
-		wintab.hctx = wintab.OpenTabletContexts(h_wnd)       # context handle for the tablet polling function.
+		self.packet_source.open(h_wnd)
 		self.poll_timer = QTimer(self)
 		# noinspection PyUnresolvedReferences
 		self.poll_timer.timeout.connect(self.tabletPoll)    # Start timer & Run polling function
@@ -45,6 +47,7 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 		self.pen_ytilt = 0
 		self.pen_y = 0
 		self.pen_pressure = 0
+		self.last_poll_time = time.perf_counter()  # time.perf_counter() of the previous tabletPoll() call
 		self.rotation_angle = 0             # Each rotate button press adds 90. used for rotating the traj file.
 		self.x_resolution = app.desktop().screenGeometry().right()  # this value is for mirroring X coordinates
 		# All files & paths
@@ -71,7 +74,8 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 		self.allow_sound_play = False
 		self.skip_ok_targets = False        # Controls viewing mode: when True, skip targets where RC = "ok".
 
-		self.path = QPainterPath()
+		self.path = QPainterPath()          # The stroke currently being drawn
+		self.stroke_item = None             # The scene item showing self.path (one item per stroke)
 		# UI settings
 		uic.loadUi(os.path.dirname(__file__) + os.sep + 'recorder_ui.ui', self)
 		self.cfg_window = QDialog()
@@ -160,52 +164,50 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 
 	#--------------------------------------------------------------------------------------
 	def tabletPoll(self):
-		lp_pkts = (wintab.PACKET * 100)()
-		lp_pkts = wintab.GetPackets()
+		prev_poll_time, self.last_poll_time = self.last_poll_time, time.perf_counter()
 
-		if lp_pkts == 0:  # no packets received
+		lp_pkts = self.packet_source.get_packets()
+		if len(lp_pkts) == 0:  # no packets received
 			return
-		print("packet count: ", len(lp_pkts))
-		for i in range(len(lp_pkts)):
-			if (lp_pkts[i].pkX == 0 and lp_pkts[i].pkY == 0):
-				return
 
-			# if this pen and next pen are the same, return
-			if self.pen_x == lp_pkts[i].pkX and self.pen_y == lp_pkts[i].pkY:
-				continue
+		batch = packets.process_packets(lp_pkts, self.pen_x, self.pen_y, self.pen_pressure)
+		if batch.n_samples == 0:
+			return
 
-			# CR add for loop for the points in the packet
-			self.pen_x = lp_pkts[i].pkX
-			self.pen_y = lp_pkts[i].pkY
-
-			new_pressure = int(lp_pkts[i].pkNormalPressure / 327.67)  # normalized to 0-100 range
-
-			print(self.pen_x, self.pen_y, new_pressure)
-			# mark Trial started flag, but only if the ok/error are not checked.
-			# this allows buffer time from the moment we chose RC to pressing next and avoid new file creation
-			if self.btn_radio_ok.isChecked() is False and self.btn_radio_err.isChecked() is False and self.session_started:
-				# When we the user chose to play sounds
-				# the trial will start when pressing play, and not when touching the tablet.
-				if not self.trial_started and self.sounds_folder_path is None:
-					print("self start in poll")
-					self.start_trial()
-			#
-			if self.pen_pressure == 0 and new_pressure > 0:  # "TabletPress"
-				self.path.moveTo(QPoint(int(wintab.X_AXIS_OUTPUT_RANGE_MAX - self.pen_x), int(self.pen_y)))
-			elif self.pen_pressure > 0 and new_pressure == 0:  # "TabletRelease"
-				if self.session_started:
-					# When the pen leaves the surface, add a sample point with zero pressure
-					self.current_active_trajectory.add_row(self.pen_x, self.pen_y, 0)
-			elif new_pressure > 0:  # it's a "TabletMove" event
-				self.path.lineTo(QPoint(wintab.X_AXIS_OUTPUT_RANGE_MAX - self.pen_x, self.pen_y))
-			self.update()  # calls paintEvent
-			self.pen_pressure = new_pressure
-			# write to traj file:
-			if self.current_active_trajectory is not None and self.session_started:
-				self.current_active_trajectory.add_row(self.pen_x, self.pen_y, self.pen_pressure)
-
-	def paintEvent(self, event):
-		self.scene.addPath(self.path)
+		# mark Trial started flag, but only if the ok/error are not checked.
+		# this allows buffer time from the moment we chose RC to pressing next and avoid new file creation
+		if self.btn_radio_ok.isChecked() is False and self.btn_radio_err.isChecked() is False and self.session_started:
+			# When we the user chose to play sounds
+			# the trial will start when pressing play, and not when touching the tablet.
+			if not self.trial_started and self.sounds_folder_path is None:
+				self.start_trial()
+
+		screen_x = (X_AXIS_OUTPUT_RANGE_MAX - batch.x).tolist()
+		screen_y = batch.y.tolist()
+		stroke_changed = False
+		for x, y, press, move in zip(screen_x, screen_y, batch.press.tolist(), batch.move.tolist()):
+			if press or (move and self.stroke_item is None):     # "TabletPress"
+				self.start_stroke(x, y)
+			elif move:    # "TabletMove"
+				self.path.lineTo(QPoint(x, y))
+				stroke_changed = True
+		if stroke_changed:
+			self.stroke_item.setPath(self.path)
+
+		self.pen_x, self.pen_y, self.pen_pressure = batch.last_sample
+
+		# write to traj file: the packets arrived since the previous poll, so their time stamps are spread over this interval
+		if self.current_active_trajectory is not None and self.session_started:
+			traj = self.current_active_trajectory
+			prev_time = max(traj.sample_time(prev_poll_time), 0 if traj.last_sample_time is None else traj.last_sample_time)
+			traj.add_rows(batch.trajectory_rows(traj.sample_time(), prev_time))
+
+	#--------------------------------------------------------------------------------------
+	# Each stroke is drawn as a single scene item, which is extended in place as new samples arrive
+	def start_stroke(self, x, y):
+		self.path = QPainterPath()
+		self.path.moveTo(QPoint(x, y))
+		self.stroke_item = self.scene.addPath(self.path)
 
 	#               -------------------------- Button/Menu Functions --------------------------
 
@@ -312,6 +314,7 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 							  msg.Yes | msg.No, msg.No)
 		if answer == msg.Yes:
 			print("Writracker: trajectory file deleted, " + str(self.current_active_trajectory))
+			self.current_active_trajectory.close()
 			os.remove(str(self.current_active_trajectory))
 			self.set_recording_on()
 			if self.allow_sound_play:
@@ -398,8 +401,10 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 				self.close_current_trial()
 				self.save_trials_file()
 				self.save_remaining_targets_file()
+			if self.current_active_trajectory is not None:
+				self.current_active_trajectory.close()
 			self.poll_timer.stop()
-			wintab.CloseTabletContext(wintab.hctx)
+			self.packet_source.close()
 			self.close()
 
 	#------------------------------------------------------------------------------------------
@@ -680,6 +685,8 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 		self.remaining_targets_file = None
 		self.trials_file = None
 		self.trial_unique_id = 1
+		if self.current_active_trajectory is not None:
+			self.current_active_trajectory.close()
 		self.current_active_trajectory = None
 		self.results_folder_path = None
 		self.targets = []
@@ -712,6 +719,8 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 	# ----------------------------------------------------------------------------------
 
 	def close_current_trial(self):
+		# Make sure all the trial's samples were written
+		self.current_active_trajectory.close()
 		# Rotate trajectory file if a rotation was applied during the writing
 		if self.rotation_angle != 180:
 			self.current_active_trajectory.rotate_trajectory_file(self.rotation_angle)
@@ -825,8 +834,10 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 
 	# ----------------------------------------------------------------------------------
 	def open_trajectory(self, unique_id):
+		if self.current_active_trajectory is not None:
+			self.current_active_trajectory.close()
 		self.current_active_trajectory = dataio.Trajectory("trajectory_" + unique_id + ".csv", self.results_folder_path)
-		self.current_active_trajectory.open_traj_file("header")
+		self.current_active_trajectory.open()
 
 	# ----------------------------------------------------------------------------------
 	def set_recording_on(self):
@@ -848,6 +859,7 @@ class MainWindow(QMainWindow):  # inherits QMainWindow, can equally define windo
 	def clean_display(self):
 		self.scene.clear()
 		self.path = QPainterPath()  # Re-declare path for a fresh start
+		self.stroke_item = None
 		self.update()               # update view after re-declare
 
 	# ----------------------------------------------------------------------------------
@@ -968,6 +980,7 @@ def check_if_tablet_connected_mac():
 # Check if a wacom tablet is connected. This check works on windows device - depended on wintab32 library
 # The check isn't blocking the program from running - for the case the device status is not 100% reliable.
 def check_if_tablet_connected_windows():
+	from writracker.recorder import wintab
 	tablet_name = wintab.getTabletInfo()
 	if tablet_name is not None:
 		print("WintabW: Tablet Found: {}".format(tablet_name))
@@ -993,6 +1006,7 @@ def _critical_msg(title, msg):
 
 #----------------------------------------
 def user_documents_folder():
+	from win32com.shell import shell, shellcon
 	return shell.SHGetFolderPath(0, shellcon.CSIDL_PERSONAL, None, 0)
 
 
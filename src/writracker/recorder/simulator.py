@@ -0,0 +1,98 @@
+"""
+Run the recorder without a tablet and without a display, feeding it packets from a replay source.
+
+This is used for testing and benchmarking the recorder's packet ingestion on any machine.
+"""
+import os
+import time
+
+import numpy as np
+
+
+#-------------------------------------------------------------------------------------------------------------
+class SimulationResults(object):
+    """
+    Statistics of one headless recorder run
+    """
+
+    def __init__(self, n_packets, n_delivered, n_dropped, latencies, poll_durations, duration):
+        self.n_packets = n_packets
+        self.n_delivered = n_delivered
+        self.n_dropped = n_dropped
+        self.latencies = np.array(latencies)              # Per packet: from its arrival until tabletPoll() finished processing it (seconds)
+        self.poll_durations = np.array(poll_durations)    # Duration of each tabletPoll() call (seconds)
+        self.duration = duration
+
+    def summary(self):
+        lines = ['Packets: {} total, {} processed, {} dropped ({:.2f}%)'.format(
+            self.n_packets, self.n_delivered, self.n_dropped, 100 * self.n_dropped / max(self.n_packets, 1))]
+        if len(self.latencies) > 0:
+            lines.append('End-to-end latency (ms): mean={:.2f}, median={:.2f}, 95%={:.2f}, max={:.2f}'.format(
+                *(1000 * np.array([np.mean(self.latencies), np.median(self.latencies),
+                                   np.percentile(self.latencies, 95), np.max(self.latencies)]))))
+        if len(self.poll_durations) > 0:
+            lines.append('tabletPoll() duration (ms): mean={:.3f}, max={:.3f}, over {} polls'.format(
+                1000 * np.mean(self.poll_durations), 1000 * np.max(self.poll_durations), len(self.poll_durations)))
+        lines.append('Run time: {:.2f} sec'.format(self.duration))
+        return '\n'.join(lines)
+
+
+#-------------------------------------------------------------------------------------------------------------
+def run_headless(packet_source, results_folder=None, poll_time=None, timeout=None):
+    """
+    Run the recorder's main window on the offscreen Qt platform until all packets of the source were processed.
+
+    :param packet_source: A replay source (packetsource.ReplayPacketSource)
+    :param results_folder: If specified, the samples are also saved to a trajectory file in this folder
+    :param poll_time: Tablet polling interval (ms). Default: the recorder's polling interval.
+    :param timeout: Stop after this number of seconds even if not all packets were processed
+    :return: SimulationResults
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+    from writracker.recorder import recorder
+
+    app = QApplication.instance() or QApplication([])
+    recorder.app = app
+
+    window = recorder.MainWindow(packet_source=packet_source)
+    if results_folder is not None:
+        window.results_folder_path = results_folder
+        window.session_started = True
+        window.trial_started = True
+        window.open_trajectory('replay')
+
+    latencies = []
+    poll_durations = []
+
+    def poll():
+        t0 = time.perf_counter()
+        window.tabletPoll()
+        t1 = time.perf_counter()
+        poll_durations.append(t1 - t0)
+        latencies.extend((t1 - packet_source.last_arrival_times).tolist())
+        if packet_source.finished:
+            app.quit()
+
+    window.poll_timer.stop()
+    window.poll_timer.timeout.disconnect()
+    window.poll_timer.timeout.connect(poll)
+    window.poll_timer.start(recorder.TABLET_POLL_TIME if poll_time is None else poll_time)
+
+    if timeout is not None:
+        QTimer.singleShot(int(timeout * 1000), app.quit)
+
+    start_time = time.perf_counter()
+    app.exec_()
+    duration = time.perf_counter() - start_time
+
+    window.poll_timer.stop()
+    if window.current_active_trajectory is not None:
+        window.current_active_trajectory.close()
+    packet_source.close()
+    window.close()
+
+    return SimulationResults(packet_source.n_packets, packet_source.n_delivered, packet_source.n_dropped,
+                             latencies, poll_durations, duration)
@@ -1,8 +1,9 @@
-from writracker.recorder.wintab_params import LOGCONTEXT, AXIS, PACKET
+from writracker.recorder.wintab_params import LOGCONTEXT, AXIS, PACKET, X_AXIS_OUTPUT_RANGE_MAX
 # from win32api import GetSystemMetrics
 from tkinter import messagebox, Tk
 from ctypes.wintypes import DWORD
 from ctypes import *
+import numpy as np
 
 
 try:
@@ -14,10 +15,6 @@ except OSError as e:
                                                              "\nTry to install/reinstall Tablet drivers.")
     raise Exception("wintab32 library couldn't load. wintab32.dll file couldn't be found. Try to install Tablet drivers.", e)
 
-''' Hard coded value for setting the X axis returned values range.
-The tablet scales the input of the x and y ranges according to what defined in lcMine.lcOut<Org/Ext><X/Y>'''
-X_AXIS_OUTPUT_RANGE_MAX = 2000
-
 FIX32 = DWORD
 WTPKT = FIX32
 
@@ -163,3 +160,14 @@ def GetPackets():
         return lpPkts
     return 0
 
+
+
+# -- Reads the latest packets from the tablet's packet queue, as a NumPy structured array --
+# use this function after calling OpenTabletContext()
+# returns an array with one entry per received packet (with the PACKET fields), or an empty array.
+def GetPacketsArray():
+    global hctx
+    cMaxPkts = 100
+    lpPkts = (PACKET * cMaxPkts)()
+    recv_num = wintab.WTPacketsGet(hctx, cMaxPkts, lpPkts)
+    return np.ctypeslib.as_array(lpPkts)[:max(recv_num, 0)]
@@ -4,6 +4,10 @@ from ctypes.wintypes import WCHAR, DWORD, BOOL, HWND, HANDLE, LONG
 FIX32 = DWORD
 WTPKT = FIX32
 
+''' Hard coded value for setting the X axis returned values range.
+The tablet scales the input of the x and y ranges according to what defined in lcMine.lcOut<Org/Ext><X/Y>'''
+X_AXIS_OUTPUT_RANGE_MAX = 2000
+
 
 class AXIS(Structure):
     _fields_ = [("axMin", c_long),    # Specifies the minimum value of the data item in the tablet's native coordinates
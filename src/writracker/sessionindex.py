@@ -0,0 +1,221 @@
+"""
+Cached index of a WEncoder results directory: the trials in trials.csv and the trajectory files in the directory.
+
+Several functions need the list of trials in a session, or the trajectory files, and some are called once per trial.
+Instead of each of them re-parsing trials.csv (or listing the directory), they get the information from the
+directory's SessionIndex. The index is parsed once and re-parsed only when trials.csv, the session journal, or the
+directory itself changes (according to their size and modification time).
+
+Trials that were deleted in the session journal (see sessionjournal) are not included in the index.
+"""
+import fnmatch
+import os
+
+import pandas as pd
+
+from writracker import sessionjournal
+
+
+trials_filename = 'trials.csv'
+
+#-- The minimal columns in trials.csv
+trial_key_cols = 'trial_id', 'sub_trial_num', 'traj_file_name'
+
+_indexes = dict()
+
+
+#-------------------------------------------------------------------------------------------------
+def get(dir_name):
+    """
+    Get the (up-to-date) index of the given directory
+    """
+    key = os.path.abspath(dir_name)
+    index = _indexes.get(key)
+    if index is None:
+        index = SessionIndex(dir_name)
+        _indexes[key] = index
+    return index
+
+
+#-------------------------------------------------------------------------------------------------
+class SessionIndex(object):
+    """
+    The trials and trajectory files of one session directory.
+    Information is parsed on first access, and re-parsed when the underlying files change.
+    """
+
+    def __init__(self, dir_name):
+        self.dir_name = dir_name
+        self._rows_state = None
+        self._fieldnames = None
+        self._rows_by_key = None
+        self._sub_trials = None
+        self._trials_df_state = None
+        self._trials_df = None
+        self._listing_state = None
+        self._filenames = None
+
+    #-------------------------------------------------------------
+    @property
+    def trials_filename(self):
+        return self.dir_name + os.sep + trials_filename
+
+    @property
+    def exists(self):
+        """ Whether the trials.csv file exists """
+        return os.path.isfile(self.trials_filename)
+
+    #-------------------------------------------------------------
+    @property
+    def fieldnames(self):
+        """ The columns of trials.csv (None if the file does not exist) """
+        self._refresh_rows()
+        return self._fieldnames
+
+    @property
+    def trial_keys(self):
+        """ The (trial_id, sub_trial_num) of all trials, in the order of trials.csv """
+        self._refresh_rows()
+        return list(self._rows_by_key)
+
+    def has_trial(self, trial_id, sub_trial_num):
+        self._refresh_rows()
+        return (trial_id, sub_trial_num) in self._rows_by_key
+
+    def trial_rows(self, trial_id, sub_trial_num=None):
+        """
+        The trials.csv rows (as dicts of strings) of the given trial, or of all its sub-trials if sub_trial_num=None.
+        Normally, there is one row per sub-trial.
+        """
+        self._refresh_rows()
+        if sub_trial_num is not None:
+            return list(self._rows_by_key.get((trial_id, sub_trial_num), []))
+
+        return [row for stn in self._sub_trials.get(trial_id, []) for row in self._rows_by_key[(trial_id, stn)]]
+
+    def traj_file_names(self, trial_id, sub_trial_num=None):
+        """ The trajectory file names of the given trial (or all its sub-trials) """
+        return [row['traj_file_name'] for row in self.trial_rows(trial_id, sub_trial_num)]
+
+    #-------------------------------------------------------------
+    def _refresh_rows(self):
+        state = self._trials_file_state()
+        if state == self._rows_state:
+            return
+
+        fieldnames, rows = sessionjournal.load_live_rows(self.dir_name, trials_filename)
+
+        if fieldnames is not None:
+            missing_fields = [f for f in trial_key_cols if f not in fieldnames]
+            if len(missing_fields) > 0:
+                raise ValueError("Invalid format for CSV file {:}: the file does not contain the field/s {:}"
+                                 .format(self.trials_filename, ", ".join(missing_fields)))
+
+        #-- Line numbers (for error messages) are known only if no rows were removed
+        has_line_nums = not sessionjournal.has_tombstones(self.dir_name)
+
+        self._fieldnames = fieldnames
+        self._rows_by_key = dict()
+        self._sub_trials = dict()
+        for line_num, row in enumerate(rows, start=2):
+            self._add_row(row, line_num if has_line_nums else None)
+
+        self._rows_state = state
+
+    def _add_row(self, row, line_num):
+        key = _parse_key(row, line_num, self.trials_filename)
+        if key not in self._rows_by_key:
+            self._rows_by_key[key] = []
+            self._sub_trials.setdefault(key[0], []).append(key[1])
+        self._rows_by_key[key].append(row)
+
+    #-------------------------------------------------------------
+    def trials_df(self, **read_csv_kwargs):
+        """
+        Get trials.csv as a data frame (a copy, which the caller may modify).
+        If read_csv_kwargs are specified, the file is re-read with them and the result is not cached.
+
+        :return: DataFrame, or None if the file does not exist
+        """
+        if len(read_csv_kwargs) > 0:
+            return self._read_trials_df(read_csv_kwargs)
+
+        state = self._trials_file_state()
+        if state != self._trials_df_state:
+            self._trials_df = self._read_trials_df(dict(dtype=dict(response='string')))
+            self._trials_df_state = state
+
+        return None if self._trials_df is None else self._trials_df.copy()
+
+    def _read_trials_df(self, read_csv_kwargs):
+        if not self.exists:
+            return None
+
+        #-- If some trials were deleted, only the non-deleted rows are parsed
+        with sessionjournal.open_live(self.trials_filename) as fp:
+            return pd.read_csv(fp, **read_csv_kwargs)
+
+    #-------------------------------------------------------------
+    def filenames(self, pattern='*'):
+        """ The names of the files in the directory that match the given (glob-style) pattern, sorted """
+        state = _file_state(self.dir_name)
+        if state != self._listing_state:
+            self._filenames = sorted(os.listdir(self.dir_name)) if state is not None else []
+            self._listing_state = state
+
+        return [fn for fn in self._filenames if fnmatch.fnmatchcase(fn, pattern)]
+
+    @property
+    def traj_files(self):
+        """ The names of the trajectory files in the directory """
+        return self.filenames('trajectory_*.csv')
+
+    #-------------------------------------------------------------
+    def _trials_file_state(self):
+        return _file_state(self.trials_filename), _file_state(sessionjournal.journal_path(self.dir_name))
+
+    #-------------------------------------------------------------
+    def trial_appended(self, row):
+        """
+        Update the index after a row was appended to trials.csv, without re-reading the file
+        """
+        if self._rows_state is None or self._rows_state[1] != _file_state(sessionjournal.journal_path(self.dir_name)):
+            return  # The index was not loaded or it's out of date: it will be reloaded when needed
+
+        if self._fieldnames is None:
+            self._fieldnames = tuple(row)
+
+        self._add_row({k: str(v) for k, v in row.items()}, None)
+        self._rows_state = self._trials_file_state()
+
+    def trial_deleted(self, trial_id, sub_trial_num=None):
+        """
+        Update the index after a trial (or all its sub-trials) was deleted in the session journal
+        """
+        if self._rows_state is None or self._rows_state[0] != _file_state(self.trials_filename):
+            return
+
+        sub_trials = self._sub_trials.get(trial_id, [])
+        for stn in list(sub_trials) if sub_trial_num is None else [sub_trial_num]:
+            if self._rows_by_key.pop((trial_id, stn), None) is not None:
+                sub_trials.remove(stn)
+        if len(sub_trials) == 0:
+            self._sub_trials.pop(trial_id, None)
+
+        self._rows_state = self._trials_file_state()
+
+
+#-------------------------------------------------------------------------------------------------
+def _parse_key(row, line_num, filename):
+    try:
+        return int(row['trial_id']), int(row['sub_trial_num'])
+    except (ValueError, TypeError):
+        location = filename if line_num is None else 'line {} in {}'.format(line_num, filename)
+        raise ValueError('Invalid trial_id/sub_trial_num in {}: "{}"/"{}"'.format(location, row['trial_id'], row['sub_trial_num']))
+
+
+def _file_state(filename):
+    if not os.path.exists(filename):
+        return None
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
@@ -0,0 +1,259 @@
+"""
+Journal of deleted trials in an encoded session.
+
+The encoder saves each trial by appending rows to the session's index files (trials.csv, strokes.csv,
+characters.csv). When a trial is deleted (or re-saved), its rows are not removed right away - rewriting the index
+files each time would make saving a trial O(session size). Instead, a tombstone is appended to the session's journal.
+The tombstone records the size of each index file at the time of deletion: it applies only to the trial's rows that
+were written before that point, so rows written later (when the trial is saved again) are not affected.
+
+Readers apply the tombstones in memory (see load_live_rows and open_live) and do not change the files.
+Compaction removes the deleted rows from the index files and removes the journal; it is done only by code that writes
+the session (e.g. when the encoder finishes a session, or when characters.csv is re-created). After compaction, the
+index files are regular CSV files again.
+"""
+import csv
+import io
+import os
+
+
+journal_filename = 'journal.csv'
+index_filenames = 'trials.csv', 'strokes.csv', 'characters.csv'
+
+_journal_cols = ('trial_id', 'sub_trial_num') + tuple('{}_size'.format(os.path.splitext(fn)[0]) for fn in index_filenames)
+
+
+#-------------------------------------------------------------------------------------------------
+class Tombstone(object):
+    """
+    Deletion of a trial (or one sub-trial) from the index files
+    """
+
+    def __init__(self, trial_id, sub_trial_num, file_sizes):
+        """
+        :param sub_trial_num: None = all sub-trials
+        :param file_sizes: The size of each index file (in index_filenames) when the trial was deleted
+        """
+        self.trial_id = trial_id
+        self.sub_trial_num = sub_trial_num
+        self.file_sizes = tuple(file_sizes)
+
+    def applies_to(self, trial_id, sub_trial_num):
+        return trial_id == self.trial_id and (self.sub_trial_num is None or sub_trial_num == self.sub_trial_num)
+
+
+#-------------------------------------------------------------------------------------------------
+def journal_path(dir_name):
+    return dir_name + os.sep + journal_filename
+
+
+#-------------------------------------------------------------------------------------------------
+def has_tombstones(dir_name):
+    return os.path.isfile(journal_path(dir_name))
+
+
+#-------------------------------------------------------------------------------------------------
+def add_tombstone(dir_name, trial_id, sub_trial_num=None):
+    """
+    Mark a trial (or, if sub_trial_num is specified, one sub-trial) as deleted from the session's index files
+    """
+    file_sizes = [_file_size(dir_name + os.sep + fn) for fn in index_filenames]
+
+    filename = journal_path(dir_name)
+    file_exists = os.path.isfile(filename)
+
+    with open(filename, 'a', encoding='utf-8') as fp:
+        writer = csv.writer(fp, lineterminator='\n')
+        if not file_exists:
+            writer.writerow(_journal_cols)
+        writer.writerow([trial_id, '' if sub_trial_num is None else sub_trial_num] + file_sizes)
+
+
+#-------------------------------------------------------------------------------------------------
+def load_tombstones(dir_name):
+    filename = journal_path(dir_name)
+    if not os.path.isfile(filename):
+        return []
+
+    with open(filename, 'r', encoding='utf-8') as fp:
+        reader = csv.DictReader(fp)
+        missing = [c for c in _journal_cols if c not in (reader.fieldnames or [])]
+        if len(missing) > 0:
+            raise ValueError('Invalid format of {}: missing columns ({})'.format(filename, ', '.join(missing)))
+
+        return [Tombstone(int(row['trial_id']),
+                          None if row['sub_trial_num'] == '' else int(row['sub_trial_num']),
+                          [int(row[c]) for c in _journal_cols[2:]])
+                for row in reader]
+
+
+#-------------------------------------------------------------------------------------------------
+def load_live_rows(dir_name, index_filename, tombstones=None):
+    """
+    Load an index file (one of index_filenames), without the rows deleted by tombstones.
+
+    :return: tuple: (field names, list of rows as dicts). If the file does not exist, return (None, [])
+    """
+    filename = dir_name + os.sep + index_filename
+    if not os.path.isfile(filename):
+        return None, []
+
+    if tombstones is None:
+        tombstones = load_tombstones(dir_name)
+    file_ind = index_filenames.index(index_filename)
+
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+
+    #-- The tombstones' offsets are always on row boundaries, so they split the file into segments of whole rows.
+    #-- A tombstone applies to the segments that end before its offset.
+    boundaries = sorted({t.file_sizes[file_ind] for t in tombstones if 0 < t.file_sizes[file_ind] < len(data)})
+    segment_starts = [0] + boundaries
+    segment_ends = boundaries + [len(data)]
+
+    fieldnames = None
+    segments = []
+    for start, end in zip(segment_starts, segment_ends):
+        segment = io.StringIO(data[start:end].decode('utf-8', errors='surrogateescape'), newline='')
+        reader = csv.DictReader(segment, fieldnames=fieldnames)
+        segments.append((end, list(reader)))
+        if fieldnames is None:
+            fieldnames = reader.fieldnames
+            if fieldnames is not None and len(tombstones) > 0 and ('trial_id' not in fieldnames or 'sub_trial_num' not in fieldnames):
+                raise ValueError('Invalid format of {}: expecting trial_id and sub_trial_num columns'.format(filename))
+
+    #-- Go over the segments from last to first: each segment is affected by the tombstones of the later segments,
+    #-- and by the tombstones recorded at its end
+    deleted_trials = set()          # trial_id, for tombstones of all sub-trials
+    deleted_sub_trials = set()      # (trial_id, sub_trial_num)
+    pending = sorted(tombstones, key=lambda t: t.file_sizes[file_ind])
+    live_segments = []
+    for end, segment_rows in reversed(segments):
+        while len(pending) > 0 and pending[-1].file_sizes[file_ind] >= end:
+            t = pending.pop()
+            if t.sub_trial_num is None:
+                deleted_trials.add(t.trial_id)
+            else:
+                deleted_sub_trials.add((t.trial_id, t.sub_trial_num))
+
+        if len(deleted_trials) == 0 and len(deleted_sub_trials) == 0:
+            live_segments.append(segment_rows)
+            continue
+
+        live_rows = []
+        for row in segment_rows:
+            try:
+                trial_id, sub_trial_num = int(row['trial_id']), int(row['sub_trial_num'])
+            except (ValueError, TypeError):
+                live_rows.append(row)   # No tombstone applies; invalid rows are reported by the code that parses them
+                continue
+            if trial_id not in deleted_trials and (trial_id, sub_trial_num) not in deleted_sub_trials:
+                live_rows.append(row)
+        live_segments.append(live_rows)
+
+    rows = [row for segment_rows in reversed(live_segments) for row in segment_rows]
+
+    return fieldnames, rows
+
+
+#-------------------------------------------------------------------------------------------------
+def has_live_rows(dir_name, index_filename, trial_id, sub_trial_num=None):
+    """
+    Whether an index file (one of index_filenames) has rows of the given trial (or sub-trial) that were not deleted
+    """
+    filename = dir_name + os.sep + index_filename
+    if not os.path.isfile(filename):
+        return False
+
+    is_deleted = Tombstone(trial_id, sub_trial_num, ()).applies_to
+
+    #-- Usually the trial has no rows at all, so first check the file without applying the tombstones
+    with open(filename, 'r', encoding='utf-8', errors='surrogateescape') as fp:
+        reader = csv.reader(fp)
+        fieldnames = next(reader, None)
+        if fieldnames is None or 'trial_id' not in fieldnames or 'sub_trial_num' not in fieldnames:
+            return False
+        key_inds = fieldnames.index('trial_id'), fieldnames.index('sub_trial_num')
+        has_rows = any(is_deleted(*key) for key in _row_keys(reader, key_inds))
+
+    if not has_rows or not has_tombstones(dir_name):
+        return has_rows
+
+    _, rows = load_live_rows(dir_name, index_filename)
+    return any(is_deleted(*key) for key in _row_keys(([row['trial_id'], row['sub_trial_num']] for row in rows), (0, 1)))
+
+
+def _row_keys(rows, key_inds):
+    """ The (trial_id, sub_trial_num) of each row; rows with invalid values are skipped """
+    for row in rows:
+        try:
+            yield int(row[key_inds[0]]), int(row[key_inds[1]])
+        except (ValueError, TypeError, IndexError):
+            continue
+
+
+#-------------------------------------------------------------------------------------------------
+def open_live(filename, encoding='utf-8', errors='surrogateescape'):
+    """
+    Open an index file for reading, without the rows deleted by tombstones. The file itself is not changed.
+    The result can be used like a file opened for reading (e.g., with csv.reader or pandas.read_csv).
+
+    :param filename: The full path of the file. Files that are not index files (see index_filenames) are opened as is.
+    :return: The open file if there are no tombstones; otherwise, a text stream (io.StringIO) with the live rows
+    """
+    dir_name, index_filename = os.path.split(filename)
+    if index_filename not in index_filenames or not has_tombstones(dir_name):
+        return open(filename, 'r', encoding=encoding, errors=errors)
+
+    if not os.path.isfile(filename):
+        raise FileNotFoundError('File not found: {}'.format(filename))
+
+    fieldnames, rows = load_live_rows(dir_name, index_filename)
+    result = io.StringIO(newline='')
+    _write_rows(result, fieldnames, rows)
+    result.seek(0)
+    return result
+
+
+#-------------------------------------------------------------------------------------------------
+def compact(dir_name):
+    """
+    Remove the deleted trials from the session's index files, and remove the journal.
+    Return True if the session had a journal.
+    """
+    if not has_tombstones(dir_name):
+        return False
+
+    tombstones = load_tombstones(dir_name)
+
+    #-- Write all the compacted files before replacing any of the index files
+    tmp_files = []
+    for index_filename in index_filenames:
+        fieldnames, rows = load_live_rows(dir_name, index_filename, tombstones)
+        if fieldnames is None:
+            continue
+
+        filename = dir_name + os.sep + index_filename
+        with open(filename + '.tmp', 'w', encoding='utf-8', errors='surrogateescape') as fp:
+            _write_rows(fp, fieldnames, rows)
+        tmp_files.append(filename)
+
+    for filename in tmp_files:
+        os.replace(filename + '.tmp', filename)
+
+    os.remove(journal_path(dir_name))
+
+    return True
+
+
+#-------------------------------------------------------------------------------------------------
+def _write_rows(fp, fieldnames, rows):
+    if fieldnames is None:
+        return
+    writer = csv.DictWriter(fp, fieldnames, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def _file_size(filename):
+    return os.path.getsize(filename) if os.path.isfile(filename) else 0
@@ -0,0 +1,158 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import writracker.analyze.preprocess.colgenerators as colgen
+
+
+def trial_response(row, ds_dir, subj_id, trial):
+    return trial['response']
+
+
+def char_x2(row):
+    return row['char_num'] * 2
+
+
+def vectorized_char_x2(df):
+    return df.char_num * 2
+
+
+def hidden_plus_1(row):
+    return row['__hidden'] + 1
+
+
+#===========================================================================================================
+class LazyRowsTests(unittest.TestCase):
+
+    #----------------------------------------------------------------
+    def test_rows_are_created_on_first_use(self):
+        rows = colgen._LazyRows(pd.DataFrame(dict(a=[1, 2])))
+        rows.set_column('__b', [10, 20])
+        rows.set_column('c', [5, 6])
+        self.assertIsNone(rows._rows)
+
+        self.assertEqual([dict(a=1, __b=10, c=5), dict(a=2, __b=20, c=6)], rows.rows)
+        rows.set_column('d', [7, 8])
+        self.assertEqual([7, 8], [r['d'] for r in rows.rows])
+
+    #----------------------------------------------------------------
+    def test_frame_includes_hidden_columns(self):
+        df = pd.DataFrame(dict(a=[1, 2]))
+        rows = colgen._LazyRows(df)
+        self.assertIs(df, rows.frame)
+
+        rows.set_column('__b', [10, 20])
+        self.assertEqual([10, 20], rows.frame['__b'].tolist())
+        self.assertNotIn('__b', df)
+
+
+#===========================================================================================================
+class GenerationScopeTests(unittest.TestCase):
+
+    def _generate(self, *generators):
+        chars_df = pd.DataFrame(dict(trial_id=[1, 1, 2], sub_trial_num=[1, 1, 1], char_num=[1, 2, 1]))
+        specs = [colgen.GeneratorSpec(colgen.GenerateFor.Chars, col_name, func, scope=scope) for col_name, func, scope in generators]
+        colgen.ColGeneratorsManager(specs).generate_custom_columns(pd.DataFrame(dict(trial_id=[1, 2], sub_trial_num=[1, 1])),
+                                                                  chars_df, colgen.Phase.DatasetLoaded)
+        return chars_df
+
+    #----------------------------------------------------------------
+    def test_vectorized_same_as_per_row(self):
+        chars_df = self._generate(('per_row', char_x2, None),
+                                  ('vectorized', vectorized_char_x2, colgen.GenerationScope.Vectorized))
+        self.assertEqual([2, 4, 2], chars_df.per_row.tolist())
+        self.assertEqual(chars_df.per_row.tolist(), chars_df.vectorized.tolist())
+
+    #----------------------------------------------------------------
+    def test_hidden_column(self):
+        chars_df = self._generate(('__hidden', char_x2, None), ('visible', hidden_plus_1, None))
+        self.assertEqual([3, 5, 3], chars_df.visible.tolist())
+        self.assertNotIn('__hidden', chars_df)
+
+    #----------------------------------------------------------------
+    def test_wrong_number_of_values(self):
+        self.assertRaisesRegex(ValueError, 'returned 2 values, expected 3',
+                               lambda: self._generate(('x', lambda df: [1, 2], colgen.GenerationScope.Vectorized)))
+
+
+#===========================================================================================================
+class TrialRowsIndexTests(unittest.TestCase):
+
+    def _generate(self, trials_df, chars_df, phase):
+        spec = colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'trial_response', trial_response, phase=phase)
+        colgen.ColGeneratorsManager([spec]).generate_custom_columns(trials_df, chars_df, phase)
+        return chars_df.trial_response.tolist()
+
+    #----------------------------------------------------------------
+    def test_split_trial(self):
+        trials_df = pd.DataFrame(dict(trial_id=[1, 2, 2], sub_trial_num=[1, 1, 2], response=['a', 'bc', 'de']))
+        chars_df = pd.DataFrame(dict(trial_id=[1, 2, 2, 2], sub_trial_num=[1, 2, 1, 2], char_num=[1, 1, 1, 2]))
+
+        self.assertEqual(['a', 'de', 'bc', 'de'], self._generate(trials_df, chars_df, colgen.Phase.DatasetLoaded))
+
+    #----------------------------------------------------------------
+    def test_several_subjects_and_blocks(self):
+        trials_df = pd.DataFrame(dict(subject=['A', 'A', 'B', 'B'], block=[1, 2, 1, 2], trial_id=[1, 1, 1, 1],
+                                      sub_trial_num=[1, 1, 1, 1], response=['a1', 'a2', 'b1', 'b2']))
+        chars_df = pd.DataFrame(dict(subject=['B', 'A', 'B', 'A'], block=[2, 2, 1, 1], trial_id=[1, 1, 1, 1],
+                                     sub_trial_num=[1, 1, 1, 1]))
+
+        self.assertEqual(['b2', 'a2', 'b1', 'a1'], self._generate(trials_df, chars_df, colgen.Phase.AllDatasetsLoaded))
+
+    #----------------------------------------------------------------
+    def test_missing_trial(self):
+        trials_df = pd.DataFrame(dict(subject=['A'], trial_id=[1], sub_trial_num=[1], response=['a']))
+        chars_df = pd.DataFrame(dict(subject=['B'], trial_id=[1], sub_trial_num=[1]))
+
+        with self.assertRaisesRegex(ValueError, 'subject=B, trial_id=1, sub_trial_num=1'):
+            self._generate(trials_df, chars_df, colgen.Phase.AllDatasetsLoaded)
+
+
+#===========================================================================================================
+class EliminateSpacesTests(unittest.TestCase):
+
+    #----------------------------------------------------------------
+    def test_vectorized_same_as_per_row(self):
+        df = pd.DataFrame(dict(response=['a b', 'C D ', float('nan'), '']))
+        for to_lower in False, True:
+            generator = colgen.EliminateSpaces('response', to_lower=to_lower)
+            self.assertEqual([generator(row) for row in df.to_dict('records')], list(generator.vectorized(df, None, None)))
+
+    #----------------------------------------------------------------
+    def test_non_string_values(self):
+        df = pd.DataFrame(dict(response=['a b', 12]))
+        generator = colgen.EliminateSpaces('response')
+        self.assertRaises(AttributeError, lambda: generator.vectorized(df, None, None))
+
+        generator = colgen.EliminateSpaces('response', nan_to_empty_string=False)
+        self.assertRaises(AttributeError, lambda: generator.vectorized(pd.DataFrame(dict(response=['a', None])), None, None))
+
+
+#===========================================================================================================
+class ZScoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame(dict(value=[1, 2, 3, np.nan, 10, 30], group=['a', 'a', 'a', 'a', 'b', 'b']))
+
+    #----------------------------------------------------------------
+    def test_per_group(self):
+        expected = [-np.sqrt(1.5), 0, np.sqrt(1.5), np.nan, -1, 1]
+        np.testing.assert_allclose(expected, colgen.compute_z_scores(self.df, 'value', 'group'))
+        np.testing.assert_allclose(expected, colgen.compute_z_scores(self.df, 'value', ['group']))
+
+    #----------------------------------------------------------------
+    def test_all_rows(self):
+        values = self.df.value.dropna()
+        expected = (self.df.value - values.mean()) / values.std(ddof=0)
+        np.testing.assert_allclose(expected, colgen.compute_z_scores(self.df, 'value'))
+
+    #----------------------------------------------------------------
+    def test_filter(self):
+        for filter_func in (lambda df: df.value < 10), (lambda df: [0, 1, 2]):
+            result = colgen.ZScoreColumn('value', filter_func=filter_func)(self.df, None, None)
+            np.testing.assert_allclose([-np.sqrt(1.5), 0, np.sqrt(1.5), np.nan, np.nan, np.nan], result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,418 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from writracker.encoder import dataio
+import writracker.analyze.preprocess.colgenerators as colgen
+import writracker.analyze.preprocess.merge as merge
+from encoder.dataio_tests import create_session
+
+
+pyarrow_available = importlib.util.find_spec('pyarrow') is not None
+
+
+#----------------------------------------------------------------
+def create_study(base_dir, n_subjects=2, n_blocks=2):
+    """
+    Create the encoded sessions of a study: each subject has a directory with one session per block
+
+    :return: dict: subject ID -> subject directory
+    """
+    subjects = {}
+    for subj_num in range(1, n_subjects + 1):
+        subj_dir = base_dir + os.sep + 'subj{}'.format(subj_num)
+        for block in range(1, n_blocks + 1):
+            dir_name = subj_dir + os.sep + 'ds_{}'.format(block)
+            os.makedirs(dir_name)
+            create_session(dir_name, n_trials=2 + subj_num)
+            _rename_traj_files(dir_name, time_offset=0.1 * block)
+            dataio.save_characters_file(dir_name)
+        subjects['s{}'.format(subj_num)] = subj_dir
+    return subjects
+
+
+def _rename_traj_files(dir_name, time_offset):
+    """
+    Use the trajectory file names that Merger expects (by default), and make the trials start at different times
+    (so the pre-trial delays are not all the same)
+    """
+    with open(dir_name + os.sep + 'trials.csv') as fp:
+        content = fp.read()
+
+    for filename in sorted(f for f in os.listdir(dir_name) if f.startswith('trajectory_')):
+        trial_id = int(filename[len('trajectory_'):-len('.csv')])
+        new_filename = 'trajectory_trial_{0}_target_{0}.csv'.format(trial_id)
+
+        with open(dir_name + os.sep + filename) as fp:
+            lines = fp.read().splitlines()
+        os.remove(dir_name + os.sep + filename)
+        with open(dir_name + os.sep + new_filename, 'w') as fp:
+            fp.write(lines[0] + '\n')
+            for line in lines[1:]:
+                values = line.split(',')
+                values[-1] = '{:.3f}'.format(float(values[-1]) + time_offset * trial_id)
+                fp.write(','.join(values) + '\n')
+
+        content = content.replace(',' + filename + ',', ',' + new_filename + ',')
+
+    with open(dir_name + os.sep + 'trials.csv', 'w') as fp:
+        fp.write(content)
+
+
+def find_sessions(subj_dir):
+    return merge.find_dataset_directories(subj_dir, 'ds', 'characters.csv', 2)
+
+
+def compile_generator(factor):
+    """ The same generator function, as if its code was edited between runs """
+    namespace = dict(__name__=__name__)
+    exec('def scaled_duration(row):\n    return row["duration"] * {}\n'.format(factor), namespace)
+    return namespace['scaled_duration']
+
+
+def compile_generator_class(factor):
+    """ The same generator class, as if the code of its helper method was edited between runs """
+    namespace = dict(__name__=__name__)
+    exec('class ScaledDuration(object):\n'
+         '    def __init__(self):\n'
+         '        self.col_name = "duration"\n'
+         '    def __call__(self, row):\n'
+         '        return self._scale(row[self.col_name])\n'
+         '    def _scale(self, value):\n'
+         '        return value * {}\n'.format(factor), namespace)
+    return namespace['ScaledDuration']
+
+
+def get_col(col_name):
+    return lambda row: row[col_name]
+
+
+class SlotsGenerator(object):
+    """ A generator whose identity cannot be determined (no attributes, default repr) """
+    __slots__ = ()
+
+    def __call__(self, row):
+        return 1
+
+
+#===========================================================================================================
+class MergeTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.subjects = create_study(self.dir_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _merge(self, new_cols=(), cache_dir=None, **kwargs):
+        new_cols = [colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'block', colgen.CopyColumnsFromTrialsToChars('block'))] + list(new_cols)
+        merger = merge.Merger(new_cols=new_cols, cache_dir=cache_dir)
+        chars_df = merger.merge_dataset(self.subjects, find_sessions, **kwargs)
+        return merger, chars_df
+
+
+#===========================================================================================================
+class ParallelMergeTests(MergeTestBase):
+
+    #----------------------------------------------------------------
+    def test_parallel_same_as_serial(self):
+        new_cols = [colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'response_nospaces', colgen.EliminateSpaces('response'))]
+        serial, serial_df = self._merge(new_cols)
+        parallel, parallel_df = self._merge(new_cols, workers=2)
+
+        self.assertEqual(2 * (3 + 4) * 2, serial_df.shape[0])
+        self.assertEqual(['s1', 's2'], sorted(serial_df.subject.unique()))
+        self.assertEqual(['1', '2'], sorted(serial_df.block.unique()))
+        pd.testing.assert_frame_equal(serial_df, parallel_df)
+        self.assertEqual(serial.merge_errors, parallel.merge_errors)
+        self.assertEqual([r.to_dict() for r in serial.validation_reports], [r.to_dict() for r in parallel.validation_reports])
+
+    #----------------------------------------------------------------
+    def test_unpicklable_generator_loads_serially(self):
+        spec = colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'copied', get_col('duration'))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            _, chars_df = self._merge([spec], workers=2)
+
+        self.assertIn('the sessions will be loaded serially', output.getvalue())
+        self.assertEqual(chars_df.duration.tolist(), chars_df.copied.tolist())
+
+    #----------------------------------------------------------------
+    def test_worker_errors_are_raised(self):
+        with open(self.subjects['s2'] + os.sep + 'ds_1' + os.sep + 'characters.csv', 'w') as fp:
+            fp.write('no_such_columns\n1\n')
+
+        self.assertRaisesRegex(AttributeError, 'trial_id', lambda: self._merge(workers=2))
+
+
+#===========================================================================================================
+class MergeCacheTests(MergeTestBase):
+
+    def _merge_with_output(self, **kwargs):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            merger, chars_df = self._merge(**kwargs)
+        return merger, chars_df, output.getvalue()
+
+    #----------------------------------------------------------------
+    def test_cached_same_as_uncached(self):
+        cache_dir = self.dir_name + os.sep + 'cache'
+        expected = self._merge_with_output()
+
+        for workers in None, None, 2:
+            merger, chars_df, output = self._merge_with_output(cache_dir=cache_dir, workers=workers)
+            pd.testing.assert_frame_equal(expected[1], chars_df)
+            self.assertEqual(expected[0].merge_errors, merger.merge_errors)
+            self.assertEqual([r.to_dict() for r in expected[0].validation_reports], [r.to_dict() for r in merger.validation_reports])
+            self.assertEqual(expected[2], output)
+
+        self.assertEqual(4, len([fn for fn in os.listdir(cache_dir) if fn.endswith('.json')]))
+
+    #----------------------------------------------------------------
+    def test_changed_session_is_reloaded(self):
+        cache_dir = self.dir_name + os.sep + 'cache'
+        self._merge(cache_dir=cache_dir)
+
+        dataio.delete_trial(self.subjects['s1'] + os.sep + 'ds_2', 1)
+        _, chars_df = self._merge(cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(self._merge()[1], chars_df)
+        self.assertEqual([2, 3], sorted(chars_df[(chars_df.subject == 's1') & (chars_df.block == '2')].trial_id.unique()))
+
+    #----------------------------------------------------------------
+    def test_cache_entries(self):
+        cache = merge.MergeCache(self.dir_name + os.sep + 'cache')
+        merger = merge.Merger(new_cols=[])
+        ds_dir = find_sessions(self.subjects['s1'])[0]
+        fingerprint = cache.fingerprint(merger, 's1', ds_dir)
+
+        self.assertIsNone(cache.load('s1', ds_dir, fingerprint))
+
+        trials_df = pd.DataFrame(dict(trial_id=[1, 2], rc=['OK', 'OK']), index=[3, 5])
+        chars_df = pd.DataFrame(dict(trial_id=[1], char=['a']))
+        cache.save('s1', ds_dir, fingerprint, trials_df, chars_df, dict(N_DUPLICATE_TRIALS=1), [], 'output\n')
+
+        loaded = cache.load('s1', ds_dir, fingerprint)
+        pd.testing.assert_frame_equal(trials_df, loaded[0])
+        pd.testing.assert_frame_equal(chars_df, loaded[1])
+        self.assertEqual((dict(N_DUPLICATE_TRIALS=1), [], 'output\n'), loaded[2:])
+
+        self.assertIsNone(cache.load('s1', ds_dir, fingerprint + 'x'))
+        self.assertIsNone(cache.load('s2', ds_dir, fingerprint))
+        self.assertNotEqual(fingerprint, cache.fingerprint(merge.Merger(new_cols=[], has_block_col=False), 's1', ds_dir))
+
+    #----------------------------------------------------------------
+    def test_changed_generator_invalidates_cache(self):
+        cache_dir = self.dir_name + os.sep + 'cache'
+        for factor in 2, 3:
+            spec = colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'duration_x', compile_generator(factor))
+            _, chars_df = self._merge([spec], cache_dir=cache_dir)
+            self.assertEqual((chars_df.duration * factor).tolist(), chars_df.duration_x.tolist())
+
+    #----------------------------------------------------------------
+    def test_changed_helper_method_invalidates_cache(self):
+        cache_dir = self.dir_name + os.sep + 'cache'
+        for factor in 2, 3:
+            spec = colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'duration_x', compile_generator_class(factor)())
+            _, chars_df = self._merge([spec], cache_dir=cache_dir)
+            self.assertEqual((chars_df.duration * factor).tolist(), chars_df.duration_x.tolist())
+
+    #----------------------------------------------------------------
+    def test_changed_trajectory_file_changes_fingerprint(self):
+        cache = merge.MergeCache(self.dir_name + os.sep + 'cache')
+        merger = merge.Merger(new_cols=[])
+        ds_dir = find_sessions(self.subjects['s1'])[0]
+        traj_filename = ds_dir.dir_name + os.sep + 'trajectory_trial_1_target_1.csv'
+
+        fingerprints = [cache.fingerprint(merger, 's1', ds_dir)]
+
+        with open(traj_filename, 'a') as fp:
+            fp.write('1,1,1,0,0,0,9.0\n')
+        fingerprints.append(cache.fingerprint(merger, 's1', ds_dir))
+
+        dataio.convert_trajectories_to_binary(ds_dir.dir_name)
+        fingerprints.append(cache.fingerprint(merger, 's1', ds_dir))
+
+        self.assertEqual(3, len(set(fingerprints)))
+        self.assertEqual(fingerprints[-1], cache.fingerprint(merger, 's1', ds_dir))
+
+    #----------------------------------------------------------------
+    def test_closure_values_are_in_fingerprint(self):
+        cache_dir = self.dir_name + os.sep + 'cache'
+        for col_name in 'duration', 'char_num':
+            spec = colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'copied', get_col(col_name))
+            _, chars_df = self._merge([spec], cache_dir=cache_dir)
+            self.assertEqual(chars_df[col_name].tolist(), chars_df.copied.tolist())
+
+    #----------------------------------------------------------------
+    def test_unknown_generator_is_not_cached(self):
+        cache_dir = self.dir_name + os.sep + 'cache'
+        spec = colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'one', SlotsGenerator())
+        _, chars_df = self._merge([spec], cache_dir=cache_dir)
+        self.assertEqual([1] * chars_df.shape[0], chars_df.one.tolist())
+        self.assertEqual([], os.listdir(cache_dir))
+
+
+#===========================================================================================================
+class SessionValidationTests(MergeTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.session_dir = self.subjects['s1'] + os.sep + 'ds_1'
+
+    #----------------------------------------------------------------
+    def test_duplicate_trials(self):
+        trials_df = pd.DataFrame(dict(trial_id=[1, 11, 2, 2, 2], sub_trial_num=[11, 1, 1, 1, 1], target_id=[1, 11, 2, 2, 2],
+                                      traj_file_name=['trajectory_trial_{}_target_{}.csv'.format(i, i) for i in (1, 11, 2, 2, 2)]))
+        report = merge.Merger(new_cols=[]).validate_session(self.session_dir, trials_df)
+
+        self.assertEqual([(2, 1)], report.duplicate_trials)
+        self.assertEqual(['trajectory_trial_11_target_11.csv'], report.missing_traj_files)
+        self.assertEqual([(1, 1, 1), (3, 1, 3)], sorted(report.missing_in_trials_csv))
+
+    #----------------------------------------------------------------
+    def test_valid_session(self):
+        report = merge.Merger(new_cols=[]).validate_session(self.session_dir)
+        self.assertTrue(report.ok)
+        self.assertEqual(dict(N_DUPLICATE_TRIALS=0, N_MISSING_TRAJ_FILES=0, N_MISSING_IN_TRIALS_CSV=0), report.error_counts())
+
+    #----------------------------------------------------------------
+    def test_missing_traj_file_is_reported(self):
+        os.remove(self.session_dir + os.sep + 'trajectory_trial_2_target_2.csv')
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            merger, chars_df = self._merge()
+
+        self.assertIn("trajectory files are missing for some trials: ['trajectory_trial_2_target_2.csv']", output.getvalue())
+        self.assertEqual(1, merger.merge_errors['N_MISSING_TRAJ_FILES'])
+        reports = [r for r in merger.validation_reports if not r.ok]
+        self.assertEqual([self.session_dir], [r.dir_name for r in reports])
+        self.assertEqual(['trajectory_trial_2_target_2.csv'], reports[0].missing_traj_files)
+
+    #----------------------------------------------------------------
+    def test_report_to_dict(self):
+        report = merge.SessionValidationReport('dir', [(np.int64(2), np.int64(1))], ['t.csv'], [(3, 1, np.int64(3))])
+        d = json.loads(json.dumps(report.to_dict()))
+        loaded = merge.SessionValidationReport.from_dict(d)
+
+        self.assertEqual([(2, 1)], loaded.duplicate_trials)
+        self.assertEqual(['t.csv'], loaded.missing_traj_files)
+        self.assertEqual([(3, 1, 3)], loaded.missing_in_trials_csv)
+        self.assertEqual(report.error_counts(), loaded.error_counts())
+        self.assertFalse(loaded.ok)
+
+
+#===========================================================================================================
+class MergedTrialsIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.trials_df = pd.DataFrame(dict(subject=['A', 'A', 'B', 'B'], trial_id=[1, 11, 1, 2], sub_trial_num=[1, 1, 1, 1],
+                                           rc=['OK', 'ERR', 'OK', 'OK']))
+        self.chars_df = pd.DataFrame(dict(subject=['B', 'A', 'A', 'B', 'B', 'A'], trial_id=[1, 11, 1, 1, 3, 1],
+                                          sub_trial_num=[1, 1, 1, 1, 1, 1], char_num=[2, 1, 1, 1, 1, 2],
+                                          delay=[0.2, 0.5, 0.1, 0.3, 0.4, 0.6]))
+        self.index = merge.MergedTrialsIndex(self.trials_df, self.chars_df, ['subject', 'trial_id', 'sub_trial_num'])
+
+    #----------------------------------------------------------------
+    def test_trials_to_chars(self):
+        rc = self.index.trials_to_chars(self.trials_df.rc)
+        self.assertEqual(['OK', 'ERR', 'OK', 'OK', 'OK'], [rc[i] for i in (0, 1, 2, 3, 5)])
+        self.assertTrue(pd.isnull(rc[4]))
+
+    #----------------------------------------------------------------
+    def test_chars_to_trials(self):
+        delay = self.index.chars_to_trials(self.chars_df.delay, self.chars_df.char_num == 1)
+        np.testing.assert_array_equal([0.1, 0.5, 0.3, np.nan], delay)
+
+    #----------------------------------------------------------------
+    def test_chars_to_chars(self):
+        delay = self.index.chars_to_chars(self.chars_df.delay, self.chars_df.char_num == 2)
+        np.testing.assert_array_equal([0.2, np.nan, 0.6, 0.2, np.nan, 0.6], delay)
+
+    #----------------------------------------------------------------
+    def test_adjacent_chars(self):
+        prev_rows, next_rows = self.index.adjacent_chars(self.chars_df.char_num)
+        self.assertEqual([3, -1, -1, -1, -1, 2], prev_rows.tolist())
+        self.assertEqual([-1, -1, 5, 0, -1, -1], next_rows.tolist())
+
+    #----------------------------------------------------------------
+    def test_empty(self):
+        index = merge.MergedTrialsIndex(self.trials_df.iloc[:0], self.chars_df, ['subject', 'trial_id', 'sub_trial_num'])
+        self.assertTrue(pd.isnull(index.trials_to_chars(self.trials_df.rc.iloc[:0])).all())
+
+
+#===========================================================================================================
+@unittest.skipUnless(pyarrow_available, 'pyarrow is not installed')
+class ColumnarOutputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    #----------------------------------------------------------------
+    def test_round_trip(self):
+        df = pd.DataFrame(dict(subject=['s1', 's1', 's2'], char=['a', 'b', 'a'], duration=[0.123456789, 1 / 3, float('nan')],
+                               trial_id=[1, 2, 11], mixed=['x', 1, None], numbers=[1, 2.5, None]))
+        df.numbers = df.numbers.astype(object)
+
+        for ext in '.parquet', '.feather', '.arrow':
+            filename = self.dir_name + os.sep + 'chars' + ext
+            merge.save_merged_data(df, filename)
+            loaded = merge.load_merged_data(filename)
+
+            self.assertEqual(list(df), list(loaded))
+            self.assertEqual('category', str(loaded.subject.dtype))
+            self.assertEqual(df.subject.tolist(), loaded.subject.tolist())
+            self.assertEqual(df.duration[:2].tolist(), loaded.duration[:2].tolist())
+            self.assertEqual(df.trial_id.tolist(), loaded.trial_id.tolist())
+            self.assertEqual(['x', '1'], loaded.mixed[:2].tolist())
+            self.assertTrue(pd.isnull(loaded.mixed[2]))
+            self.assertEqual([1, 2.5], loaded.numbers[:2].tolist())
+
+
+#===========================================================================================================
+class MergedDataFormatTests(MergeTestBase):
+
+    #----------------------------------------------------------------
+    def test_csv_output(self):
+        chars_fn = self.dir_name + os.sep + 'chars.csv'
+        trials_fn = self.dir_name + os.sep + 'trials.csv'
+        merger = merge.Merger(new_cols=[colgen.GeneratorSpec(colgen.GenerateFor.Chars, 'block', colgen.CopyColumnsFromTrialsToChars('block'))])
+        chars_df = merger.merge_dataset(self.subjects, find_sessions, out_chars_fn=[chars_fn], out_trials_fn=trials_fn)
+
+        loaded = merge.load_merged_data(chars_fn)
+        self.assertEqual(list(chars_df), list(loaded))
+        self.assertEqual(chars_df.shape[0], loaded.shape[0])
+        self.assertEqual(2 * (3 + 4), merge.load_merged_data(trials_fn).shape[0])
+
+    #----------------------------------------------------------------
+    @unittest.skipUnless(pyarrow_available, 'pyarrow is not installed')
+    def test_columnar_output(self):
+        chars_fn = self.dir_name + os.sep + 'chars.parquet'
+        _, chars_df = self._merge(out_chars_fn=[chars_fn, self.dir_name + os.sep + 'chars.feather'])
+
+        for filename in chars_fn, self.dir_name + os.sep + 'chars.feather':
+            loaded = merge.load_merged_data(filename)
+            self.assertEqual(list(chars_df), list(loaded))
+            self.assertEqual(chars_df.duration.tolist(), loaded.duration.tolist())
+
+    #----------------------------------------------------------------
+    @unittest.skipIf(pyarrow_available, 'pyarrow is installed')
+    def test_missing_engine_fails_before_merging(self):
+        with self.assertRaisesRegex(ImportError, 'pyarrow'):
+            self._merge(out_chars_fn=self.dir_name + os.sep + 'chars.feather')
+
+
+if __name__ == '__main__':
+    unittest.main()
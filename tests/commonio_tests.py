@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from writracker import commonio
+
+
+encoded_csv = '''char_num,stroke,pen_down,x,y,pressure,time
+1,1,1,100.0,200.5,37,0.125
+1,1,1,101.0,201.25,40,0.13
+0,2,0,150.0,190.0,0,0.5
+'''
+
+recorded_csv = '''x,y,pressure,time
+100,200,37,0.0
+101,201,40,0.0125
+'''
+
+on_paper_csv = '''x,y,pressure,time,on_paper
+100,200,37,0.0,1
+150,190,0,0.5,0
+'''
+
+
+#===========================================================================================================
+class BinaryTrajectoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _write(self, filename, content):
+        full_path = self.dir_name + os.sep + filename
+        with open(full_path, 'w') as fp:
+            fp.write(content)
+        return full_path
+
+    #----------------------------------------------------------------
+    def test_round_trip_keeps_columns_and_values(self):
+        for content in encoded_csv, recorded_csv, on_paper_csv:
+            csv_fn = self._write('trajectory_1.csv', content)
+            bin_fn = commonio.csv_to_binary_trajectory(csv_fn)
+            self.assertTrue(commonio.is_binary_trajectory_file(bin_fn))
+
+            #-- The values are the same, but not necessarily their text (e.g., "100.0" is restored as "100")
+            restored_fn = commonio.binary_to_csv_trajectory(bin_fn, self.dir_name + os.sep + 'restored.csv')
+            pd.testing.assert_frame_equal(pd.read_csv(csv_fn), pd.read_csv(restored_fn), check_dtype=False)
+
+    #----------------------------------------------------------------
+    def test_load_memory_mapped(self):
+        bin_fn = commonio.csv_to_binary_trajectory(self._write('trajectory_1.csv', encoded_csv))
+        records, columns = commonio.load_binary_trajectory(bin_fn, with_columns=True)
+
+        self.assertEqual(encoded_csv.split('\n')[0].split(','), columns)
+        self.assertEqual([1, 1, 2], records['stroke'].tolist())
+        self.assertEqual([200.5, 201.25, 190.0], records['y'].tolist())
+        self.assertFalse(records.flags.writeable)
+
+    #----------------------------------------------------------------
+    def test_unsupported_columns(self):
+        csv_fn = self._write('trajectory_1.csv', 'x,y,pressure,time,tilt\n100,200,37,0.0,5\n')
+        self.assertRaisesRegex(ValueError, 'unsupported columns \\(tilt\\)', lambda: commonio.csv_to_binary_trajectory(csv_fn))
+        self.assertFalse(os.path.isfile(commonio.binary_trajectory_filename(csv_fn)))
+
+    #----------------------------------------------------------------
+    def test_load_version_1(self):
+        v1_dtype = commonio._traj_binary_dtypes[1]
+        header = np.zeros(1, dtype=commonio.traj_binary_header_dtype)
+        header['magic'] = commonio.traj_binary_magic
+        header['version'] = 1
+        header['columns'] = sum(1 << commonio.traj_binary_columns.index(c) for c in ('x', 'y', 'pressure', 'time'))
+        header['n_records'] = 2
+        records = np.zeros(2, dtype=v1_dtype)
+        records['x'] = [100, 101]
+        records['time'] = [0.0, 0.0125]
+
+        bin_fn = self.dir_name + os.sep + 'trajectory_1.wtraj'
+        with open(bin_fn, 'wb') as fp:
+            fp.write(header.tobytes() + records.tobytes())
+
+        records, columns = commonio.load_binary_trajectory(bin_fn, with_columns=True)
+        self.assertEqual(['x', 'y', 'pressure', 'time'], columns)
+        self.assertEqual([100, 101], records['x'].tolist())
+        self.assertEqual([0.0, 0.0125], [p.t for p in commonio.load_trajectory(bin_fn)])
+
+    #----------------------------------------------------------------
+    def test_loader_prefers_newer_binary_file(self):
+        csv_fn = self._write('trajectory_1.csv', recorded_csv)
+        self.assertEqual(csv_fn, commonio.resolve_trajectory_file(csv_fn))
+
+        bin_fn = commonio.csv_to_binary_trajectory(csv_fn)
+        self.assertEqual(bin_fn, commonio.resolve_trajectory_file(csv_fn))
+        self.assertEqual([0.0, 0.0125], [p.t for p in commonio.load_trajectory(csv_fn)])
+
+        #-- The CSV file was modified after the conversion
+        os.utime(csv_fn, ns=(time.time_ns(), os.stat(bin_fn).st_mtime_ns + 1))
+        self.assertEqual(csv_fn, commonio.resolve_trajectory_file(csv_fn))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from writracker import commonio
+from writracker.encoder import charvalues, dataio, datatypes
+from encoder.dataio_tests import create_session
+
+
+#===========================================================================================================
+class BoundingBoxTests(unittest.TestCase):
+
+    #----------------------------------------------------------------
+    def test_intervals_of_several_segments(self):
+        values = np.array([5, 1, 2, 3, 100,   7,   10, 0, 1, 2, 3, 4, 50], dtype=float)
+        offsets = [0, 5, 5, 6, 13]
+
+        lo, hi = charvalues.find_intervals_containing(values, offsets, 0.8)
+
+        self.assertEqual([1, 7, 0], lo[[0, 2, 3]].tolist())
+        self.assertEqual([5, 7, 10], hi[[0, 2, 3]].tolist())
+        self.assertTrue(np.isnan(lo[1]))
+
+    #----------------------------------------------------------------
+    def test_ties_choose_middle_interval(self):
+        values = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+        self.assertEqual((3, 6), charvalues.find_interval_containing(values, 0.4))
+        self.assertEqual((3, 6), tuple(v[0] for v in charvalues.find_intervals_containing(values, [0, 10], 0.4)))
+
+    #----------------------------------------------------------------
+    def test_character_with_several_strokes(self):
+        strokes = [datatypes.Stroke(1, 1, True), datatypes.Stroke(1, 2, False), datatypes.Stroke(1, 3, True)]
+        strokes[0].trajectory = [commonio.TrajectoryPoint(x, 10, 1, 0) for x in (0, 1, 2)]
+        strokes[1].trajectory = [commonio.TrajectoryPoint(50, 50, 0, 0)]
+        strokes[2].trajectory = [commonio.TrajectoryPoint(x, 20, 1, 0) for x in (3, 4)]
+
+        bbox = charvalues.get_bounding_box(datatypes.Character(1, strokes))
+        self.assertEqual((0, 4, 10, 10), (bbox.xmin, bbox.width, bbox.ymin, bbox.height))
+
+    #----------------------------------------------------------------
+    def test_trial_bounding_boxes_are_cached(self):
+        dir_name = tempfile.mkdtemp()
+        try:
+            create_session(dir_name, n_trials=1)
+            for columnar in False, True:
+                trial = dataio.load_experiment(dir_name, columnar=columnar).trials[0]
+
+                boxes = charvalues.get_char_bounding_boxes(trial, 0.9, 0.9)
+                self.assertEqual([(charvalues.get_bounding_box(c, 0.9, 0.9).xmin, charvalues.get_bounding_box(c, 0.9, 0.9).width)
+                                  for c in trial.characters],
+                                 [(b.xmin, b.width) for b in boxes])
+                self.assertIs(boxes, charvalues.get_char_bounding_boxes(trial, 0.9, 0.9))
+
+                trial.mirror_in_place(x=True)
+                mirrored_box = charvalues.get_char_bounding_boxes(trial, 0.9, 0.9)[0]
+                self.assertLess(mirrored_box.xmin, 0)
+                self.assertEqual(charvalues.get_bounding_box(trial.characters[0], 0.9, 0.9).xmin, mirrored_box.xmin)
+        finally:
+            shutil.rmtree(dir_name)
+
+    #----------------------------------------------------------------
+    def test_cache_is_refreshed_after_edits(self):
+        dir_name = tempfile.mkdtemp()
+        try:
+            create_session(dir_name, n_trials=1)
+            for columnar in False, True:
+                trial = dataio.load_experiment(dir_name, columnar=columnar).trials[0]
+                char_bbox = charvalues.GetCharBoundingBox(columns=[charvalues.BBoxAttr.xmin, charvalues.BBoxAttr.width])
+                self.assertEqual((100, 9), char_bbox(trial, trial.characters[0]))
+                self.assertEqual((120, 9), char_bbox(trial, trial.characters[1]))
+
+                #-- Replace a stroke's trajectory
+                stroke = trial.characters[0].strokes[0]
+                stroke.trajectory = [commonio.TrajectoryPoint(pt.x - 50, pt.y, pt.z, pt.t) for pt in stroke.trajectory]
+                self.assertEqual((50, 9), char_bbox(trial, trial.characters[0]))
+                self.assertEqual(50, charvalues.get_stroke_bounding_boxes(trial)[0].xmin)
+
+                #-- Extend a trajectory in place, as manip.merge_strokes does
+                stroke.trajectory.extend(trial.characters[1].strokes[0].trajectory)
+                self.assertEqual((50, 79), char_bbox(trial, trial.characters[0]))
+
+                #-- Replace the characters
+                trial.characters = trial.characters[1:]
+                self.assertEqual((120, 9), char_bbox(trial, trial.characters[0]))
+                self.assertEqual(1, len(charvalues.get_char_bounding_boxes(trial)))
+        finally:
+            shutil.rmtree(dir_name)
+
+
+#===========================================================================================================
+class GenerateValuesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        create_session(self.dir_name, n_trials=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _generate(self, trials, value_generators, vectorized):
+        filename = self.dir_name + os.sep + 'chars_{}.csv'.format(vectorized)
+        charvalues.generate_char_level_custom_values(trials, value_generators, trial_filter=lambda t: t.trial_id != 2,
+                                                     out_filename=filename, vectorized=vectorized)
+        with open(filename) as fp:
+            return fp.read()
+
+    #----------------------------------------------------------------
+    def test_vectorized_same_as_per_character(self):
+        for columnar in False, True:
+            trials = dataio.load_experiment(self.dir_name, columnar=columnar).trials
+            expected = self._generate(trials, dataio._default_value_generators, False)
+            self.assertEqual(expected, self._generate(trials, dataio._default_value_generators, True))
+            self.assertEqual(4 * 2 + 1, expected.count('\n'))
+
+    #----------------------------------------------------------------
+    def test_generators_without_vectorized_form(self):
+        trials = dataio.load_experiment(self.dir_name).trials
+        value_generators = dataio._default_value_generators[:3] + \
+            (charvalues.ValueGenerator(lambda t, c, extra_values: extra_values['x'] + c.char_num, 'x_plus'),
+             charvalues.TrialLevelValueGenerator(lambda t: t.trial_id * 10, 'trial_x10'))
+
+        self.assertEqual(self._generate(trials, value_generators, False), self._generate(trials, value_generators, True))
+
+    #----------------------------------------------------------------
+    def test_schedule(self):
+        generators = dataio._default_value_generators
+        stages = charvalues.schedule_value_generators(generators)
+        self.assertEqual(sorted(map(id, generators)), sorted(id(g) for stage in stages for g in stage))
+        self.assertIn('x_norm', stages[1][0].out_fields)
+
+        stages = charvalues.schedule_value_generators(generators, ['pre_char_distance'])
+        self.assertEqual([['x', 'width', 'y', 'height'], ['pre_char_distance']], [list(s[0].out_fields) for s in stages])
+
+        self.assertRaises(ValueError, lambda: charvalues.schedule_value_generators(generators, ['no_such_field']))
+
+    #----------------------------------------------------------------
+    def test_columns_in_declared_order(self):
+        expected = 'trial_id,sub_trial_num,target_id,target,char_num,char,x,width,y,height,trial_width,x_norm,width_norm,' \
+                   'response,t0,duration,pre_char_delay,post_char_delay,pre_char_distance,post_char_distance,' \
+                   'pre_char_cdistance,post_char_cdistance,extends'
+        trials = dataio.load_experiment(self.dir_name).trials
+        for vectorized in False, True:
+            self.assertEqual(expected, self._generate(trials, dataio._default_value_generators, vectorized).split('\n')[0])
+
+        columns = charvalues.generate_char_level_columns(trials, dataio._default_value_generators, n_threads=4)
+        self.assertEqual(expected.split(','), list(columns))
+
+    #----------------------------------------------------------------
+    def test_required_fields_only(self):
+        trials = dataio.load_experiment(self.dir_name).trials
+        all_columns = charvalues.generate_char_level_columns(trials, dataio._default_value_generators, n_threads=1)
+        columns = charvalues.generate_char_level_columns(trials, dataio._default_value_generators, out_fields=['post_char_cdistance'])
+
+        self.assertNotIn('duration', columns)
+        self.assertEqual(all_columns['post_char_cdistance'], columns['post_char_cdistance'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,359 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from writracker import commonio
+from writracker import sessionjournal
+from writracker.encoder import dataio
+
+
+header = 'char_num,stroke,pen_down,x,y,pressure,time\n'
+
+
+#----------------------------------------------------------------
+def create_session(dir_name, n_trials=3):
+    """
+    Create the files of an encoded session: each trial has 2 characters, each with one on-paper stroke,
+    and space strokes between/after them
+    """
+    with open(dir_name + os.sep + 'trials.csv', 'w') as fp:
+        fp.write(','.join(dataio.trials_index_cols) + '\n')
+        for trial_id in range(1, n_trials + 1):
+            fp.write('{0},{0},1,ab,ab,{1},OK,0,trajectory_{0}.csv,10:00:00,01/01/2024,0\n'.format(trial_id, trial_id * 10))
+
+    with open(dir_name + os.sep + 'strokes.csv', 'w') as fp:
+        fp.write(','.join(dataio.strokes_cols) + '\n')
+        for trial_id in range(1, n_trials + 1):
+            for stroke_num, char_num, on_paper in (1, 1, 1), (2, 0, 0), (3, 2, 1), (4, 0, 0):
+                fp.write('{},1,{},{},{}\n'.format(trial_id, char_num, stroke_num, on_paper))
+
+    for trial_id in range(1, n_trials + 1):
+        with open(dir_name + os.sep + 'trajectory_{}.csv'.format(trial_id), 'w') as fp:
+            fp.write(header)
+            for i in range(40):
+                stroke_num = i // 10 + 1
+                char_num = (stroke_num + 1) // 2 if stroke_num % 2 == 1 else 0
+                pressure = 0 if stroke_num % 2 == 0 else 20 + i
+                fp.write('{},{},{},{},{},{},{:.3f}\n'.format(char_num, stroke_num, stroke_num % 2, 100 + i * trial_id,
+                                                             200 - i, pressure, i * 0.01))
+
+
+#===========================================================================================================
+class LoadTrajPointsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.filename = self.dir_name + os.sep + 'trajectory_1.csv'
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _write(self, rows):
+        with open(self.filename, 'w') as fp:
+            fp.write(header + ''.join(row + '\n' for row in rows))
+
+    def _as_tuples(self, points_per_stroke):
+        return {s: [(p.x, p.y, p.z, p.t) for p in points] for s, points in points_per_stroke.items()}
+
+    #----------------------------------------------------------------
+    def test_group_by_stroke(self):
+        self._write(['1,2,1,10,20,30,0.1', '1,1,1,11,21.5,31,0.2', '1,2,1,12,22,32,0.3', '0,3,0,13,23,0,0.4'])
+
+        result = dataio._load_traj_points(self.filename)
+
+        self.assertEqual([2, 1, 3], list(result.keys()))
+        self.assertEqual({2: [(10, 20, 30, 0.1), (12, 22, 32, 0.3)], 1: [(11, 21.5, 31, 0.2)], 3: [(13, 23, 0, 0.4)]},
+                         self._as_tuples(result))
+        self.assertEqual(self._as_tuples(dataio._load_traj_points_per_row(self.filename)), self._as_tuples(result))
+
+    #----------------------------------------------------------------
+    def test_invalid_value_reports_line(self):
+        self._write(['1,1,1,10,20,30,0.1', '1,1,1,11,abc,31,0.2'])
+
+        with self.assertRaisesRegex(ValueError, 'line 3 .* column y'):
+            dataio._load_traj_points(self.filename)
+
+    #----------------------------------------------------------------
+    def test_invalid_stroke_number(self):
+        self._write(['1,1,1,10,20,30,0.1', '1,1.5,1,11,21,31,0.2'])
+
+        with self.assertRaisesRegex(ValueError, 'stroke'):
+            dataio._load_traj_points(self.filename)
+
+
+
+#===========================================================================================================
+class LoadExperimentTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        create_session(self.dir_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _points(self, points):
+        return [(p.x, p.y, p.z, p.t) for p in points]
+
+    #----------------------------------------------------------------
+    def test_columnar_same_as_lists(self):
+        exp = dataio.load_experiment(self.dir_name)
+        col_exp = dataio.load_experiment(self.dir_name, columnar=True)
+
+        self.assertEqual(len(exp.trials), len(col_exp.trials))
+        for trial, col_trial in zip(exp.trials, col_exp.trials):
+            self.assertTrue(col_trial.is_columnar)
+            self.assertEqual(self._points(trial.traj_points), self._points(col_trial.traj_points))
+            self.assertEqual(self._points(trial.on_paper_points), self._points(col_trial.on_paper_points))
+            self.assertEqual(self._points(trial.on_paper_char_points), self._points(col_trial.on_paper_char_points))
+            for stroke, col_stroke in zip(trial.strokes, col_trial.strokes):
+                self.assertEqual(self._points(stroke), self._points(col_stroke))
+
+    #----------------------------------------------------------------
+    def test_columnar_points_are_writable(self):
+        trial = dataio.load_experiment(self.dir_name, columnar=True).trials[0]
+
+        trial.mirror_in_place(x=True)
+        trial.strokes[0].trajectory[0].t += 3600
+        self.assertEqual(-100, trial.traj_points[0].x)
+        self.assertEqual(3600, trial.points.t[0])
+
+        #-- Modifying a stroke's trajectory converts it to a list
+        stroke = trial.strokes[0]
+        stroke.trajectory.extend(trial.strokes[1].trajectory)
+        self.assertIsInstance(stroke.trajectory, list)
+        self.assertEqual(20, len(stroke.trajectory))
+        self.assertFalse(trial.is_columnar)
+        self.assertEqual(50, len(trial.traj_points))
+
+
+    #----------------------------------------------------------------
+    def test_parallel_same_as_serial(self):
+        for columnar in False, True:
+            exp = dataio.load_experiment([self.dir_name, self.dir_name], columnar=columnar)
+            par_exp = dataio.load_experiment([self.dir_name, self.dir_name], columnar=columnar, workers=2)
+
+            self.assertEqual([(t.block, t.trial_id) for t in exp.trials], [(t.block, t.trial_id) for t in par_exp.trials])
+            for trial, par_trial in zip(exp.trials, par_exp.trials):
+                self.assertEqual(columnar, par_trial.is_columnar)
+                self.assertEqual(self._points(trial.traj_points), self._points(par_trial.traj_points))
+                self.assertEqual([[s.stroke_num for s in c.strokes] for c in trial.characters],
+                                 [[s.stroke_num for s in c.strokes] for c in par_trial.characters])
+
+    #----------------------------------------------------------------
+    def test_lazy_same_as_eager(self):
+        for columnar in False, True:
+            exp = dataio.load_experiment(self.dir_name, columnar=columnar)
+            lazy_exp = dataio.load_experiment(self.dir_name, columnar=columnar, lazy=True, max_loaded_trials=2)
+
+            self.assertEqual(len(exp.trials), len(lazy_exp.trials))
+            for trial, lazy_trial in zip(exp.trials, lazy_exp.trials):
+                self.assertEqual(columnar, lazy_trial.is_columnar)
+                self.assertEqual(self._points(trial.traj_points), self._points(lazy_trial.traj_points))
+                self.assertEqual([c.duration for c in trial.characters], [c.duration for c in lazy_trial.characters])
+
+    #----------------------------------------------------------------
+    def test_lazy_loads_on_access(self):
+        exp = dataio.load_experiment(self.dir_name, lazy=True, max_loaded_trials=1)
+        os.remove(self.dir_name + os.sep + 'trajectory_3.csv')
+
+        trial1, trial2 = exp.trials[:2]
+        self.assertEqual(40, len(trial1.traj_points))
+        trial1.mirror_in_place(x=True)
+        self.assertEqual(-100, trial1.traj_points[0].x)
+
+        #-- Loading another trial unloads trial #1; it is re-loaded from the file
+        self.assertEqual(40, len(trial2.traj_points))
+        self.assertEqual(0, len(trial1.strokes[0]._trajectory))
+        self.assertEqual(100, trial1.traj_points[0].x)
+
+        with self.assertRaises(FileNotFoundError):
+            exp.trials[2].traj_points
+
+    #----------------------------------------------------------------
+    def test_lazy_reports_missing_trajectories(self):
+        with open(self.dir_name + os.sep + 'trajectory_2.csv', 'w') as fp:
+            fp.write(header)
+        self.assertEqual([1, 3], [t.trial_id for t in dataio.load_experiment(self.dir_name).trials])
+
+        exp = dataio.load_experiment(self.dir_name, lazy=True)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(0, len(exp.trials[1].traj_points))
+        self.assertIn('the trajectory of trial #2 (sub-trial=1) could not be loaded', output.getvalue())
+
+        os.remove(self.dir_name + os.sep + 'trajectory_2.csv')
+        with self.assertRaisesRegex(FileNotFoundError, 'trajectory_2.csv'):
+            dataio.load_experiment(self.dir_name, lazy=True)
+
+    #----------------------------------------------------------------
+    def test_parallel_reports_errors(self):
+        with open(self.dir_name + os.sep + 'trajectory_2.csv', 'a') as fp:
+            fp.write('1,1,1,abc,0,0,0\n')
+
+        with self.assertRaisesRegex(ValueError, 'trajectory_2.csv'):
+            dataio.load_experiment(self.dir_name, workers=2)
+
+
+#===========================================================================================================
+class DeleteTrialTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        create_session(self.dir_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _read(self, filename):
+        with open(self.dir_name + os.sep + filename) as fp:
+            return fp.read()
+
+    #----------------------------------------------------------------
+    def test_delete_does_not_rewrite_index_files(self):
+        trials_csv = self._read('trials.csv')
+
+        dataio.delete_trial(self.dir_name, 2)
+
+        self.assertEqual(trials_csv, self._read('trials.csv'))
+        self.assertFalse(os.path.isfile(self.dir_name + os.sep + 'trajectory_2.csv'))
+        self.assertEqual([], dataio.traj_filenames(dataio.trial_index_filename(self.dir_name), 2))
+
+        strokes_csv = self._read('strokes.csv')
+        exp = dataio.load_experiment(self.dir_name)
+        self.assertEqual([1, 3], [t.trial_id for t in exp.trials])
+        self.assertEqual([1, 3], dataio.load_coded_trials_nums(self.dir_name))
+        self.assertTrue(sessionjournal.has_tombstones(self.dir_name))
+        self.assertEqual(trials_csv, self._read('trials.csv'))
+        self.assertEqual(strokes_csv, self._read('strokes.csv'))
+
+        dataio.compact_session(self.dir_name)
+        self.assertFalse(sessionjournal.has_tombstones(self.dir_name))
+        self.assertNotIn('trajectory_2.csv', self._read('trials.csv'))
+
+    #----------------------------------------------------------------
+    def test_delete_trial_without_trials_row(self):
+        with open(self.dir_name + os.sep + 'strokes.csv', 'a') as fp:
+            fp.write('9,1,1,1,1\n')
+
+        dataio.delete_trial(self.dir_name, 9)
+        dataio.compact_session(self.dir_name)
+
+        self.assertNotIn('\n9,', self._read('strokes.csv'))
+        self.assertEqual([1, 2, 3], [t.trial_id for t in dataio.load_experiment(self.dir_name).trials])
+
+    #----------------------------------------------------------------
+    def test_delete_trial_without_rows(self):
+        dataio.delete_trial(self.dir_name, 9)
+        self.assertFalse(sessionjournal.has_tombstones(self.dir_name))
+
+        for _ in range(3):
+            dataio.append_to_trial_index(self.dir_name, 9, 1, 9, 'ab', 'ab', 90, 'OK', 0, 'trajectory_9.csv', '10:00:00', '01/01/2024', 0)
+        self.assertEqual(2, len(sessionjournal.load_tombstones(self.dir_name)))
+
+    #----------------------------------------------------------------
+    def test_rewrite_strokes_after_delete(self):
+        self._resave_trial(1)
+        exp = dataio.load_experiment(self.dir_name)
+        self.assertEqual([2, 3, 1], [t.trial_id for t in exp.trials])
+
+        dataio.save_strokes_file(exp.trials, self.dir_name)
+
+        self.assertFalse(sessionjournal.has_tombstones(self.dir_name))
+        self.assertEqual([2, 3, 1], [t.trial_id for t in dataio.load_experiment(self.dir_name).trials])
+
+    #----------------------------------------------------------------
+    def test_error_location_after_delete(self):
+        with open(self.dir_name + os.sep + 'trials.csv', 'a') as fp:
+            fp.write('4,4,x,ab,ab,40,OK,0,trajectory_4.csv,10:00:00,01/01/2024,0\n')
+        with self.assertRaisesRegex(ValueError, 'line 5 in trials.csv'):
+            dataio._load_trials_index(self.dir_name)
+
+        sessionjournal.add_tombstone(self.dir_name, 1)
+        with self.assertRaisesRegex(ValueError, 'in trials.csv') as cm:
+            dataio._load_trials_index(self.dir_name)
+        self.assertNotIn('line', str(cm.exception))
+
+    def _resave_trial(self, trial_id):
+        """ Save a trial again, as the encoder does (delete, then append) """
+        shutil.copy(self.dir_name + os.sep + 'trajectory_{}.csv'.format(trial_id), self.dir_name + os.sep + 'new_traj.csv')
+
+        dataio.append_to_trial_index(self.dir_name, trial_id, 1, trial_id, 'ab', 'ab', 20, 'OK', 0, 'trajectory_{}_new.csv'.format(trial_id),
+                                     '10:00:00', '01/01/2024', 0)
+        os.rename(self.dir_name + os.sep + 'new_traj.csv', self.dir_name + os.sep + 'trajectory_{}_new.csv'.format(trial_id))
+        with open(self.dir_name + os.sep + 'strokes.csv', 'a') as fp:
+            for stroke_num, char_num, on_paper in (1, 1, 1), (2, 0, 0), (3, 2, 1), (4, 0, 0):
+                fp.write('{},1,{},{},{}\n'.format(trial_id, char_num, stroke_num, on_paper))
+
+    #----------------------------------------------------------------
+    def test_resave_after_delete(self):
+        self._resave_trial(2)
+
+        self.assertEqual(['trajectory_2_new.csv'], dataio.traj_filenames(dataio.trial_index_filename(self.dir_name), 2))
+
+        dataio.compact_session(self.dir_name)
+        self.assertFalse(sessionjournal.has_tombstones(self.dir_name))
+        self.assertEqual(3, self._read('trials.csv').count('\n') - 1)
+        self.assertEqual(12, self._read('strokes.csv').count('\n') - 1)
+
+        exp = dataio.load_experiment(self.dir_name)
+        self.assertEqual([(1, 'trajectory_1.csv'), (3, 'trajectory_3.csv'), (2, 'trajectory_2_new.csv')],
+                         [(t.trial_id, t.traj_file_name) for t in exp.trials])
+
+
+#===========================================================================================================
+class SaveCharactersFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        create_session(self.dir_name, n_trials=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _read(self, filename):
+        with open(self.dir_name + os.sep + filename) as fp:
+            return fp.read()
+
+    #----------------------------------------------------------------
+    def test_only_changed_trials_are_recomputed(self):
+        self.assertEqual(4, dataio.save_characters_file(self.dir_name))
+        self.assertEqual(0, dataio.save_characters_file(self.dir_name))
+
+        traj = self._read('trajectory_3.csv')
+        with open(self.dir_name + os.sep + 'trajectory_3.csv', 'w') as fp:
+            fp.write(traj.replace(',200,', ',2600,'))
+        dataio.delete_trial(self.dir_name, 1)
+
+        self.assertEqual(1, dataio.save_characters_file(self.dir_name))
+        incremental = self._read('characters.csv')
+
+        self.assertEqual(3, dataio.save_characters_file(self.dir_name, incremental=False))
+        self.assertEqual(self._read('characters.csv'), incremental)
+        self.assertEqual(3 * 2 + 1, incremental.count('\n'))
+
+    #----------------------------------------------------------------
+    def test_changed_binary_trajectory_is_recomputed(self):
+        self.assertEqual(4, dataio.save_characters_file(self.dir_name))
+        before = self._read('characters.csv')
+
+        #-- A binary version of trajectory_3.csv, with different values, is loaded instead of the CSV file
+        edited_filename = self.dir_name + os.sep + 'edited.csv'
+        with open(edited_filename, 'w') as fp:
+            fp.write(self._read('trajectory_3.csv').replace('\n1,1,1,', '\n1,1,1,5'))
+        commonio.csv_to_binary_trajectory(edited_filename, commonio.binary_trajectory_filename(self.dir_name + os.sep + 'trajectory_3.csv'))
+        os.remove(edited_filename)
+
+        self.assertEqual(1, dataio.save_characters_file(self.dir_name))
+        incremental = self._read('characters.csv')
+        self.assertNotEqual(before, incremental)
+
+        self.assertEqual(4, dataio.save_characters_file(self.dir_name, incremental=False))
+        self.assertEqual(self._read('characters.csv'), incremental)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from writracker.recorder.dataio import Trajectory, TrajectoryWriter
+
+
+#===========================================================================================================
+class TrajectoryWriterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _read_lines(self, filename):
+        with open(filename, 'r', encoding='utf-8') as fp:
+            return fp.read().splitlines()
+
+    #----------------------------------------------------------------
+    def test_rows_are_written_on_close(self):
+        traj = Trajectory('trajectory_1.csv', self.dir_name)
+        traj.open()
+        traj.add_rows([(1, 2, 30, 0.0), (3, 4, 50, 0.01)])
+        traj.add_rows([(5, 6, 0, 0.02)])
+        traj.close()
+
+        self.assertEqual(['x,y,pressure,time', '1,2,30,0.0', '3,4,50,0.01', '5,6,0,0.02'], self._read_lines(traj.full_path))
+        self.assertFalse(traj.is_open)
+
+    #----------------------------------------------------------------
+    def test_reopening_appends_without_header(self):
+        traj = Trajectory('trajectory_1.csv', self.dir_name)
+        traj.open()
+        traj.add_rows([(1, 2, 30, 0.0)])
+        traj.close()
+        traj.add_rows([(3, 4, 50, 0.01)])
+        traj.close()
+
+        self.assertEqual(['x,y,pressure,time', '1,2,30,0.0', '3,4,50,0.01'], self._read_lines(traj.full_path))
+
+    #----------------------------------------------------------------
+    def test_rows_are_saved_within_max_unsaved_time(self):
+        filename = self.dir_name + os.sep + 'trajectory_1.csv'
+        writer = TrajectoryWriter(filename, max_unsaved_ms=20)
+        writer.start()
+        writer.add_rows([(1, 2, 30, 0.0)])
+
+        time.sleep(0.5)
+        self.assertEqual(['x,y,pressure,time', '1,2,30,0.0'], self._read_lines(filename))
+
+        writer.close()
+
+    #----------------------------------------------------------------
+    def test_rows_are_saved_when_buffer_is_full(self):
+        filename = self.dir_name + os.sep + 'trajectory_1.csv'
+        writer = TrajectoryWriter(filename, max_unsaved_ms=60000, max_buffered_rows=2)
+        writer.start()
+        writer.add_rows([(1, 2, 30, 0.0), (3, 4, 50, 0.01)])
+
+        time.sleep(0.5)
+        self.assertEqual(3, len(self._read_lines(filename)))
+
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
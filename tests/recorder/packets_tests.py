@@ -0,0 +1,76 @@
+import unittest
+
+import numpy as np
+
+from writracker.recorder import packets
+
+
+packet_dtype = np.dtype([('pkX', np.uint32), ('pkY', np.uint32), ('pkNormalPressure', np.uint32)])
+
+
+def legacy_samples(pkts, pen_x, pen_y, pen_pressure):
+    """ The trajectory rows written by the per-packet loop of older versions of MainWindow.tabletPoll() """
+    rows = []
+    for pkt in pkts:
+        if pkt['pkX'] == 0 and pkt['pkY'] == 0:
+            break
+        if pen_x == pkt['pkX'] and pen_y == pkt['pkY']:
+            continue
+        pen_x, pen_y = int(pkt['pkX']), int(pkt['pkY'])
+        new_pressure = int(pkt['pkNormalPressure'] / 327.67)
+        if pen_pressure > 0 and new_pressure == 0:
+            rows.append((pen_x, pen_y, 0))
+        pen_pressure = new_pressure
+        rows.append((pen_x, pen_y, pen_pressure))
+    return rows, (pen_x, pen_y, pen_pressure)
+
+
+#===========================================================================================================
+class ProcessPacketsTests(unittest.TestCase):
+
+    def test_same_rows_as_per_packet_loop(self):
+        rng = np.random.default_rng(1)
+        pkts = np.zeros(100, dtype=packet_dtype)
+        pkts['pkX'] = 1000 + rng.integers(0, 3, 100)
+        pkts['pkY'] = 700 + rng.integers(0, 3, 100)
+        pkts['pkNormalPressure'] = rng.choice([0, 0, 5000, 20000], 100)
+        pkts[90:] = 0
+
+        batch = packets.process_packets(pkts, 1000, 700, 10)
+        rows = [(x, y, p) for x, y, p, t in batch.trajectory_rows(0.5)]
+        expected_rows, expected_last = legacy_samples(pkts, 1000, 700, 10)
+
+        self.assertEqual(expected_rows, rows)
+        self.assertEqual(expected_last, batch.last_sample)
+
+    def test_press_and_release(self):
+        pkts = np.array([(1, 1, 0), (2, 2, 10000), (3, 3, 10000), (4, 4, 0)], dtype=packet_dtype)
+        batch = packets.process_packets(pkts, 0, 0, 0)
+
+        self.assertEqual([False, True, False, False], batch.press.tolist())
+        self.assertEqual([False, False, True, False], batch.move.tolist())
+        self.assertEqual([False, False, False, True], batch.release.tolist())
+
+    def test_times_increase_within_batch(self):
+        pkts = np.zeros(100, dtype=packet_dtype)
+        pkts['pkX'] = 1000 + np.arange(100)
+        pkts['pkY'] = 700
+        pkts['pkNormalPressure'] = np.where(np.arange(100) % 10 == 9, 0, 10000)
+        batch = packets.process_packets(pkts, 0, 0, 0)
+
+        times = [t for x, y, p, t in batch.trajectory_rows(1.5, 1.0)]
+        self.assertEqual(1.5, times[-1])
+        self.assertTrue(all(t1 > t0 for t0, t1 in zip([1.0] + times[:-1], times)))
+
+        #-- A too-short interval: the times still increase in the file's resolution
+        times = [t for x, y, p, t in batch.trajectory_rows(1.0001, 1.0)]
+        self.assertTrue(all(t1 > t0 for t0, t1 in zip([1.0] + times[:-1], times)))
+
+    def test_zero_packet_ends_batch(self):
+        pkts = np.array([(0, 0, 0), (2, 2, 10000)], dtype=packet_dtype)
+        batch = packets.process_packets(pkts, 5, 5, 0)
+        self.assertEqual(0, batch.n_samples)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from writracker.recorder import packetsource, packets
+
+
+#===========================================================================================================
+class ReplayPacketSourceTests(unittest.TestCase):
+
+    def test_packets_become_available_by_time(self):
+        source = packetsource.ReplayPacketSource([1, 2, 3], [1, 2, 3], [0, 10, 20], [0, 0.5, 100])
+        source.start_time = time.perf_counter() - 1
+
+        pkts = source.get_packets()
+        self.assertEqual([1, 2], pkts['pkX'].tolist())
+        self.assertEqual([0, 10], (pkts['pkNormalPressure'] / packets.pressure_scale).astype(int).tolist())
+        self.assertFalse(source.finished)
+
+    def test_full_queue_drops_packets(self):
+        n = 500
+        source = packetsource.ReplayPacketSource(range(1, n + 1), [1] * n, [10] * n, [0] * n, queue_size=150)
+
+        self.assertEqual(100, len(source.get_packets()))
+        self.assertEqual(50, len(source.get_packets()))
+        self.assertEqual(0, len(source.get_packets()))
+        self.assertEqual(150, source.n_delivered)
+        self.assertEqual(350, source.n_dropped)
+        self.assertTrue(source.finished)
+
+
+#===========================================================================================================
+class HeadlessRecorderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_replay_synthetic_handwriting(self):
+        from writracker.recorder import simulator
+
+        source = packetsource.SyntheticHandwritingSource(n_strokes=3, speed=10)
+        results = simulator.run_headless(source, results_folder=self.dir_name, poll_time=10, timeout=30)
+
+        self.assertEqual(source.n_packets, results.n_delivered)
+        self.assertEqual(0, results.n_dropped)
+
+        traj = pd.read_csv(self.dir_name + os.sep + 'trajectory_replay.csv')
+        expected_rows = packets.process_packets(source.packets, 0, 0, 0).trajectory_rows(0)
+        self.assertEqual([row[:3] for row in expected_rows], list(zip(traj.x, traj.y, traj.pressure)))
+        self.assertTrue((traj.time.diff().dropna() > 0).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from writracker import sessionindex, sessionjournal
+
+
+trials_csv = '''trial_id,sub_trial_num,rc,traj_file_name
+1,1,OK,trajectory_1.csv
+2,1,OK,trajectory_2.csv
+2,2,OK,trajectory_2_part2.csv
+'''
+
+
+#===========================================================================================================
+class SessionIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        with open(self.dir_name + os.sep + 'trials.csv', 'w') as fp:
+            fp.write(trials_csv)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _append(self, line):
+        with open(self.dir_name + os.sep + 'trials.csv', 'a') as fp:
+            fp.write(line + '\n')
+
+    #----------------------------------------------------------------
+    def test_lookup(self):
+        index = sessionindex.get(self.dir_name)
+
+        self.assertEqual([(1, 1), (2, 1), (2, 2)], index.trial_keys)
+        self.assertEqual(['trajectory_2.csv', 'trajectory_2_part2.csv'], index.traj_file_names(2))
+        self.assertEqual(['trajectory_2_part2.csv'], index.traj_file_names(2, 2))
+        self.assertEqual([], index.traj_file_names(3))
+        self.assertEqual([1, 2, 2], list(index.trials_df().trial_id))
+
+    #----------------------------------------------------------------
+    def test_reloaded_when_files_change(self):
+        index = sessionindex.get(self.dir_name)
+        self.assertEqual(3, len(index.trial_keys))
+        self.assertEqual([], index.traj_files)
+
+        self._append('3,1,OK,trajectory_3.csv')
+        open(self.dir_name + os.sep + 'trajectory_3.csv', 'w').close()
+        self.assertEqual([1, 2, 3], sorted({k[0] for k in index.trial_keys}))
+        self.assertEqual(4, len(index.trials_df()))
+        self.assertEqual(['trajectory_3.csv'], index.traj_files)
+
+        sessionjournal.add_tombstone(self.dir_name, 2)
+        self.assertEqual([(1, 1), (3, 1)], index.trial_keys)
+        self.assertEqual([1, 3], list(index.trials_df().trial_id))
+
+    #----------------------------------------------------------------
+    def test_incremental_update(self):
+        index = sessionindex.get(self.dir_name)
+        index.trial_keys
+
+        sessionjournal.add_tombstone(self.dir_name, 2, 1)
+        index.trial_deleted(2, 1)
+        self._append('2,1,OK,trajectory_2_new.csv')
+        index.trial_appended(dict(trial_id=2, sub_trial_num=1, rc='OK', traj_file_name='trajectory_2_new.csv'))
+
+        self.assertEqual(['trajectory_2_part2.csv', 'trajectory_2_new.csv'], index.traj_file_names(2))
+        self.assertEqual(index.trial_keys, sessionindex.SessionIndex(self.dir_name).trial_keys)
+
+
+if __name__ == '__main__':
+    unittest.main()